@@ -92,16 +92,18 @@ class StudentStatCalc:
     def get_mastery(self, stus, mastery_thres=0.9):
         val = list(stus['skills'].iloc[0].values())[0] # Arbitrary skill parameter
         is_not_binary = (type(val) == int) or (type(val) == float)
+        # Students x kcs array of skills, aligned by kc id
+        skills = pd.DataFrame(list(stus['skills']), index=stus.index).to_numpy(dtype=float)
         if is_not_binary:
             # Continuous skill
             out = pd.DataFrame(index=stus.index, columns=['total mastery', 'total skill'])
-            out['total mastery'] = stus.apply(lambda x: np.sum([1 if d >= mastery_thres else 0 for d in list(x['skills'].values())]), axis=1)
-            out['total skill'] = stus.apply(lambda x: np.sum(list(x['skills'].values())), axis=1)
+            out['total mastery'] = np.count_nonzero(skills >= mastery_thres, axis=1)
+            out['total skill'] = skills.sum(axis=1)
         else:
             # Binary skill
             logger.warning("************* type is binary skills ***********")
             out = pd.DataFrame(index=stus.index, columns=['total mastery'])
-            out['total mastery'] = stus.apply(lambda x: np.sum(list(x['skills'].values())), axis=1)
+            out['total mastery'] = skills.sum(axis=1)
             
 
         return out
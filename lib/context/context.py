@@ -6,11 +6,17 @@ from tutor.action import *
 
 class Context:
 
+    __slots__ = ()
+
     def get_actions(self):
         pass
 
 
 class SimpleTutorContext(Context):
+    # Slotted since a context is built for every simulated step
+
+    __slots__ = ('tutor_state', 'cur_problem', 'cur_step', 'hints_avail', 'hints_used', 'kc',
+                 'attempt', 'learner_state', 'learner_off_task', 'learner_kc_knowledge', 'time')
 
     def __init__(self, tutor_state, learner_state, time):
 
@@ -40,6 +46,7 @@ class SimpleTutorContext(Context):
 
 class ClassSessionContext(SimpleTutorContext):
 
+    __slots__ = ('session',)
 
     def __init__(self, tutor_state, learner_state, session, time):
         super().__init__(tutor_state, learner_state, time)
@@ -9,6 +9,9 @@ import copy
 
 from log_db import mongo
 from log_db.domain_mapper import DBDomainMapper
+from sampling.rng import make_stream
+from tutor.kc_index import KCIndex, KCArray
+from sampling.truncnorm import truncnorm
 
 from tutor.action import *
 from tutor.feedback import *
@@ -18,10 +21,14 @@ logger = logging.getLogger(__name__)
 
 class Cognition:
 
-    def __init__(self, domain):
+    # Type of the skill values held in the skills array
+    skill_dtype = float
+
+    def __init__(self, domain, rng=None):
         self.domain_id = domain._id
         self.type = type(self).__name__
-        self.skills = {}
+        self.rng = make_stream(rng)
+        self.skills = KCArray(domain.get_kc_index(), dtype=self.skill_dtype)
         self.init_skills(domain)
         logger.debug(f"Init {self.type} module")
 
@@ -38,13 +45,32 @@ class Cognition:
         pass
 
     def to_dict(self):
-        d = copy.deepcopy(self.__dict__)
+        d = {k: v for k, v in self.__dict__.items() if k not in ('rng', 'skills')}
+        d = copy.deepcopy(d)
+        d['skills'] = dict(self.skills.items())
         return d
 
     def update_with_dict(self, d):
         self.domain_id = d['domain_id']
         self.type = d['type']
-        self.skills = d['skills']
+        self.skills = KCArray.from_dict(KCIndex.from_ids(d['skills'].keys()), d['skills'], dtype=self.skill_dtype)
+
+    @classmethod
+    def from_skills(cls, domain, skills, rng=None, **attrs):
+        """
+        Module with the given skill values, in the order of the domain's kc
+        index, instead of skills sampled by init_skills. attrs sets module
+        attributes such as ability
+
+        """
+        out = cls.__new__(cls)
+        out.domain_id = domain._id
+        out.type = cls.__name__
+        out.rng = make_stream(rng)
+        for key, val in attrs.items():
+            setattr(out, key, val)
+        out.skills = KCArray(domain.get_kc_index(), skills, dtype=cls.skill_dtype)
+        return out
 
     @staticmethod
     def get_init_args(d):
@@ -64,9 +90,11 @@ class Cognition:
 
 class BinarySkillCognition(Cognition):
 
+    skill_dtype = bool
+
     def init_skills(self, domain):
         for skill in domain.kcs:
-            self.skills[skill._id] = random.choices([True, False], weights=[skill.pl0, (1-skill.pl0)], k=1)[0]
+            self.skills[skill._id] = self.rng.bernoulli(skill.pl0)
 
             
     def practice_skill(self, skill):
@@ -74,7 +102,7 @@ class BinarySkillCognition(Cognition):
         if self.is_skill_mastered(skill):
             logger.debug("Skill is already mastered. No update necessary")
         else:
-            learned = random.choices([True, False], weights=[skill.pt, (1-skill.pt)], k=1)[0]
+            learned = self.rng.bernoulli(skill.pt)
             logger.debug("Probability of learning skill: %f\t learned?: %s" % (skill.pt, str(learned)))
             # Update skill if learned
             if learned:
@@ -94,11 +122,11 @@ class BinarySkillCognition(Cognition):
                 hint_exp = cntxt.hints_used / total_hints
                 pg = kc.pg + (1 - kc.pg) * hint_exp
                 weights = [pg, (1 - pg)]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
             
         elif action == Guess:
             weights = [0.01, 0.99]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
 
         else:
             raise Exception(f"Can't produce answer for action: {action.__name__}")
@@ -112,8 +140,8 @@ class BinarySkillCognition(Cognition):
 
 class PCorSkillCognition(Cognition):
 
-    def __init__(self, domain):
-        super().__init__(domain)
+    def __init__(self, domain, rng=None):
+        super().__init__(domain, rng)
 
     def init_skills(self, domain):
         def get_skill_level(skl):
@@ -122,9 +150,7 @@ class PCorSkillCognition(Cognition):
                 skl_sd = skill.pl0_sd
             else:
                 skl_sd = 0.1
-            while not ((pl0 >0) and (pl0 <=1)):
-                pl0 = random.normalvariate(skill.pl0, skl_sd)
-            return pl0
+            return truncnorm(self.rng, skill.pl0, skl_sd, 0, 1)
 
         for skill in domain.kcs:
             self.skills[skill._id] = get_skill_level(skill)
@@ -160,16 +186,16 @@ class PCorSkillCognition(Cognition):
 
             
             # Same chance of producing an answer as producing a correct answer
-            has_answer = random.choices([True, False], weights=weights, k=1)[0]
+            has_answer = self.rng.choices([True, False], weights)
             if has_answer:
-                is_correct = random.choices([True, False], weights=weights, k=1)[0]
+                is_correct = self.rng.choices([True, False], weights)
             else:
                 is_correct = None
                 
             
         elif action == Guess:
             weights = [0.01, 0.99]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
 
         else:
             raise Exception(f"Can't produce answer for action: {action.__name__}")
@@ -203,7 +229,7 @@ class PCorSkillCognition(Cognition):
 class BiasSkillCognition(PCorSkillCognition):
     
 
-    def __init__(self, domain, ability):
+    def __init__(self, domain, ability, rng=None):
         
         # Set Ability paramter before calling super because skills are initialized in the super class
         if (ability > 1) or (ability < -1):
@@ -211,7 +237,7 @@ class BiasSkillCognition(PCorSkillCognition):
         else:
             self.ability = ability
 
-        super().__init__(domain)
+        super().__init__(domain, rng)
 
     def init_skills(self, domain):
         def get_init_skill_level(skl):
@@ -223,11 +249,8 @@ class BiasSkillCognition(PCorSkillCognition):
 
             mu = skill.pl0 + self.ability * 2 * skl_sd
             
-            pl0 = -1
             logger.debug(f"Initialiing skill with mean {mu} and sd {skl_sd}")
-            while not ((pl0 >=0) and (pl0 <=1)):
-                pl0 = random.normalvariate(mu, skl_sd)
-            return pl0
+            return truncnorm(self.rng, mu, skl_sd, 0, 1)
 
         for skill in domain.kcs:
             self.skills[skill._id] = get_init_skill_level(skill)
@@ -11,6 +11,9 @@ import pickle
 
 
 from log_db import mongo
+from sampling.rng import make_stream
+from sampling.truncnorm import truncnorm
+from learner.ev_kernel import EVKernel
 
 from tutor.action import *
 from tutor.feedback import *
@@ -22,8 +25,9 @@ logger = logging.getLogger(__name__)
 
 class Decider:
 
-    def __init__(self):
+    def __init__(self, rng=None):
         self.type = type(self).__name__
+        self.rng = make_stream(rng)
         logger.debug(f"Init {self.type} module")
 
     def choose(self, choices, state, cntxt):
@@ -33,8 +37,8 @@ class Decider:
         return str(self.to_dict())
 
     def to_dict(self):
-        out = copy.deepcopy(self.__dict__)
-        return out
+        out = {k: v for k, v in self.__dict__.items() if k not in ('rng', 'kernel')}
+        return copy.deepcopy(out)
 
     def start_working(self, max_t):
         # Default to start working immediately
@@ -43,8 +47,8 @@ class Decider:
 
 class EVDecider(Decider):
 
-    def __init__(self, attr={}, values={}, exp={}, constructs=[]):
-        super().__init__()
+    def __init__(self, attr={}, values={}, exp={}, constructs=[], rng=None):
+        super().__init__(rng)
         self.attr = attr
 
         if 'mean_start' not in attr:
@@ -57,6 +61,8 @@ class EVDecider(Decider):
         self.exps = {}
         self.init_values(values)
         self.init_expectancies(exp)
+        # Compiled ev evaluator, compiled on first choice
+        self.kernel = None
 
     def init_values(self, values):
         req_vals = {Attempt: lambda s,c: 10,
@@ -99,6 +105,40 @@ class EVDecider(Decider):
 
     def choose(self, choices, state, cntxt):
         # Calc choice distribution
+        choice_evs, pev = self.calc_ev_dist(choices, state, cntxt)
+
+        # Make choice
+        choice = self.rng.choices(choices, pev)
+
+        return choice, {"choice_evs": choice_evs, "pev": pev}
+
+    def __getstate__(self):
+        # The compiled kernel is rebuilt on first use rather than pickled
+        state = self.__dict__.copy()
+        state['kernel'] = None
+        return state
+
+    def get_kernel(self):
+        # Deciders overriding the expectancy or value calculation are not compiled
+        if getattr(self, 'kernel', None) is None:
+            cls = type(self)
+            if all(getattr(cls, m) is getattr(EVDecider, m)
+                   for m in ('calc_ev', 'calc_expectancy', 'calc_value')):
+                self.kernel = EVKernel.compile(self)
+            if self.kernel is None:
+                self.kernel = False
+        return self.kernel
+
+    def calc_ev_dist(self, choices, state, cntxt):
+        """
+        Returns the expectancy-value of each choice and the probability of
+        choosing it, using the compiled kernel when the decider supports it
+
+        """
+        kernel = self.get_kernel()
+        if kernel:
+            return kernel.evaluate(choices, state, cntxt)
+
         choice_evs = self.calc_ev(choices, state, cntxt)
         pev = []
 
@@ -112,8 +152,8 @@ class EVDecider(Decider):
                     pev.append(0)
         else:
             # reverse order of negative costs
-            logger.warning(f"Have negative costs. Diligence: {self.diligence}")
             vals = [val['ev'] for val in choice_evs.values()]
+            logger.warning(f"Have negative costs. EVs: {vals}")
             total_ev = abs(np.sum(vals))
             ev_min  = np.min(vals)
             ev_max = np.max(vals)
@@ -122,11 +162,7 @@ class EVDecider(Decider):
                 # pev.append(choice_evs[choice.__name__]['ev']/total_ev)
             pev = [(choice_evs[choice.__name__]['ev'] - offset)/total_ev for choice in choices]
 
-        
-        # Make choice
-        choice = random.choices(choices, weights=pev, k=1)[0]
-
-        return choice, {"choice_evs": choice_evs, "pev": pev}
+        return choice_evs, pev
 
     def calc_ev(self, choices, state, cntxt):
         choice_evs = {}
@@ -184,9 +220,7 @@ class EVDecider(Decider):
             mu = 1
         sd = self.attr['start_sd']
 
-        delay = -1
-        while (delay < 0) or (delay > max_t):
-            delay = np.random.normal(mu, sd)
+        delay = truncnorm(self.rng, mu, sd, 0, max_t)
 
         return delay
 
@@ -200,9 +234,7 @@ class EVDecider(Decider):
         ot_max = attr['max_off_task'] * w
         ot_mean = attr['mean_off_task' ] * w
         ot_sd = (ot_max - ot_mean) / 3
-        time = -1
-        while (time < ot_min) or (time > ot_max):
-            time = random.gauss(ot_mean, ot_sd)
+        time = truncnorm(self.rng, ot_mean, ot_sd, ot_min, ot_max)
         return time
 
 
@@ -211,7 +243,17 @@ class EVDecider(Decider):
         mean_stop = 3 * 60
         base_val = 1 #0.5*self.values['attempt']
         # logger.info(f"Stop Work Value: { (base_val*mean_stop)/tt_end }\tTime to end: {cntxt.session.end - cntxt.time}")
-        return ((base_val*mean_stop)/tt_end) ** 2
+        # Squared by multiplication like calc_stop_work_values, since pow can round differently
+        v = (base_val*mean_stop)/tt_end
+        return v * v
+
+    @staticmethod
+    def calc_stop_work_values(tt_end):
+        # Vectorized get_stop_work_value over an array of seconds to the end of class
+        mean_stop = 3 * 60
+        base_val = 1
+        v = (base_val*mean_stop)/np.abs(tt_end)
+        return v * v
 
     def to_dict(self):
         obj = super().to_dict()
@@ -232,15 +274,15 @@ class EVDecider(Decider):
 class DiligentDecider(EVDecider):
 
     # def __init__(self, ev_decider, dil=None, ot_min_sd=60, ot_max_sd=300, ot_mean_sd=20):
-    def __init__(self, attr={}, values={}, exp={}, constructs=[]):
-        super().__init__(attr, values, exp, constructs)
+    def __init__(self, attr={}, values={}, exp={}, constructs=[], rng=None):
+        super().__init__(attr, values, exp, constructs, rng)
         # self.ev_decider = ev_decider
 
         # Initialize diligence construct if not provided
         if sum([type(c) == Diligence for c in constructs]) == 0:
             if Diligence not in constructs:
                 logger.info("Adding Diligence Construct to learner")
-                self.constructs[Diligence] = Diligence()
+                self.constructs[Diligence] = Diligence(rng=self.rng)
                 # self.attr['diligence'] = random.gauss(0,1)
 
     def get_focus(self, cntxt):
@@ -249,7 +291,7 @@ class DiligentDecider(EVDecider):
 
 class DecisionConstruct:
 
-    def __init__(self, attrs={}):
+    def __init__(self, attrs={}, rng=None):
         for key in attrs:
             setattr(self, key, attrs[key])
 
@@ -271,6 +313,17 @@ class DecisionConstruct:
     def calc_total_val(self, val, action, state, cntxt):
         return val
 
+    def kernel_ops(self, action):
+        """
+        Describes the construct's pipeline stages for an action for the
+        compiled ev kernel. Maps each stage that changes the action's
+        expectancy or value to a (weight, upper bound) pair applied as
+        min(weight * val, bound), with a None bound for no bound. Constructs
+        that depend on the state or context must not define this
+
+        """
+        return {}
+
     def to_dict(self):
         out = copy.deepcopy(self.__dict__)
         return out
@@ -278,10 +331,10 @@ class DecisionConstruct:
 
 class Diligence(DecisionConstruct):
 
-    def __init__(self, attrs={}):
-        super().__init__(attrs)
+    def __init__(self, attrs={}, rng=None):
+        super().__init__(attrs, rng)
         if 'diligence' not in attrs:
-            setattr(self, 'diligence',random.gauss(0,1))
+            setattr(self, 'diligence', make_stream(rng).gauss(0,1))
 
     def calc_weighted_val(self, val, action, state, cntxt):
         if action == StopWork:
@@ -298,6 +351,17 @@ class Diligence(DecisionConstruct):
             else:
                 return val
 
+    def kernel_ops(self, action):
+        # Mirrors calc_weighted_val
+        dil = self.diligence
+        w = dil + 1 if dil > 0 else dil - 1
+        if action == StopWork:
+            return {'calc_weighted_val': (1 - (w / 25), None)}
+        elif self.is_diligent(action, None, None):
+            return {'calc_weighted_val': (1 + (w / 10), None)}
+        else:
+            return {}
+
     def is_diligent(self, action, state, cntxt):
         if action == Attempt:
             return True
@@ -321,10 +385,10 @@ class Diligence(DecisionConstruct):
 
 class DomainSelfEff(DecisionConstruct):
 
-    def __init__(self, attrs={}):
-        super().__init__(attrs)
+    def __init__(self, attrs={}, rng=None):
+        super().__init__(attrs, rng)
         if 'self_eff' not in attrs:
-            setattr(self, 'self_eff',random.gauss(0,1))
+            setattr(self, 'self_eff', make_stream(rng).gauss(0,1))
 
     def calc_weighted_exp(self, val, action, state, cntxt):
         if action == Attempt:
@@ -337,28 +401,27 @@ class DomainSelfEff(DecisionConstruct):
         else:
             return val
 
+    def kernel_ops(self, action):
+        # Mirrors calc_weighted_exp
+        if action == Attempt:
+            return {'calc_weighted_exp': (1 + (self.self_eff / 5), 1)}
+        else:
+            return {}
+
 
 class RandValDecider(EVDecider):
     
-    def __init__(self, attr={}, values={}):
-        super().__init__(attr, values)
+    def __init__(self, attr={}, values={}, rng=None):
+        super().__init__(attr, values, rng=rng)
 
     def init_values(self):
-        atv = 0
-        while atv <= 4:
-            atv = random.gauss(10,1.5)
-        gsv = 0
-        while gsv <= 0:
-                gsv = random.gauss(atv - 2, 1)
-        hrv = 0
-        while hrv <= 0.1:
-            if gsv < 3:
-                hrv = random.gauss(gsv + 1, 1)
-            else:
-                hrv = random.gauss(3, 1)
-        otv = 0
-        while otv <= 0:
-            otv = random.gauss(1,3)
+        atv = truncnorm(self.rng, 10, 1.5, low=4)
+        gsv = truncnorm(self.rng, atv - 2, 1, low=0)
+        if gsv < 3:
+            hrv = truncnorm(self.rng, gsv + 1, 1, low=0.1)
+        else:
+            hrv = truncnorm(self.rng, 3, 1, low=0.1)
+        otv = truncnorm(self.rng, 1, 3, low=0)
         self.values = {
             'attempt': atv,
             'guess': gsv,
@@ -368,8 +431,8 @@ class RandValDecider(EVDecider):
 
 class DomainSelfEffDecider(EVDecider):
     
-    def __init__(self, attr={}, values={}):
-        super().__init__(attr, values)
+    def __init__(self, attr={}, values={}, rng=None):
+        super().__init__(attr, values, rng=rng)
         if 'self_eff' not in attr:
             raise KeyError("'self_eff' key not provided in attr dictionary")
         self.self_eff = 0.5
@@ -379,9 +442,7 @@ class DomainSelfEffDecider(EVDecider):
         if self_eff is not None:
             se = self_eff
         else:
-            se = -1
-            while (se <= 0) or (se >= 1):
-                se = random.gauss(0.5, 0.2)
+            se = truncnorm(self.rng, 0.5, 0.2, 0, 1)
 
         self.self_eff = se
 
@@ -441,7 +502,9 @@ class DomainSelfEffDecider(EVDecider):
         mean_stop = 3 * 60
         base_val = 1 #0.5*self.values['attempt']
         # logger.info(f"Stop Work Value: { (base_val*mean_stop)/tt_end }\tTime to end: {cntxt.session.end - cntxt.time}")
-        return ((base_val*mean_stop)/tt_end) ** 2
+        # Squared by multiplication like calc_stop_work_values, since pow can round differently
+        v = (base_val*mean_stop)/tt_end
+        return v * v
         
     # def get_start_speed(self):
         # speed = 1 - self.self_eff / 3
@@ -463,12 +526,12 @@ class DomainSelfEffDecider(EVDecider):
 
 class MathInterestDecider(EVDecider):
 
-    def __init__(self, attr={}, values={}):
-        super().__init__(attr, values)
+    def __init__(self, attr={}, values={}, rng=None):
+        super().__init__(attr, values, rng=rng)
         if 'interest' in attr:
             self.interest = attr['interest']
         else:
-            self.interest = random.gauss(0, 1)
+            self.interest = self.rng.gauss(0, 1)
         w = 1 + self.interest / 8
         self.values['attempt'] = self.values['attempt'] * w
         self.values['hint request'] = self.values['hint request'] * w
@@ -498,8 +561,8 @@ class MathInterestDecider(EVDecider):
 class MathIntSelfEffDecider(MathInterestDecider, DomainSelfEffDecider):
 
 
-    def __init__(self, attr={}, values={}):
-        super().__init__(attr, values)
+    def __init__(self, attr={}, values={}, rng=None):
+        super().__init__(attr, values, rng=rng)
 
     def get_start_speed(self):
         speed = 1 - (self.self_eff + self.interest) / 5
@@ -7,6 +7,7 @@ import logging
 import random
 import inspect
 import numpy as np
+import pandas as pd
 
 from .learner import Learner
 from tutor.action import *
@@ -14,6 +15,76 @@ from log_db.learner_log import *
 
 logger = logging.getLogger(__name__)
 
+
+class TunerCurves:
+    """
+    Expected per kc opportunity curves of a DomainTuner computed from the
+    BKT Markov chain of each kc instead of simulating students. A tuner
+    attempts every step, answers its first attempt from its skill before
+    practicing, and only learns on a step's first attempt, so at
+    opportunity n (from 0):
+
+        p_learned[n] = 1 - (1 - pl0) * (1 - pt)^n
+        p_correct[n] = p_learned[n] * (1 - ps) + (1 - p_learned[n]) * pg
+
+    Later attempts at a step are answered from the skill after the first
+    attempt's practice and do not change it, so the number of attempts
+    after an incorrect first one is geometric given that skill. Arrays are
+    kcs x opportunities in the order of kc_ids
+
+    """
+
+    def __init__(self, kc_ids, pl0, pt, ps, pg, num_opps):
+        self.kc_ids = list(kc_ids)
+        pl0, pt, ps, pg = [np.asarray(x, dtype=float)[:, None] for x in (pl0, pt, ps, pg)]
+        n = np.arange(num_opps)
+
+        p_unlearned = (1 - pl0) * (1 - pt) ** n
+        self.p_learned = 1 - p_unlearned
+        self.p_correct = self.p_learned * (1 - ps) + p_unlearned * pg
+        # Expected attempts at a step, infinite for kcs that can never be answered correctly.
+        # Incorrect first attempts split by whether the skill is learned after practicing
+        wrong_learned = self.p_learned * ps + p_unlearned * (1 - pg) * pt
+        wrong_unlearned = p_unlearned * (1 - pg) * (1 - pt)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.attempts = 1 + wrong_learned / (1 - ps) + wrong_unlearned / pg
+
+    @classmethod
+    def from_domain(cls, domain, num_opps):
+        index = domain.get_kc_index()
+        return cls(index.ids, index.params('pl0'), index.params('pt'),
+                   index.params('ps'), index.params('pg'), num_opps)
+
+    def get_opps_to_learn(self, thres=0.95):
+        # First opportunity each kc is learned with probability of at least thres
+        reached = self.p_learned >= thres
+        return np.where(reached.any(axis=1), reached.argmax(axis=1), -1)
+
+    def mean_correct(self, num_opps=None):
+        """
+        Expected percent correct of each kc's first attempts over its first
+        num_opps opportunities, a scalar or one count per kc. Defaults to
+        all opportunities of the curves
+
+        """
+        if num_opps is None:
+            return self.p_correct.mean(axis=1)
+        num_opps = np.broadcast_to(np.asarray(num_opps, dtype=int), (len(self.kc_ids),))
+        mask = np.arange(self.p_correct.shape[1]) < num_opps[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.p_correct * mask).sum(axis=1) / mask.sum(axis=1)
+
+    def to_dataframe(self):
+        # One row per kc and opportunity
+        num_kcs, num_opps = self.p_correct.shape
+        return pd.DataFrame({'kc': np.repeat(self.kc_ids, num_opps),
+                             'opportunity': np.tile(np.arange(num_opps), num_kcs),
+                             'p_learned': self.p_learned.ravel(),
+                             'p_correct': self.p_correct.ravel(),
+                             'attempts': self.attempts.ravel()
+                            })
+
+
 class DomainTuner(Learner):
 
     def __init__(self, domain):
@@ -32,6 +103,11 @@ class DomainTuner(Learner):
         self.attributes['sd_guess_time'] = 1 # seconds
         self.attributes['diligence'] = 2
 
+    @staticmethod
+    def expected_curves(domain, num_opps):
+        # Closed form opportunity curves of the domain's kcs for tuners, see TunerCurves
+        return TunerCurves.from_domain(domain, num_opps)
+
     def choose_action(self, cntxt):
         actions = cntxt.get_actions()
         if Attempt in actions:
@@ -56,7 +132,7 @@ class DomainTuner(Learner):
         logger.debug("Action is %s" % str(action))
         if action == Attempt:
             logger.debug("Action is attempt")
-            time = random.gauss(kc.m_time, kc.sd_time)
+            time = self.rng.gauss(kc.m_time, kc.sd_time)
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -66,14 +142,14 @@ class DomainTuner(Learner):
                 weights = [(1 - kc.ps), kc.ps]
             else:
                 weights = [kc.pg, (1 - kc.pg)]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
             self.set_attempted()
             # Make is_correct default to True to change later
             act = Attempt(time, is_correct)
             
         elif action == HintRequest:
             logger.debug("Action is HintRequest")
-            time = random.gauss(self.attributes['mean_hint_time'], self.attributes['sd_hint_time'])
+            time = self.rng.gauss(self.attributes['mean_hint_time'], self.attributes['sd_hint_time'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -83,8 +159,8 @@ class DomainTuner(Learner):
         elif action == Guess:
             logger.debug("Action is Guess")
             weights = [0.01, 0.99]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
-            time = random.gauss(self.attributes['mean_guess_time'], self.attributes['sd_guess_time'])
+            is_correct = self.rng.choices([True, False], weights)
+            time = self.rng.gauss(self.attributes['mean_guess_time'], self.attributes['sd_guess_time'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -95,7 +171,7 @@ class DomainTuner(Learner):
             act = Guess(time, is_correct)
         elif action == OffTask:
             logger.debug("Action is %s" % str(action))
-            time = random.uniform(self.attributes['min_off_task'], self.attributes['max_off_task'])
+            time = self.rng.uniform(self.attributes['min_off_task'], self.attributes['max_off_task'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
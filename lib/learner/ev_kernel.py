@@ -0,0 +1,283 @@
+# Compiled expectancy-value evaluation for EVDecider
+# Flattens a decider's decision construct pipelines into per action weight
+# vectors so all available actions are evaluated in one vectorized pass, and
+# stacks them over many deciders to make a cohort's decisions at once
+import sys
+sys.path.append('..')
+
+import logging
+
+import numpy as np
+
+from tutor.action import StopWork
+
+logger = logging.getLogger(__name__)
+
+
+# Construct pipeline stages of expectancy and value in the order EVDecider applies them
+EXP_STAGES = ['calc_base_exp', 'calc_weighted_exp', 'calc_total_exp']
+VAL_STAGES = ['calc_base_val', 'calc_weighted_val', 'calc_total_val']
+
+# Construct methods whose behavior a construct's kernel_ops must describe
+KERNEL_METHODS = EXP_STAGES + VAL_STAGES + ['is_diligent']
+
+
+def get_owner(cls, name):
+    # Class in the mro of cls that defines the attribute name
+    for c in cls.__mro__:
+        if name in c.__dict__:
+            return c
+    return None
+
+
+def is_compilable(construct):
+    """
+    A construct can be compiled when the class defining its kernel_ops is
+    at least as derived as every class overriding its pipeline methods, so
+    subclasses that change the pipeline without describing it fall back to
+    the interpreted path
+
+    """
+    cls = type(construct)
+    ops_owner = get_owner(cls, 'kernel_ops')
+    if ops_owner is None:
+        return False
+    for name in KERNEL_METHODS:
+        owner = get_owner(cls, name)
+        if (owner is not None) and not issubclass(ops_owner, owner):
+            return False
+    return True
+
+
+class EVKernel:
+    """
+    Evaluates the expectancy, value and choice probability of every
+    available action of an EVDecider in one vectorized pass.
+
+    Each construct describes its pipeline stages as a multiplicative weight
+    and optional upper bound per action (see DecisionConstruct.kernel_ops).
+    For each tuple of available actions, these are compiled once into a
+    sequence of weight and bound vectors applied in the same order as the
+    interpreted pipeline, so results are identical to EVDecider.calc_ev.
+    Base expectancies and values are still the decider's callables since
+    they may depend on the state and context.
+
+    Construct attributes are read when compiling, so reset the decider's
+    kernel if they change afterwards
+
+    """
+
+    def __init__(self, decider):
+        self.decider = decider
+        # Compiled (names, exp ops, val ops) keyed by tuple of available actions
+        self.plans = {}
+
+    @classmethod
+    def compile(cls, decider):
+        # Returns None if any of the decider's constructs can not be compiled
+        for c in decider.constructs.values():
+            if not is_compilable(c):
+                logger.debug("Unable to compile construct %s" % type(c).__name__)
+                return None
+        return cls(decider)
+
+    def compile_ops(self, choices, stages):
+        ops = []
+        for stage in stages:
+            for c in self.decider.constructs.values():
+                w = np.ones(len(choices))
+                bound = np.full(len(choices), np.inf)
+                changed = False
+                bounded = False
+                for i, action in enumerate(choices):
+                    op = c.kernel_ops(action).get(stage)
+                    if op is None:
+                        continue
+                    changed = True
+                    w[i] = op[0]
+                    if op[1] is not None:
+                        bounded = True
+                        bound[i] = op[1]
+                if changed:
+                    ops.append((w, bound if bounded else None))
+        return ops
+
+    def get_plan(self, choices):
+        key = tuple(choices)
+        if key not in self.plans:
+            self.plans[key] = ([choice.__name__ for choice in choices],
+                               self.compile_ops(choices, EXP_STAGES),
+                               self.compile_ops(choices, VAL_STAGES))
+        return self.plans[key]
+
+    def apply(self, x, ops):
+        for w, bound in ops:
+            x = w * x
+            if bound is not None:
+                x = np.minimum(x, bound)
+        return x
+
+    def calc_ev(self, choices, state, cntxt):
+        """
+        Expectancy, value and expectancy-value vectors over the given choices
+
+        """
+        names, exp_ops, val_ops = self.get_plan(choices)
+        exps = self.decider.exps
+        values = self.decider.values
+        exp = np.array([exps[choice](state, cntxt) for choice in choices], dtype=float)
+        val = np.array([values[choice](state, cntxt) for choice in choices], dtype=float)
+        exp = self.apply(exp, exp_ops)
+        val = self.apply(val, val_ops)
+        return exp, val, exp * val
+
+    def evaluate(self, choices, state, cntxt):
+        """
+        Returns the choice evs dictionary of EVDecider.calc_ev and the
+        probability of choosing each choice
+
+        """
+        names = self.get_plan(choices)[0]
+        exp, val, ev = self.calc_ev(choices, state, cntxt)
+
+        pos = ev > 0
+        if np.any(pos):
+            # There is at least 1 postive EV, choose most valued action
+            total_ev = np.sum(ev[pos])
+            pev = np.where(pos, ev / total_ev, 0)
+        else:
+            # reverse order of negative costs
+            logger.warning("Have negative costs. EVs: %s" % str(ev.tolist()))
+            total_ev = abs(np.sum(ev))
+            offset = np.min(ev) + np.max(ev)
+            pev = (ev - offset) / total_ev
+
+        exp = exp.tolist()
+        val = val.tolist()
+        ev = ev.tolist()
+        choice_evs = {name: {'expectancy': exp[i], 'value': val[i], 'ev': ev[i]}
+                      for i, name in enumerate(names)}
+        return choice_evs, pev.tolist()
+
+
+class DeciderArrays:
+    """
+    Struct of arrays of the compiled ev pipelines of many EVDeciders over a
+    fixed list of actions, so the decisions of a whole cohort are made with
+    matrix operations (students x actions).
+
+    Base expectancies and values must be constant given each student's
+    state, except the default stop work value which depends on the time to
+    the end of class. Each student's pipeline is padded with identity
+    weights and bounds to the longest pipeline of the cohort, which leaves
+    the results identical to each decider's own kernel
+
+    """
+
+    def __init__(self, deciders, states, actions):
+        n = len(deciders)
+        self.actions = actions
+        self.base_exps = np.zeros((n, len(actions)))
+        self.base_vals = np.zeros((n, len(actions)))
+        self.stop_col = actions.index(StopWork) if StopWork in actions else None
+        self.stop_value = None
+
+        exp_ops = []
+        val_ops = []
+        for i, (dec, state) in enumerate(zip(deciders, states)):
+            kernel = dec.get_kernel() if hasattr(dec, 'get_kernel') else None
+            if not kernel:
+                raise ValueError(f"Unable to compile decider: {dec.type}")
+            exp_ops.append(kernel.compile_ops(actions, EXP_STAGES))
+            val_ops.append(kernel.compile_ops(actions, VAL_STAGES))
+            try:
+                for j, action in enumerate(actions):
+                    self.base_exps[i, j] = dec.exps[action](state, None)
+                    if j != self.stop_col:
+                        self.base_vals[i, j] = dec.values[action](state, None)
+            except Exception as e:
+                raise ValueError(f"Base values and expectancies must be constant given the state: {e}")
+            if self.stop_col is not None:
+                self.check_stop_value(dec)
+
+        self.exp_w, self.exp_bound = self.stack_ops(exp_ops)
+        self.val_w, self.val_bound = self.stack_ops(val_ops)
+
+    def __len__(self):
+        return len(self.base_exps)
+
+    def check_stop_value(self, dec):
+        # Stop work values are computed by the vectorized form of the default value
+        cls = type(dec)
+        stop_val = dec.values[StopWork]
+        owner = get_owner(cls, 'calc_stop_work_values')
+        if ((owner is None) or (get_owner(cls, 'get_stop_work_value') is not owner) or
+                (getattr(stop_val, '__func__', None) is not owner.get_stop_work_value)):
+            raise ValueError("Deciders must use the default stop work value")
+        if self.stop_value is None:
+            self.stop_value = owner.calc_stop_work_values
+        elif self.stop_value is not owner.calc_stop_work_values:
+            raise ValueError("Deciders must share the same stop work value")
+
+    def stack_ops(self, ops):
+        # (ops x students x actions) weights and bounds, or None bounds if no op is bounded
+        k = max([len(o) for o in ops] + [0])
+        w = np.ones((k, len(ops), len(self.actions)))
+        bound = np.full((k, len(ops), len(self.actions)), np.inf)
+        bounded = False
+        for i, student_ops in enumerate(ops):
+            for j, (op_w, op_bound) in enumerate(student_ops):
+                w[j, i] = op_w
+                if op_bound is not None:
+                    bounded = True
+                    bound[j, i] = op_bound
+        return w, bound if bounded else None
+
+    def apply(self, x, idx, w, bound):
+        for k in range(len(w)):
+            x = w[k, idx] * x
+            if bound is not None:
+                x = np.minimum(x, bound[k, idx])
+        return x
+
+    def calc_ev(self, idx, tt_end):
+        """
+        Expectancy, value and expectancy-value matrices (students x actions)
+        for the students in idx, given their seconds to the end of class
+
+        """
+        exp = self.base_exps[idx].copy()
+        val = self.base_vals[idx].copy()
+        if self.stop_col is not None:
+            val[:, self.stop_col] = self.stop_value(tt_end)
+        exp = self.apply(exp, idx, self.exp_w, self.exp_bound)
+        val = self.apply(val, idx, self.val_w, self.val_bound)
+        return exp, val, exp * val
+
+    def choose_many(self, idx, avail, tt_end, rng):
+        """
+        Batch EVDecider.choose for the students in idx given a mask of their
+        available actions, sampling every choice at once from the numpy
+        generator rng. Returns the choice columns and the exp, val, ev and
+        pev matrices
+
+        """
+        exp, val, ev = self.calc_ev(idx, tt_end)
+        pos = (ev > 0) & avail
+        total_pos = np.sum(np.where(pos, ev, 0), axis=1)
+        has_pos = np.any(pos, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pev = np.where(pos, ev / total_pos[:, None], 0)
+            if not np.all(has_pos):
+                # Reverse order of negative costs
+                masked = np.where(avail, ev, np.nan)
+                total = np.abs(np.nansum(masked, axis=1))
+                offset = np.nanmin(masked, axis=1) + np.nanmax(masked, axis=1)
+                neg_pev = np.where(avail, (ev - offset[:, None]) / total[:, None], 0)
+                pev = np.where(has_pos[:, None], pev, neg_pev)
+
+        # Sample one action per student with the same rule as random.choices
+        cum = np.cumsum(pev, axis=1)
+        x = rng.random(len(idx)) * cum[:, -1]
+        choice = np.argmax((cum > x[:, None]) & avail, axis=1)
+        return choice, exp, val, ev, pev
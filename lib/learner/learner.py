@@ -6,6 +6,8 @@ import random
 import copy
 
 from log_db import mongo
+from sampling.rng import make_stream
+from tutor.kc_index import KCArray
 from tutor.feedback import *
 
 
@@ -14,12 +16,14 @@ logger = logging.getLogger(__name__)
 
 class Learner:
 
-    def __init__(self, domain):
+    def __init__(self, domain, rng=None):
         self._id = str(uuid.uuid4())
         self.domain_id = domain._id
         self.type = type(self).__name__
+        # Learner specific random stream
+        self.rng = make_stream(rng)
 
-        self.skills = {skill._id: random.choices([True, False], weights=[skill.pl0, (1-skill.pl0)], k=1)[0] for skill in domain.kcs}
+        self.init_skills(domain)
 
         self.state = {}
         self.attributes = {}
@@ -32,13 +36,18 @@ class Learner:
                           # self.db_params['user'], 
                           # self.db_params['pswd'])
 
+    def init_skills(self, domain):
+        # Binary skills drawn from each kc's pl0. Learners that get their skills elsewhere override this
+        self.skills = KCArray(domain.get_kc_index(), [self.rng.bernoulli(skill.pl0) for skill in domain.kcs],
+                              dtype=bool)
+
     def practice_skill(self, skill):
         # Update skill
         
         if self.skills[skill._id]:
             logger.debug("Skill is already mastered. No update necessary")
         else:
-            learned = random.choices([True, False], weights=[skill.pt, (1-skill.pt)], k=1)[0]
+            learned = self.rng.bernoulli(skill.pt)
             logger.debug("Probability of learning skill: %f\t learned?: %s" % (skill.pt, str(learned)))
             # Update skill if learned
             if learned:
@@ -57,8 +66,13 @@ class Learner:
             logger.debug("Processing Hint Request response: %s" % str(fdbk))
 
     def get_state(self):
-        state = copy.deepcopy(self.state)
-        state['skills'] = copy.deepcopy(self.skills)
+        # State values are scalars so a shallow copy is consistent. Skills are
+        # snapshotted by their store, e.g. a copy-on-write view of a KCArray
+        state = dict(self.state)
+        if hasattr(self.skills, 'snapshot'):
+            state['skills'] = self.skills.snapshot()
+        else:
+            state['skills'] = copy.deepcopy(self.skills)
         return state
 
     def calc_expectancy(self, action):
@@ -71,7 +85,10 @@ class Learner:
         pass
 
     def to_dict(self):
-        d = copy.deepcopy(self.__dict__)
+        # Modules are persisted by the subclasses that own them
+        d = {k: v for k, v in self.__dict__.items() if k not in ('rng', 'cog', 'decider', 'skills')}
+        d = copy.deepcopy(d)
+        d['skills'] = dict(self.skills.items())
         
         # Persist state variables independently
         keys = list(d['state'].keys())
@@ -3,14 +3,16 @@
 import uuid
 import logging
 import random
-import pickle
 import dill
 
 import pandas as pd
 
 from log_db import mongo
+from sampling.truncnorm import truncnorm
 
 from .learner import Learner
+from tutor.kc_index import KCArray
+from . import schema
 from tutor.action import *
 from tutor.feedback import *
 from log_db.learner_log import *
@@ -22,8 +24,11 @@ logger = logging.getLogger(__name__)
 
 class ModularLearner(Learner):
 
-    def __init__(self, domain, cog, decider):
-        super().__init__(domain)
+    def __init__(self, domain, cog, decider, rng=None):
+        # Share the cognitive module's random stream unless one is given
+        if rng is None:
+            rng = cog.rng
+        super().__init__(domain, rng)
 
         # State variables
         self.state['off_task'] = False
@@ -34,11 +39,18 @@ class ModularLearner(Learner):
         # Cognitive Module
         self.cog = cog
         # Overrride skills attribute to referece to skills within cognitive module
+        if not isinstance(self.cog.skills, KCArray):
+            self.cog.skills = KCArray.from_dict(domain.get_kc_index(), self.cog.skills,
+                                                dtype=self.cog.skill_dtype)
         self.skills = self.cog.skills
         
         # Motivation/Decision-making model
         self.decider = decider
 
+        # All modules draw from the learner's random stream
+        self.cog.rng = self.rng
+        self.decider.rng = self.rng
+
         # Learner Specific attributes
         self.attributes['min_off_task'] = 90 # 30 sec
         self.attributes['max_off_task'] = 600 # 10 minutes
@@ -49,6 +61,10 @@ class ModularLearner(Learner):
         self.attributes['sd_guess_time'] = 1 # seconds
 
 
+    def init_skills(self, domain):
+        # Skills are the cognitive module's, so none are drawn. They are set once the base learner is initialized
+        self.skills = None
+
     def practice_skill(self, skill):
         # Override base skill practice to force cog module to manage skills
         # Update skill
@@ -73,27 +89,15 @@ class ModularLearner(Learner):
         if action == Attempt:
             act = self.make_attempt(cntxt)
         elif action == HintRequest:
-            time = 0
             m = cntxt.kc.m_time / 2
             sd = cntxt.kc.sd_time / 2
-            loops = 0
-            while (time < 1) and (loops < 50):
-                time = random.gauss(m, sd)
-                loops += 1
-                if loops == 50:
-                    time = 1
+            time = truncnorm(self.rng, m, sd, low=1)
             act = HintRequest(time)
         elif action == Guess:
             is_correct = self.cog.produce_answer(action, cntxt)
-            time = 0
             m = cntxt.kc.m_time / 4
             sd = cntxt.kc.sd_time / 4
-            loops = 0
-            while (time <  1) and (loops < 50):
-                time = random.gauss(m, sd)
-                loops += 1
-                if loops == 50:
-                    time = 1
+            time = truncnorm(self.rng, m, sd, low=1)
             act = Guess(time, is_correct)
         elif action == OffTask:
             act = self.go_offtask(cntxt)
@@ -119,19 +123,17 @@ class ModularLearner(Learner):
 
     def process_feedback(self, fdbk):
         if isinstance(fdbk, AttemptResponse):
-            logger.debug("Processing Attempt response: %s" % str(fdbk))
+            logger.debug("Processing Attempt response: %s", fdbk)
             self.state['total_attempts'] = self.state['total_attempts'] + 1
             if fdbk.is_correct:
                 self.state['total_success'] = self.state['total_success'] + 1
         if isinstance(fdbk, HintResponse):
-            logger.debug("Processing Hint Request response: %s" % str(fdbk))
+            logger.debug("Processing Hint Request response: %s", fdbk)
 
     def start_working(self, max_t):
         return self.decider.start_working(max_t)
 
     def make_attempt(self, cntxt):
-        time = 0
-        loops = 0
         kc = cntxt.kc
         if hasattr(self.decider, 'get_focus'):
             focus = self.decider.get_focus(cntxt)
@@ -142,13 +144,8 @@ class ModularLearner(Learner):
             speed = self.cog.get_speed(cntxt)
         else:
             speed = 1
-        while time < 0.25:
-            m = kc.m_time #* focus * speed
-            time = random.gauss(m, kc.sd_time)
-            loops += 1
-            if loops > 50:
-                logger.debug(f"Setting time to 0.25\tDuration of action mu: {kc.m_time}\tsd: {kc.sd_time}")
-                time = 0.25
+        m = kc.m_time #* focus * speed
+        time = truncnorm(self.rng, m, kc.sd_time, low=0.25)
 
         is_correct = self.cog.produce_answer(Attempt, cntxt)
         self.state['attempted'] = True
@@ -167,18 +164,18 @@ class ModularLearner(Learner):
             time = self.decider.get_offtask_time(self.attributes)
             return OffTask(time)
         else:
-            time = -1
             ot_sd = (self.attributes['max_off_task'] - self.attributes['mean_off_task'])/3
-            while (time < self.attributes['min_off_task']) or (time > self.attributes['max_off_task']):
-                time = random.gauss(self.attributes['mean_off_task'], ot_sd)
+            time = truncnorm(self.rng, self.attributes['mean_off_task'], ot_sd,
+                             self.attributes['min_off_task'], self.attributes['max_off_task'])
             return OffTask(time)
             
 
     def to_dict(self):
         d = super().to_dict()
-        d['cog'] = self.cog.to_dict()
-        d['decider'] = self.decider.to_dict()
-        d['pickle'] = dill.dumps(self)
+        d['cog'] = schema.dump_cog(self.cog)
+        d['decider'] = schema.dump_decider(self.decider)
+        d['rng'] = self.rng.to_dict()
+        d['schema_version'] = schema.SCHEMA_VERSION
 
         return  d
 
@@ -204,13 +201,32 @@ class ModularLearner(Learner):
 
 
         # Remove unnecessary fields
-        del d['pickle']
         del d['cog']
         del d['decider']
+        del d['rng']
 
         return pd.Series(d, name=d['_id'])
 
     
     @staticmethod
     def from_dict(d):
-        return dill.loads(d['pickle'])
+        """
+        Rebuilds a learner from its to_dict document. Documents written
+        before the schema was versioned hold a pickle of the learner instead
+
+        """
+        if 'schema_version' not in d:
+            return dill.loads(d['pickle'])
+        schema.check_version(d)
+
+        out = ModularLearner.__new__(ModularLearner)
+        out._id = d['_id']
+        out.type = d['type']
+        out.domain_id = d['domain_id']
+        out.rng = schema.load_rng(d.get('rng'))
+        out.state = {f: d[f] for f in d['state_fields']}
+        out.attributes = {f: d[f] for f in d['attribute_fields']}
+        out.cog = schema.load_cog(d['cog'], d['skills'], out.rng)
+        out.skills = out.cog.skills
+        out.decider = schema.load_decider(d['decider'], out.rng)
+        return out
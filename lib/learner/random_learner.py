@@ -19,7 +19,7 @@ class RandomLearner(Learner):
 
     def choose_action(self, cntxt):
         actions = cntxt.get_actions()
-        choice = random.choice(actions)
+        choice = self.rng.choice(actions)
         logger.debug("Choosing action: %s" % str(choice))
         return choice
 
@@ -28,32 +28,32 @@ class RandomLearner(Learner):
         logger.debug("Action is %s" % str(action))
         if action == Attempt:
             logger.debug("Aciton is attempt")
-            time = random.gauss(kc.m_time, kc.sd_time)
+            time = self.rng.gauss(kc.m_time, kc.sd_time)
             if self.skills[kc._id]:
                 weights = [(1 - kc.ps), kc.ps]
             else:
                 weights = [kc.pg, (1 - kc.pg)]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
             # Make is_correct default to True to change later
             act = Attempt(time, is_correct)
             
         elif action == HintRequest:
             logger.debug("Aciton is HintRequest")
-            time = random.gauss(kc.m_time, kc.sd_time)
+            time = self.rng.gauss(kc.m_time, kc.sd_time)
             act = HintRequest(time)
         elif action == Guess:
             logger.debug("Action is Guess")
             weights = [0.01, 0.99]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
-            time = random.gauss(2, 2)
+            is_correct = self.rng.choices([True, False], weights)
+            time = self.rng.gauss(2, 2)
             if time < 0:
                 time = 0
             act = Guess(time, is_correct)
         elif action == OffTask:
             logger.debug("Action is %s" % str(action))
-            time = random.gauss(300, 300)
+            time = self.rng.gauss(300, 300)
             if time < 0:
-                time = random.gauss(30, 3)
+                time = self.rng.gauss(30, 3)
             act = OffTask(time)
         else:
             logger.debug("Action is %s" % str(action))
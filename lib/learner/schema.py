@@ -0,0 +1,201 @@
+# Versioned schema for persisting learners as plain fields
+# Rebuilds cognition and decider modules from the fields of their to_dict
+# documents instead of unpickling whole objects
+import sys
+sys.path.append('..')
+
+import logging
+import copy
+import importlib
+
+from sampling.rng import RandomStream, make_stream
+from tutor.kc_index import KCIndex, KCArray
+from learner import cognition
+from learner import decider
+from tutor import action
+
+logger = logging.getLogger(__name__)
+
+
+# Version of the learner document layout written by ModularLearner.to_dict.
+# Bump when fields are renamed or their meaning changes
+SCHEMA_VERSION = 1
+
+
+def check_version(d):
+    version = d.get('schema_version')
+    if version is None:
+        raise ValueError("Learner document has no schema version")
+    if version > SCHEMA_VERSION:
+        raise ValueError("Learner document schema version %s is newer than supported version %i" %
+                         (str(version), SCHEMA_VERSION))
+    return version
+
+
+def get_type(module, name, base):
+    cls = getattr(module, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, base)):
+        raise ValueError("Unknown %s type: %s" % (base.__name__, str(name)))
+    return cls
+
+
+def load_rng(d):
+    if d is None:
+        return make_stream()
+    return RandomStream.from_dict(d)
+
+
+def dump_cog(cog):
+    # Cognition fields without its skills, which the learner document already holds
+    d = {k: v for k, v in cog.__dict__.items() if k not in ('rng', 'skills')}
+    return copy.deepcopy(d)
+
+
+def load_cog(d, skills, rng):
+    """
+    Cognition module of type d['type'] with the fields of d and the given
+    skills. Skills are not re-initialized, so the domain is not needed
+
+    """
+    cls = get_type(cognition, d['type'], cognition.Cognition)
+    out = cls.__new__(cls)
+    for key, val in d.items():
+        setattr(out, key, val)
+    out.skills = KCArray.from_dict(KCIndex.from_ids(skills.keys()), skills, dtype=cls.skill_dtype)
+    out.rng = rng
+    return out
+
+
+# Value and expectancy functions stored by name, see register_ev_func
+EV_FUNCS = {}
+
+
+def register_ev_func(name, func):
+    """
+    Registers a value or expectancy function under name so learners whose
+    deciders use it can be stored. Functions defined at module level can
+    be stored by their import path without registering them
+
+    """
+    if (name in EV_FUNCS) and (EV_FUNCS[name] is not func):
+        raise ValueError("Another function is registered as %s" % name)
+    EV_FUNCS[name] = func
+    return func
+
+
+def same_func(f, default):
+    # Lambdas from the same definition have equal code, also after a round trip through a pickle
+    f = getattr(f, '__func__', f)
+    default = getattr(default, '__func__', default)
+    if getattr(f, '__closure__', None) or getattr(default, '__closure__', None):
+        return f is default
+    return getattr(f, '__code__', f) == getattr(default, '__code__', default)
+
+
+def resolve_func(ref, dec):
+    # Function stored as a registered name, a method of the decider or a module:qualname import path
+    if ref in EV_FUNCS:
+        return EV_FUNCS[ref]
+    if ref.startswith('self.'):
+        return getattr(dec, ref[len('self.'):])
+    if ':' in ref:
+        module, qualname = ref.split(':', 1)
+        out = importlib.import_module(module)
+        for name in qualname.split('.'):
+            out = getattr(out, name)
+        return out
+    raise ValueError("Unknown value or expectancy function: %s" % ref)
+
+
+def get_func_ref(func, dec):
+    for name, f in EV_FUNCS.items():
+        if f is func:
+            return name
+    if getattr(func, '__self__', None) is dec:
+        return 'self.' + func.__name__
+    module = getattr(func, '__module__', None)
+    qualname = getattr(func, '__qualname__', '')
+    if (module is not None) and ('<' not in qualname):
+        ref = module + ':' + qualname
+        try:
+            if resolve_func(ref, dec) is func:
+                return ref
+        except (ImportError, AttributeError):
+            pass
+    raise ValueError("Unable to store value or expectancy function %s. Register it with register_ev_func" %
+                     repr(func))
+
+
+def get_default_evs(dec):
+    # Values and expectancies EVDecider.init_values and init_expectancies give dec without arguments
+    default = type(dec).__new__(type(dec))
+    default.values = {}
+    default.exps = {}
+    decider.EVDecider.init_values(default, {})
+    decider.EVDecider.init_expectancies(default, {})
+    return default.values, default.exps
+
+
+def dump_funcs(funcs, defaults, dec):
+    # References to the functions that differ from the defaults, keyed by action name
+    out = {}
+    for act, func in funcs.items():
+        if (act in defaults) and same_func(func, defaults[act]):
+            continue
+        if not isinstance(act, type):
+            raise ValueError("Unable to store value or expectancy of %s, which is not an action" % repr(act))
+        out[act.__name__] = get_func_ref(func, dec)
+    return out
+
+
+def load_funcs(d, dec):
+    return {get_type(action, name, action.Action): resolve_func(ref, dec) for name, ref in d.items()}
+
+
+def dump_decider(dec):
+    """
+    Decider fields from its to_dict. EVDecider value and expectancy
+    functions that differ from the defaults are stored as references, see
+    register_ev_func, and functions that can not be referenced raise a
+    ValueError
+
+    """
+    d = dec.to_dict()
+    if isinstance(dec, decider.EVDecider):
+        default_values, default_exps = get_default_evs(dec)
+        values = dump_funcs(dec.values, default_values, dec)
+        exps = dump_funcs(dec.exps, default_exps, dec)
+        if len(values) > 0:
+            d['values'] = values
+        if len(exps) > 0:
+            d['exps'] = exps
+    return d
+
+
+def load_decider(d, rng):
+    """
+    Decider of type d['type'] from the fields written by dump_decider.
+    EVDeciders get the default value and expectancy functions back except
+    for the stored references
+
+    """
+    cls = get_type(decider, d['type'], decider.Decider)
+    out = cls.__new__(cls)
+    # Fields derived from the constructs are rebuilt with them
+    skip = set(['constructs', 'construct_attrs', 'values', 'exps'] + d.get('construct_attrs', []))
+    for key, val in d.items():
+        if key not in skip:
+            setattr(out, key, val)
+    out.rng = rng
+
+    if isinstance(out, decider.EVDecider):
+        out.constructs = {}
+        for name, attrs in d.get('constructs', {}).items():
+            ctype = get_type(decider, name, decider.DecisionConstruct)
+            out.constructs[ctype] = ctype(attrs=attrs, rng=rng)
+        out.values = {}
+        out.exps = {}
+        decider.EVDecider.init_values(out, load_funcs(d.get('values', {}), out))
+        decider.EVDecider.init_expectancies(out, load_funcs(d.get('exps', {}), out))
+        out.kernel = None
+    return out
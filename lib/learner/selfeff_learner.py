@@ -11,6 +11,7 @@ from .learner import Learner
 from tutor.action import *
 from tutor.feedback import *
 from log_db.learner_log import *
+from sampling.truncnorm import truncnorm
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +33,7 @@ class SelfEfficacyLearner(Learner):
         self.attributes['sd_hint_time'] = 1 # seconds
         self.attributes['mean_guess_time'] = 3 # seconds
         self.attributes['sd_guess_time'] = 1 # seconds
-        self.attributes['diligence'] = random.gauss(2,.3)
+        self.attributes['diligence'] = self.rng.gauss(2,.3)
         if self.diligence <= 0:
             self.attributes['diligence'] = 0.1
         self.attributes['values'] = {}
@@ -43,21 +44,13 @@ class SelfEfficacyLearner(Learner):
         self.init_self_eff(self_eff)
 
     def init_values(self):
-        atv = 0
-        while atv <= 4:
-            atv = random.gauss(10,1.5)
-        gsv = 0
-        while gsv <= 0:
-            gsv = random.gauss(atv - 2, 1)
-        hrv = 0
-        while hrv <= 0.1:
-            if gsv < 3:
-                hrv = random.gauss(gsv + 1, 1)
-            else:
-                hrv = random.gauss(3, 1)
-        otv = 0
-        while otv <= 0:
-            otv = random.gauss(1,3)
+        atv = truncnorm(self.rng, 10, 1.5, low=4)
+        gsv = truncnorm(self.rng, atv - 2, 1, low=0)
+        if gsv < 3:
+            hrv = truncnorm(self.rng, gsv + 1, 1, low=0.1)
+        else:
+            hrv = truncnorm(self.rng, 3, 1, low=0.1)
+        otv = truncnorm(self.rng, 1, 3, low=0)
 
         self.values = {
             'attempt': atv,
@@ -71,7 +64,7 @@ class SelfEfficacyLearner(Learner):
         if self_eff is not None:
             se = self_eff
         else:
-            se = random.gauss(0.5, 0.15)
+            se = self.rng.gauss(0.5, 0.15)
 
         if se >= 1:
             se = 0.99
@@ -102,7 +95,7 @@ class SelfEfficacyLearner(Learner):
         pev = [action_evs[action.__name__]/total_ev for action in actions]
         logger.debug(str(pev))
 
-        choice = random.choices(actions, weights=pev, k=1)[0]
+        choice = self.rng.choices(actions, pev)
         decision = Decision(self, choice.__name__, cntxt.time, action_evs, pev, cntxt)
         # logger.debug("Logging decision: %s" % str(decision.to_dict()))
         # logger.debug("******************************************************")
@@ -117,7 +110,7 @@ class SelfEfficacyLearner(Learner):
         logger.debug("Action is %s" % str(action))
         if action == Attempt:
             logger.debug("Action is attempt")
-            time = random.gauss(kc.m_time, kc.sd_time)
+            time = self.rng.gauss(kc.m_time, kc.sd_time)
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -127,14 +120,14 @@ class SelfEfficacyLearner(Learner):
                 weights = [(1 - kc.ps), kc.ps]
             else:
                 weights = [kc.pg, (1 - kc.pg)]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
+            is_correct = self.rng.choices([True, False], weights)
             self.attempted = True
             # Make is_correct default to True to change later
             act = Attempt(time, is_correct)
             
         elif action == HintRequest:
             logger.debug("Action is HintRequest")
-            time = random.gauss(self.attributes['mean_hint_time'], self.attributes['sd_hint_time'])
+            time = self.rng.gauss(self.attributes['mean_hint_time'], self.attributes['sd_hint_time'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -144,8 +137,8 @@ class SelfEfficacyLearner(Learner):
         elif action == Guess:
             logger.debug("Action is Guess")
             weights = [0.01, 0.99]
-            is_correct = random.choices([True, False], weights=weights, k=1)[0]
-            time = random.gauss(self.attributes['mean_guess_time'], self.attributes['sd_guess_time'])
+            is_correct = self.rng.choices([True, False], weights)
+            time = self.rng.gauss(self.attributes['mean_guess_time'], self.attributes['sd_guess_time'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -156,7 +149,7 @@ class SelfEfficacyLearner(Learner):
             act = Guess(time, is_correct)
         elif action == OffTask:
             logger.debug("Action is %s" % str(action))
-            time = random.uniform(self.attributes['min_off_task'], self.attributes['max_off_task'])
+            time = self.rng.uniform(self.attributes['min_off_task'], self.attributes['max_off_task'])
             # Lazy fiz to truncate gaussian
             if time < 0:
                 logger.debug("Action performed was less than 0 secs, channging to 0 sec")
@@ -200,7 +193,7 @@ class SelfEfficacyLearner(Learner):
             exp = self_eff + (1 - self_eff) * hint_exp
             return exp
         elif action == Guess:
-            exp = random.gauss(0.10, 0.02)
+            exp = self.rng.gauss(0.10, 0.02)
             if exp < 0:
                 exp = 0
             elif exp >1:
@@ -0,0 +1,242 @@
+# Columnar on disk format for a curriculum and its domain
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import os
+import json
+
+import numpy as np
+
+from tutor.domain import Domain, ContKCDomain, KC, ContKC
+from tutor.curriculum import Curriculum, Unit, Section, Problem, Step
+from tutor.cogtutor_curriculum import CogTutorCurriculum
+from tutor.simple_curriculum import SimpleCurriculum
+
+logger = logging.getLogger(__name__)
+
+
+# Version of the directory layout written by save_curriculum
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+
+DOMAIN_TYPES = {cls.__name__: cls for cls in (Domain, ContKCDomain)}
+KC_TYPES = {cls.__name__: cls for cls in (KC, ContKC)}
+CURRIC_TYPES = {cls.__name__: cls for cls in (Curriculum, CogTutorCurriculum, SimpleCurriculum)}
+
+KC_PARAMS = ('pl0', 'pt', 'ps', 'pg', 'm_time', 'sd_time', 'pl0_sd')
+
+
+def num_column(vals):
+    # Ints stay ints, anything else is stored as float with None as nan
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in vals):
+        return np.array(vals, dtype=np.int64)
+    return np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+
+
+def str_column(vals):
+    return np.array(vals, dtype=str) if len(vals) > 0 else np.zeros(0, dtype='U1')
+
+
+def csr(lists, pos):
+    # Offsets and flattened positions of a list of lists of objects
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) for l in lists])
+    vals = np.array([pos[id(obj)] for l in lists for obj in l], dtype=np.int32)
+    return offsets, vals
+
+
+def save_curriculum(curric, path):
+    """
+    Writes a curriculum and its domain to directory path as one .npy file
+    per column and a meta.json of the curriculum and domain fields. Units,
+    sections, problems and steps are stored in curriculum order as id
+    arrays with the position of their parent, and kc lists as offsets into
+    arrays of kc positions
+
+    """
+    os.makedirs(path, exist_ok=True)
+    domain = curric.domain
+    units = list(curric.units)
+    sections = [sect for unit in units for sect in unit.sections]
+    problems = [prob for sect in sections for prob in sect.problems]
+    steps = [step for prob in problems for step in prob.steps]
+    kc_pos = {id(kc): i for i, kc in enumerate(domain.kcs)}
+    unit_pos = {id(unit): i for i, unit in enumerate(units)}
+    sect_pos = {id(sect): i for i, sect in enumerate(sections)}
+    prob_pos = {id(prob): i for i, prob in enumerate(problems)}
+
+    cols = {}
+    cols['kc_id'] = str_column([kc._id for kc in domain.kcs])
+    kc_types = sorted(set(type(kc).__name__ for kc in domain.kcs))
+    cols['kc_type'] = np.array([kc_types.index(type(kc).__name__) for kc in domain.kcs], dtype=np.int8)
+    for name in KC_PARAMS:
+        cols['kc_' + name] = num_column([getattr(kc, name, None) for kc in domain.kcs])
+
+    cols['unit_id'] = str_column([unit._id for unit in units])
+    cols['unit_kc_offsets'], cols['unit_kcs'] = csr([unit.kcs for unit in units], kc_pos)
+
+    cols['section_id'] = str_column([sect._id for sect in sections])
+    cols['section_unit'] = np.array([unit_pos[id(unit)] for unit in units for sect in unit.sections], dtype=np.int32)
+    cols['section_m_steps'] = num_column([sect.m_steps for sect in sections])
+    cols['section_sd_steps'] = num_column([sect.sd_steps for sect in sections])
+    cols['section_kc_offsets'], cols['section_kcs'] = csr([sect.kcs for sect in sections], kc_pos)
+
+    cols['problem_id'] = str_column([prob._id for prob in problems])
+    cols['problem_section'] = np.array([sect_pos[id(sect)] for sect in sections for prob in sect.problems],
+                                       dtype=np.int32)
+    cols['problem_kc_offsets'], cols['problem_kcs'] = csr([prob.kcs for prob in problems], kc_pos)
+
+    cols['step_id'] = str_column([step._id for step in steps])
+    cols['step_problem'] = np.array([prob_pos[id(prob)] for prob in problems for step in prob.steps],
+                                    dtype=np.int32)
+    cols['step_m_time'] = num_column([step.m_time for step in steps])
+    cols['step_sd_time'] = num_column([step.sd_time for step in steps])
+    cols['step_hints'] = num_column([step.hints_avail for step in steps])
+    cols['step_kc_offsets'], cols['step_kcs'] = csr([step.kcs for step in steps], kc_pos)
+
+    for name, col in cols.items():
+        np.save(os.path.join(path, name + '.npy'), col)
+
+    meta = {'format_version': FORMAT_VERSION,
+            'curric': {'_id': curric._id, 'type': type(curric).__name__, 'domain_id': curric.domain_id},
+            'domain': {k: v for k, v in domain.__dict__.items() if k not in ('kcs', 'kc_index')},
+            'kc_types': kc_types,
+            'columns': sorted(cols.keys())
+           }
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    logger.info("Saved curriculum %s with %i problems and %i steps to %s" %
+                (curric._id, len(problems), len(steps), path))
+
+
+class CurriculumArrays:
+    """
+    Columns of a curriculum saved by save_curriculum, memory mapped by
+    default so processes opening the same directory share its pages.
+    Columns are available by name, e.g. arrays['step_m_time'], and
+    to_curriculum builds the curriculum objects
+
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        version = self.meta.get('format_version')
+        if (version is None) or (version > FORMAT_VERSION):
+            raise ValueError("Unsupported curriculum format version %s in %s" % (str(version), path))
+        mode = 'r' if mmap else None
+        self.cols = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+                     for name in self.meta['columns']}
+
+    def __getitem__(self, name):
+        return self.cols[name]
+
+    def get_lists(self, name, objs):
+        # Lists of objects for each row of a csr column
+        offsets = self.cols[name + '_kc_offsets'].tolist()
+        vals = self.cols[name + '_kcs'].tolist()
+        return [[objs[j] for j in vals[offsets[i]:offsets[i+1]]] for i in range(len(offsets) - 1)]
+
+    def build_domain(self):
+        d = self.meta['domain']
+        if d['type'] not in DOMAIN_TYPES:
+            raise ValueError("Unknown domain type: %s" % d['type'])
+        domain = DOMAIN_TYPES[d['type']].__new__(DOMAIN_TYPES[d['type']])
+        domain.__dict__.update(d)
+        domain.kc_index = None
+
+        kc_types = [KC_TYPES[name] for name in self.meta['kc_types']]
+        params = {}
+        for name in KC_PARAMS:
+            col = self.cols['kc_' + name]
+            params[name] = [None if v != v else v for v in col.tolist()]
+        domain.kcs = []
+        for i, (kc_id, t) in enumerate(zip(self.cols['kc_id'].tolist(), self.cols['kc_type'].tolist())):
+            cls = kc_types[t]
+            kc = cls.__new__(cls)
+            kc._id = kc_id
+            kc.type = cls.__name__
+            kc.domain_id = domain._id
+            for name in KC_PARAMS:
+                if (name != 'pl0_sd') or issubclass(cls, ContKC):
+                    setattr(kc, name, params[name][i])
+            domain.kcs.append(kc)
+        return domain
+
+    def to_curriculum(self):
+        """
+        Curriculum and domain objects with the saved ids. Objects are
+        created without their constructors, so no ids or kcs are sampled
+
+        """
+        domain = self.build_domain()
+        kcs = domain.kcs
+        c = self.meta['curric']
+        if c['type'] not in CURRIC_TYPES:
+            raise ValueError("Unknown curriculum type: %s" % c['type'])
+        curric = CURRIC_TYPES[c['type']].__new__(CURRIC_TYPES[c['type']])
+        curric._id = c['_id']
+        curric.domain = domain
+        curric.domain_id = c['domain_id']
+        curric.units = []
+        curric.nav_index = None
+
+        units = []
+        for unit_id, unit_kcs in zip(self.cols['unit_id'].tolist(), self.get_lists('unit', kcs)):
+            unit = Unit.__new__(Unit)
+            unit.__dict__.update({'_id': unit_id, 'curric_id': curric._id, 'domain_id': domain._id,
+                                  'sections': [], 'kcs': unit_kcs})
+            units.append(unit)
+        curric.units = units
+
+        sections = []
+        for sect_id, u, m_steps, sd_steps, sect_kcs in zip(self.cols['section_id'].tolist(),
+                                                          self.cols['section_unit'].tolist(),
+                                                          self.cols['section_m_steps'].tolist(),
+                                                          self.cols['section_sd_steps'].tolist(),
+                                                          self.get_lists('section', kcs)):
+            sect = Section.__new__(Section)
+            sect.__dict__.update({'_id': sect_id, 'domain_id': domain._id, 'curric_id': curric._id,
+                                  'unit_id': units[u]._id, 'problems': [], 'kcs': sect_kcs,
+                                  'm_steps': m_steps, 'sd_steps': sd_steps})
+            units[u].sections.append(sect)
+            sections.append(sect)
+
+        problems = []
+        for prob_id, s, prob_kcs in zip(self.cols['problem_id'].tolist(),
+                                        self.cols['problem_section'].tolist(),
+                                        self.get_lists('problem', kcs)):
+            sect = sections[s]
+            prob = Problem.__new__(Problem)
+            prob.__dict__.update({'_id': prob_id, 'domain_id': domain._id, 'curric_id': curric._id,
+                                  'unit_id': sect.unit_id, 'section_id': sect._id,
+                                  'steps': [], 'kcs': prob_kcs})
+            sect.problems.append(prob)
+            problems.append(prob)
+
+        for step_id, p, m_time, sd_time, hints, step_kcs in zip(self.cols['step_id'].tolist(),
+                                                                self.cols['step_problem'].tolist(),
+                                                                self.cols['step_m_time'].tolist(),
+                                                                self.cols['step_sd_time'].tolist(),
+                                                                self.cols['step_hints'].tolist(),
+                                                                self.get_lists('step', kcs)):
+            prob = problems[p]
+            step = Step.__new__(Step)
+            step.__dict__.update({'_id': step_id, 'domain_id': domain._id, 'curric_id': curric._id,
+                                  'unit_id': prob.unit_id, 'section_id': prob.section_id,
+                                  'prob_id': prob._id, 'kcs': step_kcs, 'hints_avail': hints,
+                                  'm_time': None if m_time != m_time else m_time,
+                                  'sd_time': None if sd_time != sd_time else sd_time})
+            prob.steps.append(step)
+        return curric
+
+
+def load_curriculum(path, mmap=True):
+    # Curriculum with its domain from a directory written by save_curriculum
+    curric = CurriculumArrays(path, mmap).to_curriculum()
+    logger.info("Loaded curriculum %s from %s" % (curric._id, path))
+    return curric
@@ -9,6 +9,11 @@ from uuid import UUID
 logger = logging.getLogger(__name__)
 
 class Decision:
+    # Slotted since a decision is logged for every simulated step
+
+    __slots__ = ('_id', 'student_id', 'choice', 'time', 'action_evs', 'pev', 'problem', 'step',
+                 'kc', 'learner_knowledge', 'attempt', 'hints_avail', 'hints_used',
+                 'learner_off_task', 'self_eff')
 
     def __init__(self, student, choice, time, action_evs, pev, cntxt):
         self._id = str(uuid.uuid4())
@@ -31,14 +36,34 @@ class Decision:
             self.self_eff = ''
 
 
+    def __str__(self):
+        return str(self.to_dict())
+
     def to_dict(self):
-        result = copy.deepcopy(self.__dict__)
-        result['kc'] = copy.deepcopy(self.kc.__dict__)
-        return result
+        # Fields are scalars except the ev dictionaries, pev list and kc
+        action_evs = {k: dict(v) if isinstance(v, dict) else v for k, v in self.action_evs.items()}
+        return {'_id': self._id,
+                'student_id': self.student_id,
+                'choice': self.choice,
+                'time': self.time,
+                'action_evs': action_evs,
+                'pev': list(self.pev),
+                'problem': self.problem,
+                'step': self.step,
+                'kc': dict(self.kc.__dict__),
+                'learner_knowledge': self.learner_knowledge,
+                'attempt': self.attempt,
+                'hints_avail': self.hints_avail,
+                'hints_used': self.hints_used,
+                'learner_off_task': self.learner_off_task,
+                'self_eff': self.self_eff
+               }
 
 
 class LoggedAction:
 
+    __slots__ = ('_id', 'student_id', 'action', 'time', 'decision_id')
+
     def __init__(self, student, action, time):
         self._id = str(uuid.uuid4())
         self.student_id = student._id
@@ -46,11 +71,16 @@ class LoggedAction:
         self.time = time
         self.decision_id = None
 
+    def __str__(self):
+        return str(self.to_dict())
+
     def to_dict(self):
-        result = copy.deepcopy(self.__dict__)
-        result['action'] = self.action.to_dict()
-        # result['action'] = self.action.to_dict()
-        return result
+        return {'_id': self._id,
+                'student_id': self.student_id,
+                'action': self.action.to_dict(),
+                'time': self.time,
+                'decision_id': self.decision_id
+               }
         
 
 
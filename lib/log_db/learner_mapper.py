@@ -26,6 +26,8 @@ class DBLearnerMapper:
         logger.debug("Retrieving ModularLearner from database with id: %s" % _id)
         obj  = self.db.students.find_one({'_id': _id})
         logger.debug(f"Retrieved student {str(obj)}")
+        if ('schema_version' in obj) or ('pickle' in obj):
+            return ModularLearner.from_dict(obj)
 
         # Retrieve domain
         domain = DBDomainMapper(self.db).get_from_db(obj['domain_id'])
@@ -0,0 +1,126 @@
+# In memory stand-in for a mongo database, used to run simulations without a db server
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+
+import bson
+from bson.errors import InvalidDocument
+
+logger = logging.getLogger(__name__)
+
+
+class InsertResult:
+
+    def __init__(self, inserted_ids):
+        self.acknowledged = True
+        self.inserted_ids = inserted_ids
+
+    @property
+    def inserted_id(self):
+        return self.inserted_ids[0]
+
+
+class DeleteResult:
+
+    def __init__(self, deleted_count):
+        self.acknowledged = True
+        self.deleted_count = deleted_count
+
+
+class MemoryCollection:
+    """
+    Supports the subset of the pymongo collection api used by the simulation.
+    Tracks the number of documents and the bson size of everything inserted.
+    With keep_docs False nothing is retained, so it acts as a null sink
+
+    """
+
+    def __init__(self, name, keep_docs=True):
+        self.name = name
+        self.keep_docs = keep_docs
+        self.docs = []
+        self.num_inserted = 0
+        self.bytes_inserted = 0
+
+    def get_size(self, doc):
+        try:
+            return len(bson.encode(doc))
+        except InvalidDocument:
+            # Some records hold numpy scalars that a real insert would also reject
+            logger.debug("Unable to bson encode document for collection %s" % self.name)
+            return len(str(doc))
+
+    def insert_one(self, doc):
+        return self.insert_many([doc])
+
+    def insert_many(self, docs):
+        ids = []
+        for doc in docs:
+            self.num_inserted += 1
+            self.bytes_inserted += self.get_size(doc)
+            ids.append(doc.get('_id'))
+            if self.keep_docs:
+                self.docs.append(doc)
+        return InsertResult(ids)
+
+    def matches(self, doc, query):
+        for key, val in query.items():
+            field = doc.get(key)
+            if isinstance(val, dict):
+                if '$gt' in val and not (field is not None and field > val['$gt']):
+                    return False
+                if '$in' in val and field not in val['$in']:
+                    return False
+            elif isinstance(field, list):
+                if val not in field:
+                    return False
+            elif field != val:
+                return False
+        return True
+
+    def find(self, query=None):
+        if query is None:
+            query = {}
+        return [doc for doc in self.docs if self.matches(doc, query)]
+
+    def delete_many(self, query):
+        num_docs = len(self.docs)
+        self.docs = [doc for doc in self.docs if not self.matches(doc, query)]
+        return DeleteResult(num_docs - len(self.docs))
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+
+class MemoryDB:
+    """
+    Dict of MemoryCollections accessible by attribute or key like a pymongo
+    database
+
+    """
+
+    def __init__(self, keep_docs=True):
+        self.keep_docs = keep_docs
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name, self.keep_docs)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or 'collections' not in self.__dict__:
+            raise AttributeError(name)
+        return self[name]
+
+    def collection_names(self):
+        return list(self.collections.keys())
+
+    def stats(self):
+        return {name: {'docs': col.num_inserted, 'bytes': col.bytes_inserted}
+                for name, col in self.collections.items()}
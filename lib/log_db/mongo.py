@@ -13,10 +13,15 @@ import random
 import logging
 import json
 
+import bson
+
 from .tutor_log import TransactionEncoder
 
 SETTINGS_PATH = "../mongo_settings.cfg"
 
+# Mongo's limit on the size of a single bson document
+MAX_BSON_SIZE = 16 * 1024 * 1024
+
 logger = logging.getLogger(__name__)
 
 def get_db_params(name='motivsim', settings_path=None):
@@ -85,6 +90,35 @@ def write_json_to_file(data='', dir_path='data', file_name='default'):
     resultsFile.close()
 
 
+def insert_chunked(col, docs, max_docs=1000, max_bytes=MAX_BSON_SIZE):
+    """
+    Inserts an iterable of documents into the collection in batches of at
+    most max_docs documents and max_bytes of bson, so large writes stay
+    under the server's message limits and docs can be generated lazily.
+    Returns the number of documents inserted
+
+    """
+    batch = []
+    batch_bytes = 0
+    count = 0
+    for doc in docs:
+        size = len(bson.encode(doc))
+        if size > MAX_BSON_SIZE:
+            raise ValueError("Document %s is %i bytes, over the %i byte bson limit" %
+                             (str(doc.get('_id')), size, MAX_BSON_SIZE))
+        if (len(batch) > 0) and ((len(batch) >= max_docs) or (batch_bytes + size > max_bytes)):
+            col.insert_many(batch)
+            count += len(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(doc)
+        batch_bytes += size
+    if len(batch) > 0:
+        col.insert_many(batch)
+        count += len(batch)
+    return count
+
+
 class Data_Utility:
     """
     Utility functions for mass database operations
@@ -4,6 +4,7 @@
 import logging
 import sys
 from queue import Queue
+from collections import deque, Counter
 
 from pymongo import MongoClient
 from os import mkdir, listdir, path
@@ -37,6 +38,8 @@ class SimLogger:
         }
 
         self.max_queue = 1000
+        # Number of actions logged by type
+        self.action_counts = Counter()
 
         self.decisions = []
         self.actions = []
@@ -45,7 +48,7 @@ class SimLogger:
 
 
     def log_decision(self, d):
-        logger.debug("Logging decision: %s" % str(d.to_dict()))
+        logger.debug("Logging decision: %s", d)
         self.state['last_decision'].append(d)
 
         self.decisions.append(d)
@@ -57,9 +60,10 @@ class SimLogger:
 
 
     def log_action(self, d, cntxt):
-        logger.debug("Return action: %s" % str(d))
+        logger.debug("Return action: %s", d)
         logged_action = LoggedAction(self.student, d, cntxt.time)
-        logger.debug("Logged action: %s" % str(logged_action.to_dict()))
+        logger.debug("Logged action: %s", logged_action)
+        self.action_counts[d.type] += 1
         
         # Add decision_id of most recent decision to action before logging
         last_dec = self.state['last_decision'].pop()
@@ -77,7 +81,7 @@ class SimLogger:
 
 
     def log_transaction(self, d):
-        logger.debug(f"Logging transaction: {d.to_dict()}")
+        logger.debug("Logging transaction: %s", d)
         # if d.type == "SessionStart":
             # logger.warning(f"Logging Session Start. current tx count: {len(self.transactions)}")
 
@@ -97,7 +101,7 @@ class SimLogger:
 
 
     def log_session(self, d):
-        logger.debug(f"Logging session: {d.__dict__}")
+        logger.debug("Logging session: %s", d.__dict__)
         # self.db.class_sessions.insert_one(d.__dict__)
         self.sessions.append(d)
         if len(self.sessions) > self.max_queue:
@@ -132,3 +136,52 @@ class SimLogger:
 
 
 
+
+class StreamLogger:
+    """
+    Drop in replacement for SimLogger that converts each record to its db
+    form as it is logged and queues it for a consumer instead of buffering
+    rich objects. Records are queued as (collection, record) tuples and should
+    be drained with pop_records after every simulation step
+
+    """
+
+    def __init__(self, stu, tutor):
+        self.student = stu
+        self.tutor = tutor
+
+        # Only ids are kept to link actions to decisions and transactions to actions
+        self.state = {
+            'last_decision': [],
+            'last_actions':  [],
+        }
+
+        self.records = deque()
+        self.action_counts = Counter()
+
+    def log_decision(self, d):
+        self.state['last_decision'].append(d._id)
+        self.records.append(('decisions', d.to_dict()))
+
+    def log_action(self, d, cntxt):
+        logged_action = LoggedAction(self.student, d, cntxt.time)
+        logged_action.decision_id = self.state['last_decision'].pop()
+        self.state['last_actions'].append(logged_action._id)
+        self.action_counts[d.type] += 1
+        self.records.append(('actions', logged_action.to_dict()))
+
+    def log_transaction(self, d):
+        d.action_ids = self.state['last_actions']
+        self.state['last_actions'] = []
+        self.records.append(('tutor_events', d.to_dict()))
+
+    def log_session(self, d):
+        self.records.append(('sessions', d.__dict__))
+
+    def pop_records(self):
+        while self.records:
+            yield self.records.popleft()
+
+    def write_to_db(self):
+        # Records are handed to the consumer as they are produced
+        pass
@@ -109,12 +109,10 @@ class TutorInput(Transaction):
 
 
     def to_dict(self):
-        out = copy.deepcopy(self.__dict__)
-
-        # logger.info(out['kcs'])
-        # logger.info(type(out['kcs'][0].__dict__))
-        # logger.info(str(out['kcs'][0].__dict__))
-        out['kcs'] = [kc.__dict__ for kc in out['kcs']]
+        # Fields are scalars except the kcs and action ids
+        out = dict(self.__dict__)
+        out['kcs'] = [dict(kc.__dict__) for kc in self.kcs]
+        out['action_ids'] = list(self.action_ids)
         return out
 
 
@@ -0,0 +1,165 @@
+# Seeded random number streams with block drawn pools of random values
+import logging
+import bisect
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RandomStream:
+    """
+    Wraps a seeded numpy Generator and serves single uniform and normal
+    draws from pre-allocated blocks. Each learner, tutor and simulation
+    owns a stream so runs are reproducible regardless of how students are
+    interleaved or sharded across processes. Method names mirror the
+    random module so it can be used as a drop-in replacement
+
+    """
+
+    def __init__(self, seed=None, block_size=1024):
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_seq = seed
+        else:
+            self.seed_seq = np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_seq)
+        self.block_size = block_size
+
+        # Pools are filled lazily on first use. The generator state each pool
+        # was drawn from is kept so the stream can be persisted without its pools
+        self._uniform = []
+        self._u_pos = 0
+        self._u_state = None
+        self._normal = []
+        self._n_pos = 0
+        self._n_state = None
+
+    def random(self):
+        # Uniform draw on [0, 1)
+        if self._u_pos >= len(self._uniform):
+            self._u_state = self.generator.bit_generator.state
+            self._uniform = self.generator.random(self.block_size).tolist()
+            self._u_pos = 0
+        u = self._uniform[self._u_pos]
+        self._u_pos += 1
+        return u
+
+    def std_normal(self):
+        if self._n_pos >= len(self._normal):
+            self._n_state = self.generator.bit_generator.state
+            self._normal = self.generator.standard_normal(self.block_size).tolist()
+            self._n_pos = 0
+        z = self._normal[self._n_pos]
+        self._n_pos += 1
+        return z
+
+    def gauss(self, mu, sigma):
+        return mu + sigma * self.std_normal()
+
+    normalvariate = gauss
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    def triangular(self, low=0.0, high=1.0, mode=None):
+        # Same inverse transform as random.triangular
+        u = self.random()
+        try:
+            c = 0.5 if mode is None else (mode - low) / (high - low)
+        except ZeroDivisionError:
+            return low
+        if u > c:
+            u = 1.0 - u
+            c = 1.0 - c
+            low, high = high, low
+        return low + (high - low) * (u * c) ** 0.5
+
+    def bernoulli(self, p):
+        # Equivalent to random.choices([True, False], weights=[p, 1-p])[0]
+        return self.random() < p
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def choices(self, population, weights):
+        # Single weighted draw following random.choices(population, weights, k=1)[0]
+        cum_weights = []
+        total = 0
+        for w in weights:
+            total += w
+            cum_weights.append(total)
+        return population[bisect.bisect(cum_weights, self.random() * total, 0, len(population) - 1)]
+
+    def spawn(self, n):
+        # Independent child streams, e.g. for a student's tutor and simulation
+        return [RandomStream(s, self.block_size) for s in self.seed_seq.spawn(n)]
+
+    def to_dict(self):
+        """
+        Plain fields that restore the stream to its current position. Pools
+        are stored as the generator state they were drawn from and redrawn
+        on load. Integers wider than 64 bits are stored as hex strings
+
+        """
+        return {'entropy': hex(self.seed_seq.entropy),
+                'spawn_key': list(self.seed_seq.spawn_key),
+                'n_children_spawned': self.seed_seq.n_children_spawned,
+                'block_size': self.block_size,
+                'state': encode_state(self.generator.bit_generator.state),
+                'uniform': [encode_state(self._u_state), self._u_pos, len(self._uniform)],
+                'normal': [encode_state(self._n_state), self._n_pos, len(self._normal)]
+               }
+
+    @classmethod
+    def from_dict(cls, d):
+        seed_seq = np.random.SeedSequence(int(d['entropy'], 16), spawn_key=tuple(d['spawn_key']),
+                                          n_children_spawned=d['n_children_spawned'])
+        out = cls(seed_seq, d['block_size'])
+        bit_gen = out.generator.bit_generator
+        state, pos, size = d['uniform']
+        if state is not None:
+            bit_gen.state = decode_state(state)
+            out._u_state = bit_gen.state
+            out._uniform = out.generator.random(size).tolist()
+            out._u_pos = pos
+        state, pos, size = d['normal']
+        if state is not None:
+            bit_gen.state = decode_state(state)
+            out._n_state = bit_gen.state
+            out._normal = out.generator.standard_normal(size).tolist()
+            out._n_pos = pos
+        bit_gen.state = decode_state(d['state'])
+        return out
+
+
+def encode_state(state):
+    # Bit generator state with ints as hex strings so it fits in 64 bit db fields
+    if isinstance(state, dict):
+        return {k: encode_state(v) for k, v in state.items()}
+    if isinstance(state, int) and not isinstance(state, bool):
+        return hex(state)
+    return state
+
+
+def decode_state(state):
+    if isinstance(state, dict):
+        return {k: decode_state(v) for k, v in state.items()}
+    if isinstance(state, str) and state.startswith(('0x', '-0x')):
+        return int(state, 16)
+    return state
+
+
+def make_stream(rng=None):
+    """
+    Returns rng if it is already a RandomStream, otherwise a new stream
+    seeded with rng (an int, SeedSequence or None for fresh entropy)
+
+    """
+    if isinstance(rng, RandomStream):
+        return rng
+    return RandomStream(rng)
+
+
+def spawn_seeds(seed, n):
+    # Independent seed sequences for n students derived from a single batch seed
+    return np.random.SeedSequence(seed).spawn(n)
@@ -0,0 +1,124 @@
+# Truncated normal sampling by inverse CDF
+# Replaces rejection loops around gauss draws with a single uniform draw per value
+import logging
+import math
+from statistics import NormalDist
+
+import numpy as np
+from scipy import special
+
+logger = logging.getLogger(__name__)
+
+
+STD_NORMAL = NormalDist()
+
+# Beyond this many standard deviations the normal cdf underflows, so the tail
+# is sampled from its exponential approximation instead
+TAIL_CUTOFF = 37.0
+
+
+def ndtr(x):
+    # Standard normal cdf, accurate in the lower tail
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
+
+def tail_ppf(u, a, b):
+    # Deep lower tail where the density is proportional to exp(-b * (x - b))
+    lam = -b
+    span = -math.expm1(lam * (a - b)) if a > -math.inf else 1
+    return b + math.log1p(-u * span) / lam
+
+
+def std_ppf(u, a, b):
+    """
+    Maps a uniform draw u to a standard normal truncated to [a, b]. Values
+    above the median are found from the upper tail so both tails keep
+    their precision
+
+    """
+    if b < -TAIL_CUTOFF:
+        return tail_ppf(u, a, b)
+    if a > TAIL_CUTOFF:
+        return -tail_ppf(u, -b, -a)
+    pa = ndtr(a)
+    p = pa + u * (ndtr(b) - pa)
+    if p <= 0.5:
+        return STD_NORMAL.inv_cdf(p) if p > 0 else a
+    # Upper tail probability 1 - p
+    qa = ndtr(-a)
+    q = qa - u * (qa - ndtr(-b))
+    return -STD_NORMAL.inv_cdf(q) if q > 0 else b
+
+
+def truncnorm_ppf(u, mu, sd, low=-math.inf, high=math.inf):
+    """
+    Inverse cdf of a normal with mean mu and standard deviation sd
+    truncated to [low, high], evaluated at u in [0, 1)
+
+    """
+    if sd <= 0:
+        return min(max(mu, low), high)
+    z = std_ppf(u, (low - mu) / sd, (high - mu) / sd)
+    return min(max(mu + sd * z, low), high)
+
+
+def truncnorm(rng, mu, sd, low=-math.inf, high=math.inf):
+    """
+    Single draw from a normal with mean mu and standard deviation sd
+    truncated to [low, high]. rng is any source with a random() method
+    returning uniforms on [0, 1), e.g. a RandomStream or the random module.
+    Always consumes exactly one uniform draw
+
+    """
+    if low > high:
+        raise ValueError("Truncation bounds are reversed: [%s, %s]" % (str(low), str(high)))
+    return truncnorm_ppf(rng.random(), mu, sd, low, high)
+
+
+def tail_ppf_many(u, a, b):
+    lam = -b
+    span = np.where(np.isfinite(a), -np.expm1(lam * (a - b)), 1)
+    return b + np.log1p(-u * span) / lam
+
+
+def truncnorm_ppf_many(u, mu, sd, low=-np.inf, high=np.inf):
+    """
+    Vectorized truncnorm_ppf. All arguments broadcast against each other
+
+    """
+    u, mu, sd, low, high = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (u, mu, sd, low, high)])
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        safe_sd = np.where(sd > 0, sd, 1)
+        a = (low - mu) / safe_sd
+        b = (high - mu) / safe_sd
+
+        pa = special.ndtr(a)
+        p = pa + u * (special.ndtr(b) - pa)
+        qa = special.ndtr(-a)
+        q = qa - u * (qa - special.ndtr(-b))
+        z = np.where(p <= 0.5, special.ndtri(p), -special.ndtri(q))
+
+        # Deep tails from their exponential approximation
+        lower = b < -TAIL_CUTOFF
+        if np.any(lower):
+            z[lower] = tail_ppf_many(u[lower], a[lower], b[lower])
+        upper = a > TAIL_CUTOFF
+        if np.any(upper):
+            z[upper] = -tail_ppf_many(u[upper], -b[upper], -a[upper])
+
+        x = np.where(sd > 0, mu + sd * z, mu)
+    return np.clip(x, low, high)
+
+
+def truncnorm_many(rng, mu, sd, low=-np.inf, high=np.inf, size=None):
+    """
+    Batch of draws from truncated normals. mu, sd, low and high broadcast
+    against each other and size. rng is a numpy Generator or a RandomStream
+
+    """
+    if np.any(np.asarray(low) > np.asarray(high)):
+        raise ValueError("Truncation bounds are reversed")
+    if size is None:
+        size = np.broadcast(np.asarray(mu), np.asarray(sd), np.asarray(low), np.asarray(high)).shape
+    generator = getattr(rng, 'generator', rng)
+    return truncnorm_ppf_many(generator.random(size), mu, sd, low, high)
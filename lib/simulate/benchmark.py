@@ -0,0 +1,191 @@
+# Reproducible benchmark suite for the simulation engine
+# Runs fixed curriculum and cohort size scenarios against an in memory db
+# Usage (from lib): python -m simulate.benchmark --curric tiny mid --students 10 100
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import argparse
+import json
+import copy
+import random
+import time
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tutor.domain import Domain
+from tutor.simple_curriculum import SimpleCurriculum
+from tutor.curriculum_factory import CurriculumFactory
+from learner.cognition import BiasSkillCognition
+from learner.decider import DiligentDecider, Diligence
+from learner.modular_learner import ModularLearner
+from log_db.memory_db import MemoryDB
+from sampling.rng import make_stream, spawn_seeds
+from simulate.simulation import SimulationBatch
+from simulate.script_helpers import SimHelper
+
+logger = logging.getLogger(__name__)
+
+
+DOMAIN_PARAMS = {'m_l0': 0.45,
+                 'sd_l0': 0.155,
+                 'm_l0_sd': 0.1,
+                 'sd_l0_sd': 0.03,
+                 'm_t': 0.35,
+                 'sd_t': 0.13,
+                 'm_s': 0.105,
+                 'sd_s': 0.055,
+                 'm_g': 0.45,
+                 'sd_g': 0.105
+}
+
+# Curricula to benchmark. simple curricula are generated from a fixed size domain
+CURRICULA = {
+    'tiny': {'type': 'simple',
+             'num_kcs': 10,
+             'params': {'num_units': 1, 'num_sections': 2, 'num_practice': 10}
+            },
+    'mid': {'type': 'cogtutor',
+            'params': {'num_units': 6, 'mean_sections': 4, 'stdev_sections': 1.76,
+                       'section_kcs_lambda': 4, 'num_practice': 20}
+           },
+    'full': {'type': 'cogtutor',
+             'params': {'num_units': 60, 'mean_sections': 4, 'stdev_sections': 1.76,
+                        'section_kcs_lambda': 4, 'num_practice': 100}
+            },
+}
+
+STUDENT_COUNTS = [10, 100, 1000]
+
+# Collections holding the simulation logs
+LOG_COLLECTIONS = ['decisions', 'actions', 'tutor_events', 'sessions']
+
+
+def gen_curriculum(name, seed):
+    spec = CURRICULA[name]
+    # Curriculum generation draws from the global random modules
+    random.seed(seed)
+    np.random.seed(seed)
+    if spec['type'] == 'simple':
+        domain = Domain()
+        domain.generate_kcs(spec['num_kcs'])
+        curric = SimpleCurriculum(domain)
+        curric.generate(**spec['params'])
+    else:
+        domain, curric = CurriculumFactory.gen_curriculum(DOMAIN_PARAMS, spec['params'])
+    return domain, curric
+
+
+def gen_students(domain, num_students, seed, m_diligence=0, sd_diligence=1, decider_attr=None):
+    # Each student's decider gets its own copy of decider_attr
+    stus = []
+    for stu_seed in spawn_seeds(seed, num_students):
+        rng = make_stream(stu_seed)
+        cog = BiasSkillCognition(domain, rng.triangular(-1, 1), rng=rng)
+        constructs = [Diligence(attrs={'diligence': rng.gauss(m_diligence, sd_diligence)})]
+        attr = {} if decider_attr is None else copy.deepcopy(decider_attr)
+        decider = DiligentDecider(attr=attr, constructs=constructs, rng=rng)
+        stus.append(ModularLearner(domain, cog, decider, rng))
+    return stus
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on linux and bytes on mac
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak = peak * 1024
+    return peak
+
+
+def run_scenario(curric_name, num_students, num_sessions=5, executor='direct', seed=0):
+    """
+    Simulate one scenario against a null sink db and return its metrics.
+    Curriculum and student generation are not included in the timing
+
+    """
+    domain, curric = gen_curriculum(curric_name, seed)
+    students = gen_students(domain, num_students, seed)
+    db = MemoryDB(keep_docs=False)
+    helper = SimHelper(db)
+    batch = SimulationBatch(f"benchmark {curric_name} {num_students}")
+
+    start = time.perf_counter()
+    helper.simulate_students(curric, students, batch, num_sessions, seed=seed, executor=executor)
+    elapsed = time.perf_counter() - start
+
+    stats = db.stats()
+    steps = stats.get('decisions', {'docs': 0})['docs']
+    txs = stats.get('tutor_events', {'docs': 0})['docs']
+    log_bytes = sum(stats[col]['bytes'] for col in LOG_COLLECTIONS if col in stats)
+    result = {'curric': curric_name,
+              'students': num_students,
+              'sessions': num_sessions,
+              'executor': executor,
+              'seed': seed,
+              'seconds': elapsed,
+              'steps': steps,
+              'transactions': txs,
+              'steps_per_sec': steps / elapsed,
+              'tx_per_sec': txs / elapsed,
+              'peak_rss_mb': get_peak_rss() / 2**20,
+              'bytes_logged': log_bytes
+             }
+    return result
+
+
+def run_suite(curricula=None, student_counts=None, num_sessions=5, executor='direct', seed=0):
+    """
+    Run every combination of curriculum and number of students, each in a
+    fresh process so peak RSS is measured per scenario
+
+    """
+    if curricula is None:
+        curricula = list(CURRICULA.keys())
+    if student_counts is None:
+        student_counts = STUDENT_COUNTS
+
+    results = []
+    for name in curricula:
+        for num_students in student_counts:
+            logger.info(f"Benchmarking {name} curriculum with {num_students} students")
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(run_scenario, name, num_students,
+                                     num_sessions, executor, seed).result()
+            results.append(result)
+            logger.info(format_results([result]))
+    return results
+
+
+def format_results(results):
+    header = "%-8s%10s%10s%12s%12s%12s%14s%14s" % ("curric", "students", "steps", "sec",
+                                                     "steps/sec", "tx/sec", "peak rss MB", "MB logged")
+    lines = [header]
+    for r in results:
+        lines.append("%-8s%10i%10i%12.2f%12.1f%12.1f%14.1f%14.2f" % (r['curric'], r['students'], r['steps'],
+                                                                     r['seconds'], r['steps_per_sec'],
+                                                                     r['tx_per_sec'], r['peak_rss_mb'],
+                                                                     r['bytes_logged'] / 2**20))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Benchmark the simulation engine.')
+    parser.add_argument('--curric', nargs='+', choices=list(CURRICULA.keys()),
+                        default=list(CURRICULA.keys()), help="curricula to benchmark")
+    parser.add_argument('--students', nargs='+', type=int, default=STUDENT_COUNTS,
+                        help="numbers of students to benchmark")
+    parser.add_argument('--sessions', type=int, default=5, help="class sessions per student")
+    parser.add_argument('--executor', choices=['simpy', 'direct'], default='direct')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help="optional json file to write results to")
+    args = parser.parse_args()
+
+    results = run_suite(args.curric, args.students, args.sessions, args.executor, args.seed)
+    print(format_results(results))
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
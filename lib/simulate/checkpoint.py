@@ -0,0 +1,160 @@
+# Checkpoint and resume of single student simulations at class session boundaries
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import os
+import io
+
+import dill
+
+logger = logging.getLogger(__name__)
+
+
+class _CurricPickler(dill.Pickler):
+    # Pickles curriculum and domain objects by reference so checkpoints stay small
+    # and restored tutor state points at the live curriculum objects
+
+    def __init__(self, file, refs):
+        super().__init__(file)
+        self.refs = refs
+
+    def persistent_id(self, obj):
+        return self.refs.get(id(obj))
+
+
+class _CurricUnpickler(dill.Unpickler):
+
+    def __init__(self, file, objs):
+        super().__init__(file)
+        self.objs = objs
+
+    def persistent_load(self, pid):
+        return self.objs[pid]
+
+
+class SimCheckpointer:
+    """
+    Saves the state of SingleStudentSims to a directory at class session
+    boundaries, one file per student. A checkpoint holds the learner (with its
+    random stream), the tutor state and random stream, the session scheduling
+    random stream and the session counter. Logs are flushed to the db before
+    each checkpoint, so resuming only loses the work after the last checkpoint
+
+    """
+
+    def __init__(self, path, curric, every=1):
+        self.path = path
+        self.curric = curric
+        # Number of sessions between checkpoints
+        self.every = every
+        os.makedirs(path, exist_ok=True)
+
+        # Index every curriculum object by _id so it can be pickled by reference
+        objs = [curric, curric.domain] + list(curric.domain.kcs)
+        for unit in curric.units:
+            objs.append(unit)
+            for sect in unit.sections:
+                objs.append(sect)
+                for prob in sect.problems:
+                    objs.append(prob)
+                    objs.extend(prob.steps)
+        self.objs = {obj._id: obj for obj in objs}
+        self.refs = {id(obj): obj._id for obj in objs}
+        # Skill and mastery arrays share the domain's kc index
+        index = curric.domain.get_kc_index()
+        self.objs['kc_index'] = index
+        self.refs[id(index)] = 'kc_index'
+
+    def get_path(self, stu_id):
+        return os.path.join(self.path, f"{stu_id}.ckpt")
+
+    def has_checkpoint(self, stu_id):
+        return os.path.exists(self.get_path(stu_id))
+
+    def save(self, sim, finished=False):
+        """
+        Write a checkpoint of the given simulation. Logs are flushed first so
+        the db holds every record up to the checkpoint
+
+        """
+        # Checkpoint the objects without any timing wrappers
+        if sim.timer is not None:
+            sim.timer.release()
+        sim.log.write_to_db()
+        ckpt = {'sim_id': sim._id,
+                'start': sim.start,
+                'class_start': sim.class_start,
+                'state': sim.state,
+                'rng': sim.rng,
+                'student': sim.student,
+                'tutor_id': sim.tutor._id,
+                'tutor_state': sim.tutor.state,
+                'tutor_rng': sim.tutor.rng,
+                'time': sim.get_sim_time(sim.state['clock']),
+                'finished': finished
+               }
+        buf = io.BytesIO()
+        _CurricPickler(buf, self.refs).dump(ckpt)
+
+        # Write to a temp file and rename so a crash never leaves a partial checkpoint
+        path = self.get_path(sim.student._id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buf.getvalue())
+        os.replace(tmp_path, path)
+        if sim.timer is not None:
+            sim.timer.instrument(sim)
+        logger.debug(f"Saved checkpoint for student {sim.student._id} at session {sim.state['session_num']}")
+
+    def load(self, stu_id):
+        with open(self.get_path(stu_id), 'rb') as f:
+            return _CurricUnpickler(f, self.objs).load()
+
+    def session_end(self, sim):
+        # Called by the simulation after every completed class session
+        if sim.state['session_num'] == sim.num_sessions:
+            self.save(sim, finished=True)
+        elif (sim.state['session_num'] % self.every) == 0:
+            self.save(sim)
+
+    def resume(self, sim, db):
+        """
+        Restore a simulation from its student's last checkpoint and remove any
+        records logged after it. Saves an initial checkpoint if there is none.
+        Returns True if the student had already finished simulating
+
+        """
+        stu_id = sim.student._id
+        if not self.has_checkpoint(stu_id):
+            self.save(sim)
+            return False
+
+        ckpt = self.load(stu_id)
+        sim._id = ckpt['sim_id']
+        sim.start = ckpt['start']
+        sim.class_start = ckpt['class_start']
+        sim.state = ckpt['state']
+        sim.rng = ckpt['rng']
+        sim.student = ckpt['student']
+        sim.tutor._id = ckpt['tutor_id']
+        sim.tutor.state = ckpt['tutor_state']
+        sim.tutor.rng = ckpt['tutor_rng']
+        sim.log.student = sim.student
+        sim.log.tutor = sim.tutor
+
+        if ckpt['finished']:
+            logger.debug(f"Student {stu_id} already finished. Skipping")
+            return True
+
+        self.rollback_logs(db, stu_id, ckpt['time'])
+        logger.info(f"Resuming student {stu_id} from session {sim.state['session_num']}")
+        return False
+
+    def rollback_logs(self, db, stu_id, time):
+        # Remove records of a student's unfinished session logged after a checkpoint
+        db.decisions.delete_many({'student_id': stu_id, 'time': {'$gt': time}})
+        db.actions.delete_many({'student_id': stu_id, 'time': {'$gt': time}})
+        db.tutor_events.delete_many({'stu_id': stu_id, 'time': {'$gt': time}})
+        db.sessions.delete_many({'students': stu_id, 'start': {'$gt': time}})
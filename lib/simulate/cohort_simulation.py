@@ -0,0 +1,478 @@
+# Simulation of a cohort of students advancing through their tutors in lockstep
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import math
+import datetime as dt
+
+import numpy as np
+
+from log_db.sim_logger import SimLogger
+from log_db.learner_log import Decision
+from context.context import ClassSessionContext
+from tutor.action import *
+from tutor.session import ClassSession
+from learner.cognition import BinarySkillCognition, PCorSkillCognition
+from learner.decider import EVDecider, DiligentDecider, Diligence, DomainSelfEff
+from learner.ev_kernel import DeciderArrays
+from tutor.kc_index import KCArray
+from tutor.bkt import bkt_update
+from sampling.truncnorm import truncnorm_many
+from .simulation import TimedSimulation
+
+logger = logging.getLogger(__name__)
+# logger.setLevel(logging.DEBUG)
+
+# Columns of the cohort action matrices. Order matches ClassSessionContext.get_actions
+# so that the logged pev lists line up with the per-student simulation
+ACTIONS = [Attempt, Guess, HintRequest, OffTask, StopWork]
+ATTEMPT, GUESS, HINT, OFFTASK, STOPWORK = range(len(ACTIONS))
+
+SUPPORTED_DECIDERS = (EVDecider, DiligentDecider)
+SUPPORTED_CONSTRUCTS = (Diligence, DomainSelfEff)
+
+
+class MasteryRow:
+    """
+    Dict-like view of a single student's row of the cohort mastery array.
+    Installed as SimpleTutorState.mastery so tutor navigation reads the
+    mastery estimates updated in bulk by the cohort
+
+    """
+
+    def __init__(self, mastery, row, kc_pos):
+        self.mastery = mastery
+        self.row = row
+        self.kc_pos = kc_pos
+
+    def __getitem__(self, kc):
+        return float(self.mastery[self.row, self.kc_pos[kc._id]])
+
+    def __setitem__(self, kc, val):
+        self.mastery[self.row, self.kc_pos[kc._id]] = val
+
+    def __contains__(self, kc):
+        return kc._id in self.kc_pos
+
+
+class CohortSim(TimedSimulation):
+    """
+    Simulates many independent students through class sessions at once.
+    Learner skills, decider parameters, tutor mastery and step cursors are
+    held in arrays indexed by student so that decisions, action durations,
+    answers and knowledge tracing updates are computed for the whole cohort
+    at each step. Curriculum navigation and log records are still handled
+    per student by each SimpleTutor and SimLogger so the logged decisions,
+    actions, transactions and sessions match SingleStudentSim.
+
+    Supports ModularLearners using Binary, PCor or Bias skill cognition and
+    EVDecider/DiligentDecider deciders with constant base values and
+    expectancies and Diligence and DomainSelfEff constructs.
+
+    Learner draws (decisions, action times, answers and learning) come from
+    one stream seeded by seed and shared by the cohort instead of each
+    learner's own stream, so a run is reproducible for the same seed but
+    matches SingleStudentSim runs of the same students only in
+    distribution. Tutors still navigate with their own streams.
+
+    """
+
+    def __init__(self, db, start,
+                 students, tutors,
+                 num_sessions, m_ses_len, sd_ses_len,
+                 max_ses_len, seed=None
+                ):
+        super().__init__(None, start)
+        self.db = db
+        self.students = students
+        self.tutors = tutors
+        self.num_sessions = num_sessions
+        self.m_ses_len = m_ses_len
+        self.sd_ses_len = sd_ses_len
+        self.max_ses_len = max_ses_len
+        self.rng = np.random.default_rng(seed)
+
+        self.state = {'session_num': 0}
+        self.logs = [SimLogger(db, stu, tutor) for stu, tutor in zip(students, tutors)]
+
+        self.init_kc_index()
+        self.init_skills()
+        self.init_deciders()
+        self.init_tutors()
+        self.set_class_start()
+
+    def __len__(self):
+        return len(self.students)
+
+    def init_kc_index(self):
+        # Dense index of all kcs in the domain shared by the cohort
+        self.kc_index = self.tutors[0].curric.domain.get_kc_index()
+        self.kcs = self.kc_index.kcs
+        self.kc_pos = self.kc_index.pos
+        self.kc_pl0 = self.kc_index.params('pl0')
+        self.kc_pt = self.kc_index.params('pt')
+        self.kc_ps = self.kc_index.params('ps')
+        self.kc_pg = self.kc_index.params('pg')
+        self.kc_m_time = self.kc_index.params('m_time')
+        self.kc_sd_time = self.kc_index.params('sd_time')
+
+    def init_skills(self):
+        n = len(self)
+        self.skills = np.zeros((n, len(self.kcs)))
+        self.is_binary = np.zeros(n, dtype=bool)
+        for i, stu in enumerate(self.students):
+            if isinstance(stu.cog, BinarySkillCognition):
+                self.is_binary[i] = True
+            elif not isinstance(stu.cog, PCorSkillCognition):
+                raise ValueError(f"CohortSim does not support cognition module: {stu.cog.type}")
+            if isinstance(stu.skills, KCArray) and (stu.skills.index.ids == self.kc_index.ids):
+                self.skills[i] = stu.skills.array
+            else:
+                for kc_id, val in stu.skills.items():
+                    self.skills[i, self.kc_pos[kc_id]] = float(val)
+
+        self.total_attempts = np.array([stu.state['total_attempts'] for stu in self.students])
+        self.total_success = np.array([stu.state['total_success'] for stu in self.students])
+        self.off_task = np.array([stu.state['off_task'] for stu in self.students], dtype=bool)
+        self.attempted = np.array([stu.state['attempted'] for stu in self.students], dtype=bool)
+
+        ot_attrs = ['min_off_task', 'max_off_task', 'mean_off_task']
+        self.ot_attrs = {attr: np.array([stu.attributes[attr] for stu in self.students], dtype=float)
+                         for attr in ot_attrs}
+
+    def init_deciders(self):
+        n = len(self)
+        self.diligence = np.zeros(n)
+        self.has_diligence = np.zeros(n, dtype=bool)
+        self.mean_start = np.zeros(n)
+        self.start_sd = np.zeros(n)
+
+        for i, stu in enumerate(self.students):
+            dec = stu.decider
+            if type(dec) not in SUPPORTED_DECIDERS:
+                raise ValueError(f"CohortSim does not support decider: {dec.type}")
+            for c in dec.constructs.values():
+                if type(c) not in SUPPORTED_CONSTRUCTS:
+                    raise ValueError(f"CohortSim does not support decision construct: {type(c).__name__}")
+
+            if Diligence in dec.constructs:
+                self.has_diligence[i] = True
+                self.diligence[i] = dec.constructs[Diligence].diligence
+            self.mean_start[i] = dec.attr['mean_start']
+            self.start_sd[i] = dec.attr['start_sd']
+
+        # Compiled ev pipelines of every decider for batch decisions
+        try:
+            self.decider_arrays = DeciderArrays([stu.decider for stu in self.students],
+                                                [stu.state for stu in self.students], ACTIONS)
+        except ValueError as e:
+            raise ValueError(f"CohortSim does not support decider: {e}")
+
+    def init_tutors(self):
+        n = len(self)
+        self.mastery = np.zeros((n, len(self.kcs)))
+        for i, tutor in enumerate(self.tutors):
+            mastery = tutor.state.mastery
+            if isinstance(mastery, KCArray) and (mastery.index.ids == self.kc_index.ids):
+                self.mastery[i] = mastery.array
+            else:
+                for kc, val in mastery.items():
+                    self.mastery[i, self.kc_pos[kc._id]] = val
+            tutor.state.mastery = MasteryRow(self.mastery, i, self.kc_pos)
+
+        # Step cursors
+        self.cur_kc = np.zeros(n, dtype=int)
+        self.hints_avail = np.zeros(n, dtype=int)
+        self.hints_used = np.zeros(n, dtype=int)
+        self.attempt = np.zeros(n, dtype=int)
+        self.has_more = np.zeros(n, dtype=bool)
+        for i in range(n):
+            self.sync_cursor(i)
+
+    def sync_cursor(self, i):
+        # Refresh step cursor arrays after tutor navigation
+        state = self.tutors[i].state
+        self.has_more[i] = self.tutors[i].has_more()
+        if self.has_more[i]:
+            self.cur_kc[i] = self.kc_pos[state.step.kcs[0]._id]
+            self.hints_avail[i] = state.hints_avail
+            self.hints_used[i] = state.hints_used
+            self.attempt[i] = state.attempt
+
+    def set_class_start(self):
+        """
+        Set the regular class start time for each student to some random time in a school day
+
+        """
+        school_start = 7
+        school_end = 12+2.5
+        steps = 0.25 # 15 minute class start intervals
+        day_intervals = np.arange(school_start, school_end - 1, steps)
+        class_start = self.rng.choice(day_intervals, size=len(self))
+        self.class_start = [dt.time(hour=math.floor(cs), minute=int((cs - math.floor(cs))*60))
+                            for cs in class_start]
+
+    def get_next_class_sessions(self):
+        """
+        Returns a list of class sessions for the next session of each student
+
+        """
+        n = len(self)
+        length = truncnorm_many(self.rng, self.m_ses_len, self.sd_ses_len, 0, self.max_ses_len, size=n)
+        sessions = []
+        for i, stu in enumerate(self.students):
+            first_class = dt.datetime(year=self.start.year, month=self.start.month, day=self.start.day,
+                                      hour=self.class_start[i].hour, minute=self.class_start[i].minute)
+            if (self.start - first_class).total_seconds() > 0:
+                first_class = first_class + dt.timedelta(days=1)
+            next_class = first_class + dt.timedelta(days=self.state['session_num'])
+            sessions.append(ClassSession(start=next_class,
+                                         end=next_class+dt.timedelta(minutes=length[i]),
+                                         sim_id=self._id,
+                                         students=[stu._id]
+                                        ))
+        return sessions
+
+    def start_working(self, max_t):
+        # Vectorized EVDecider.start_working
+        mean_start = np.where(max_t*60 < self.mean_start, max_t, self.mean_start)
+        w = np.where(self.has_diligence, 1 + self.diligence / 10, 1)
+        mu = np.maximum(mean_start * w, 1)
+        return truncnorm_many(self.rng, mu, self.start_sd, 0, max_t)
+
+    def choose(self, idx, avail, tt_end):
+        """
+        Batch EVDecider.choose for the students in idx given a mask of
+        available actions. Returns the choice column and the decision data
+
+        """
+        return self.decider_arrays.choose_many(idx, avail, tt_end, self.rng)
+
+    def perform_actions(self, idx, choice):
+        """
+        Vectorized ModularLearner.perform_action. Returns durations, answer
+        outcomes (None for no answer) for the students in idx
+
+        """
+        n = len(idx)
+        kc = self.cur_kc[idx]
+        m = self.kc_m_time[kc]
+        sd = self.kc_sd_time[kc]
+        time = np.zeros(n)
+        is_correct = np.zeros(n, dtype=bool)
+        has_answer = np.ones(n, dtype=bool)
+
+        att = choice == ATTEMPT
+        if np.any(att):
+            time[att] = truncnorm_many(self.rng, m[att], sd[att], low=0.25)
+            skl = self.skills[idx[att], kc[att]]
+            binary = self.is_binary[idx[att]]
+            hint_exp = self.hints_used[idx[att]] / (self.hints_used[idx[att]] + self.hints_avail[idx[att]])
+            # Binary skill probability of correct
+            pg = self.kc_pg[kc[att]]
+            p_bin = np.where(skl == 1, 1 - self.kc_ps[kc[att]], pg + (1 - pg) * hint_exp)
+            # Continuous skill probability of producing an answer and being correct
+            p_cont = skl + (1 - skl) * hint_exp
+            self.attempted[idx[att]] = True
+            u = self.rng.random((2, np.sum(att)))
+            has_answer[att] = binary | (u[0] < p_cont)
+            is_correct[att] = np.where(binary, u[1] < p_bin, u[1] < p_cont)
+
+        hint = choice == HINT
+        if np.any(hint):
+            time[hint] = truncnorm_many(self.rng, m[hint] / 2, sd[hint] / 2, low=1)
+
+        guess = choice == GUESS
+        if np.any(guess):
+            is_correct[guess] = self.rng.random(np.sum(guess)) < 0.01
+            time[guess] = truncnorm_many(self.rng, m[guess] / 4, sd[guess] / 4, low=1)
+
+        off = choice == OFFTASK
+        if np.any(off):
+            sub = idx[off]
+            w = np.where(self.has_diligence[sub], 1 - self.diligence[sub] / 16, 1)
+            ot_min = self.ot_attrs['min_off_task'][sub] * w
+            ot_max = self.ot_attrs['max_off_task'][sub] * w
+            ot_mean = self.ot_attrs['mean_off_task'][sub] * w
+            time[off] = truncnorm_many(self.rng, ot_mean, (ot_max - ot_mean) / 3, ot_min, ot_max)
+
+        # Learning from correct attempts
+        learn = att & has_answer & is_correct
+        if np.any(learn):
+            self.practice_skills(idx[learn], kc[learn])
+
+        return time, is_correct, has_answer
+
+    def practice_skills(self, idx, kc):
+        # Vectorized cognition module practice_skill
+        skl = self.skills[idx, kc]
+        pt = self.kc_pt[kc]
+        binary = self.is_binary[idx]
+        learned = self.rng.random(len(idx)) < pt
+        new_skl = np.where(binary, np.where(learned, 1.0, skl), np.minimum(skl + pt, 1))
+        self.skills[idx, kc] = np.where(skl == 1, skl, new_skl)
+
+    def update_mastery(self, idx, is_correct):
+        """
+        Vectorized SimpleTutor.update_skill for the current kc of the students in idx.
+        Returns the mastery before and after the update
+
+        """
+        kc = self.cur_kc[idx]
+        plt = self.mastery[idx, kc]
+        ps = self.kc_ps[kc]
+        pg = self.kc_pg[kc]
+        first = self.attempt[idx] == 0
+        plt1 = bkt_update(plt, is_correct, self.kc_pt[kc], ps, pg)
+        plt1 = np.where(first, plt1, plt)
+        self.mastery[idx, kc] = plt1
+        return plt, plt1
+
+    def get_context(self, i, session, t):
+        tutor = self.tutors[i]
+        kc = self.kcs[self.cur_kc[i]]
+        val = self.skills[i, self.cur_kc[i]]
+        learner_state = {'off_task': bool(self.off_task[i]),
+                         'skills': {kc._id: bool(val) if self.is_binary[i] else float(val)}}
+        return ClassSessionContext(tutor.state, learner_state, session, t)
+
+    def study(self, sessions, now, end):
+        """
+        Simulate all students working on their tutors until the end of the
+        class session, they stop work or they complete the curriculum.
+        Returns the logout time of each student
+
+        """
+        studying = self.has_more.copy()
+        logout = now.copy()
+        while np.any(studying):
+            idx = np.flatnonzero(studying)
+            avail = np.ones((len(idx), len(ACTIONS)), dtype=bool)
+            avail[:, HINT] = self.hints_avail[idx] > 0
+            avail[:, OFFTASK] = ~self.off_task[idx]
+
+            times = [self.get_sim_time(now[i]) for i in idx]
+            tt_end = np.array([(sessions[i].end - t).total_seconds() for i, t in zip(idx, times)])
+            choice, exp, val, ev, pev = self.choose(idx, avail, tt_end)
+            time, is_correct, has_answer = self.perform_actions(idx, choice)
+
+            # Knowledge tracing for all attempts, guesses and hint requests
+            answered = ((choice == ATTEMPT) & has_answer) | (choice == GUESS)
+            tutored = answered | (choice == HINT)
+            plt = np.zeros(len(idx))
+            plt1 = np.zeros(len(idx))
+            if np.any(tutored):
+                plt[tutored], plt1[tutored] = self.update_mastery(idx[tutored],
+                                                                  is_correct[tutored] & answered[tutored])
+
+            for j, i in enumerate(idx):
+                t = times[j]
+                stu = self.students[i]
+                tutor = self.tutors[i]
+                log = self.logs[i]
+                cntxt = self.get_context(i, sessions[i], t)
+
+                choices = [a for k, a in enumerate(ACTIONS) if avail[j, k]]
+                choice_evs = {a.__name__: {'expectancy': float(exp[j, k]),
+                                           'value': float(val[j, k]),
+                                           'ev': float(ev[j, k])}
+                              for k, a in enumerate(ACTIONS) if avail[j, k]}
+                decision = Decision(stu, ACTIONS[choice[j]].__name__, t, choice_evs,
+                                    [float(pev[j, k]) for k in range(len(ACTIONS)) if avail[j, k]], cntxt)
+                log.log_decision(decision)
+
+                c = choice[j]
+                if c == ATTEMPT:
+                    if has_answer[j]:
+                        act = Attempt(float(time[j]), bool(is_correct[j]))
+                    else:
+                        act = FailedAttempt(float(time[j]))
+                elif c == GUESS:
+                    act = Guess(float(time[j]), bool(is_correct[j]))
+                elif c == HINT:
+                    act = HintRequest(float(time[j]))
+                elif c == OFFTASK:
+                    act = OffTask(float(time[j]))
+                else:
+                    act = StopWork(0)
+                log.log_action(act, cntxt)
+
+                if c == STOPWORK:
+                    logger.debug(f"Student {stu._id} chose to stop working")
+                    studying[i] = False
+                    logout[i] = now[i]
+                    continue
+
+                if tutored[j]:
+                    # Mastery was updated in bulk above
+                    fdbk, tx = tutor.record_input(act, t, float(plt[j]), float(plt1[j]))
+                    if c != HINT:
+                        self.total_attempts[i] += 1
+                        if act.is_correct:
+                            self.total_success[i] += 1
+                    logger.debug("Processing feedback: %s" % str(fdbk))
+                    log.log_transaction(tx)
+                    self.sync_cursor(i)
+
+                now[i] = now[i] + act.time
+                if now[i] > end[i]:
+                    # Interrupted by the end of class. Like study_direct, an action ending
+                    # exactly at the end of class is followed by one more step
+                    studying[i] = False
+                    logout[i] = end[i]
+                elif not self.has_more[i]:
+                    studying[i] = False
+                    logout[i] = now[i]
+
+        return logout
+
+    def run(self):
+        logger.debug(f"Starting cohort sim for {len(self)} students")
+        for s in range(self.num_sessions):
+            sessions = self.get_next_class_sessions()
+            length = np.array([ses.length() for ses in sessions])
+            ses_start = np.array([self.convert_to_sim_time(ses.start) for ses in sessions])
+
+            # Start working
+            delay = self.start_working(length)
+            now = ses_start + delay
+            end = now + (length - delay)
+
+            # Login to tutors
+            for i, tutor in enumerate(self.tutors):
+                tx = tutor.login(sessions[i], self.get_sim_time(now[i]))
+                self.logs[i].log_transaction(tx)
+
+            logout = self.study(sessions, now, end)
+
+            # Logout of tutors and log sessions
+            for i, tutor in enumerate(self.tutors):
+                tx = tutor.logout(sessions[i], self.get_sim_time(logout[i]))
+                self.logs[i].log_transaction(tx)
+                self.logs[i].log_session(sessions[i])
+
+            self.state['session_num'] += 1
+            logger.debug(f"Completed cohort session #{s}")
+
+        self.finish()
+
+    def finish(self):
+        # Write back array state to the student and tutor objects and flush logs
+        for i, stu in enumerate(self.students):
+            if isinstance(stu.skills, KCArray) and (stu.skills.index.ids == self.kc_index.ids):
+                stu.skills.set_array(self.skills[i])
+            else:
+                for kc_id in stu.skills:
+                    val = self.skills[i, self.kc_pos[kc_id]]
+                    stu.skills[kc_id] = bool(val) if self.is_binary[i] else float(val)
+            stu.state['total_attempts'] = int(self.total_attempts[i])
+            stu.state['total_success'] = int(self.total_success[i])
+            stu.state['attempted'] = bool(self.attempted[i])
+
+            tutor = self.tutors[i]
+            tutor.state.mastery = KCArray(self.kc_index, self.mastery[i].copy(), by_kc=True)
+
+        for log in self.logs:
+            log.write_to_db()
@@ -0,0 +1,159 @@
+# Sequential sampling with convergence based early stopping for simulation batches
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import math
+
+from scipy import stats
+
+logger = logging.getLogger(__name__)
+
+
+class RunningStat:
+    """
+    Running mean and variance of a stream of values using Welford's
+    algorithm, with t-distribution confidence intervals of the mean
+
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        # Sum of squared deviations from the mean
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def variance(self):
+        if self.n < 2:
+            return float('nan')
+        return self.m2 / (self.n - 1)
+
+    def sem(self):
+        return math.sqrt(self.variance() / self.n)
+
+    def ci_halfwidth(self, confidence=0.95):
+        if self.n < 2:
+            return float('inf')
+        return float(stats.t.ppf(0.5 + confidence / 2, self.n - 1)) * self.sem()
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'sd': math.sqrt(self.variance()) if self.n > 1 else None}
+
+
+# Per student metrics computed from a finished SingleStudentSim
+
+def mean_mastery(sim):
+    # Tutor estimate of the student's mastery averaged over all kcs
+    mastery = sim.tutor.state.mastery
+    return sum(mastery.values()) / len(mastery)
+
+def off_task_rate(sim):
+    counts = sim.log.action_counts
+    total = sum(counts.values())
+    if total == 0:
+        return None
+    return counts['OffTask'] / total
+
+def correct_rate(sim):
+    state = sim.student.state
+    if state['total_attempts'] == 0:
+        return None
+    return state['total_success'] / state['total_attempts']
+
+METRICS = {'mean_mastery': mean_mastery,
+           'off_task_rate': off_task_rate,
+           'correct_rate': correct_rate
+          }
+
+
+class ConvergenceTarget:
+    """
+    Tracks the running estimate of one metric across students. Converges
+    once the confidence interval half width of its mean is within tol, or
+    within tol times the mean when relative
+
+    """
+
+    def __init__(self, metric, tol, relative=False, confidence=0.95):
+        if callable(metric):
+            self.name = metric.__name__
+            self.metric = metric
+        elif metric in METRICS:
+            self.name = metric
+            self.metric = METRICS[metric]
+        else:
+            raise ValueError("Unknown convergence metric: %s" % str(metric))
+        self.tol = tol
+        self.relative = relative
+        self.confidence = confidence
+        self.stat = RunningStat()
+
+    def update(self, sim):
+        # Students the metric is undefined for do not count toward its estimate
+        val = self.metric(sim)
+        if val is not None:
+            self.stat.add(val)
+
+    def get_tol(self):
+        if self.relative:
+            return self.tol * abs(self.stat.mean)
+        return self.tol
+
+    def is_converged(self):
+        return self.stat.ci_halfwidth(self.confidence) <= self.get_tol()
+
+    def to_dict(self):
+        out = self.stat.to_dict()
+        out.update({'metric': self.name,
+                    'tol': self.tol,
+                    'relative': self.relative,
+                    'confidence': self.confidence,
+                    'ci_halfwidth': self.stat.ci_halfwidth(self.confidence),
+                    'converged': self.is_converged()
+                   })
+        return out
+
+
+class SequentialStopping:
+    """
+    Stopping rule for sequentially sampled simulation batches. Students are
+    added until every target has converged, after at least min_students
+    and no more than max_students
+
+    """
+
+    def __init__(self, targets, min_students=30, max_students=None):
+        self.targets = targets
+        self.min_students = min_students
+        self.max_students = max_students
+        self.num_students = 0
+
+    def update(self, sim):
+        self.num_students += 1
+        for target in self.targets:
+            target.update(sim)
+
+    def is_converged(self):
+        if self.num_students < self.min_students:
+            return False
+        return all(target.is_converged() for target in self.targets)
+
+    def should_stop(self):
+        if (self.max_students is not None) and (self.num_students >= self.max_students):
+            return True
+        return self.is_converged()
+
+    def to_dict(self):
+        return {'num_students': self.num_students,
+                'min_students': self.min_students,
+                'max_students': self.max_students,
+                'converged': self.is_converged(),
+                'targets': [target.to_dict() for target in self.targets]
+               }
@@ -0,0 +1,169 @@
+# Process pool runner for simulating batches of independent students in parallel
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import math
+import os
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import dill
+import simpy
+
+from log_db import mongo
+from log_db.curriculum_store import load_curriculum
+from tutor.tutor import SimpleTutor
+from simulate.simulation import SingleStudentSim
+from simulate.checkpoint import SimCheckpointer
+from simulate.profiling import PhaseTimer
+from sampling.rng import spawn_seeds
+
+logger = logging.getLogger(__name__)
+
+# Per worker process state set once by the pool initializer
+_worker = {}
+
+
+def init_worker(db_params, curric_src):
+    """
+    Pool initializer. Opens a db connection for this worker process and
+    loads the curriculum once so it is not resent with every shard.
+    curric_src is a pickled curriculum or the path of one saved by
+    save_curriculum, which workers open from disk
+
+    """
+    _worker['db'] = mongo.connect(db_params['url'],
+                                  db_params['port'],
+                                  db_params['name'],
+                                  db_params['user'],
+                                  db_params['pswd'])
+    if isinstance(curric_src, str):
+        _worker['curric'] = load_curriculum(curric_src)
+    else:
+        _worker['curric'] = dill.loads(curric_src)
+
+
+def simulate_shard(shard_pickle, seeds, sim_params):
+    """
+    Simulate a shard of students in their own simpy environment and persist
+    the final students. seeds holds each student's tutor and session
+    scheduling seeds. Returns the pickled students with their final state
+    and their phase timings when profiling
+
+    """
+    db = _worker['db']
+    curric = _worker['curric']
+    students = dill.loads(shard_pickle)
+    logger.info(f"Worker {os.getpid()} simulating shard of {len(students)} students")
+
+    checkpointer = None
+    if sim_params['checkpoint_dir'] is not None:
+        checkpointer = SimCheckpointer(sim_params['checkpoint_dir'], curric, sim_params['checkpoint_every'])
+
+    env = simpy.Environment()
+    final_stus = []
+    sims = []
+    for stu, (tutor_seed, sim_seed) in zip(students, seeds):
+        tutor = SimpleTutor(curric, stu._id, sim_params['mastery_thres'], tutor_seed)
+        sim = SingleStudentSim(db, env, sim_params['sim_start'], stu, tutor,
+                               sim_params['num_sessions'], sim_params['m_ses_len'],
+                               sim_params['sd_ses_len'], sim_params['max_ses_len'], sim_seed,
+                               checkpointer, PhaseTimer() if sim_params['profile'] else None)
+        sims.append(sim)
+        finished = False
+        if checkpointer is not None:
+            finished = checkpointer.resume(sim, db)
+        final_stus.append(sim.student)
+
+        if finished:
+            continue
+        elif sim_params['executor'] == 'direct':
+            sim.run_direct()
+        else:
+            env.process(sim.run())
+    env.run()
+
+    if len(final_stus) > 0:
+        if checkpointer is not None:
+            # Replace final students persisted by an earlier run of this shard
+            db.finalsimstudents.delete_many({'_id': {'$in': [stu._id for stu in final_stus]}})
+        count = mongo.insert_chunked(db.finalsimstudents, (stu.to_dict() for stu in final_stus))
+        logger.debug("Inserted %i students to db" % count)
+
+    timings = {}
+    if sim_params['profile']:
+        timings = {sim.student._id: sim.timer.to_dict() for sim in sims}
+
+    return dill.dumps((final_stus, timings))
+
+
+class ParallelSimRunner:
+    """
+    Shards independent students across a pool of worker processes. Each
+    worker simulates its shards with its own simpy environment, db
+    connection and SimLoggers. Results are merged into a single SimulationBatch
+
+    """
+
+    def __init__(self, db_params, num_workers=None, shards_per_worker=4):
+        self.db_params = db_params
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        self.num_workers = num_workers
+        # Use several shards per worker so uneven students balance out across the pool
+        self.shards_per_worker = shards_per_worker
+
+    def get_shards(self, students):
+        num_shards = min(len(students), self.num_workers * self.shards_per_worker)
+        size = math.ceil(len(students) / num_shards)
+        return [students[i:i+size] for i in range(0, len(students), size)]
+
+    def run(self, curric, students, batch, num_sessions,
+            mastery_thres=0.95, m_ses_len=45, sd_ses_len=8, max_ses_len=60, seed=None,
+            executor='simpy', checkpoint_dir=None, checkpoint_every=1, profile=False):
+        # curric can be the path of a curriculum saved by save_curriculum instead of the curriculum
+        if executor not in ('simpy', 'direct'):
+            raise ValueError("Unknown simulation executor: %s" % executor)
+        curric_src = curric if isinstance(curric, str) else dill.dumps(curric)
+        sim_params = {'sim_start': dt.datetime.now(),
+                      'num_sessions': num_sessions,
+                      'mastery_thres': mastery_thres,
+                      'm_ses_len': m_ses_len,
+                      'sd_ses_len': sd_ses_len,
+                      'max_ses_len': max_ses_len,
+                      'executor': executor,
+                      'checkpoint_dir': checkpoint_dir,
+                      'checkpoint_every': checkpoint_every,
+                      'profile': profile
+                     }
+        if len(students) == 0:
+            return batch, students
+
+        # Seeds are derived per student, so results do not depend on how students are sharded
+        seeds = [tuple(s.spawn(2)) for s in spawn_seeds(seed, len(students))]
+        shards = self.get_shards(students)
+        shard_seeds = self.get_shards(seeds)
+        logger.info("Simulating %i students in %i shards across %i workers" %
+                    (len(students), len(shards), self.num_workers))
+
+        results = []
+        timings = {}
+        with ProcessPoolExecutor(max_workers=self.num_workers,
+                                 initializer=init_worker,
+                                 initargs=(self.db_params, curric_src)) as pool:
+            futures = [pool.submit(simulate_shard, dill.dumps(shard), shard_seeds[i], sim_params)
+                       for i, shard in enumerate(shards)]
+            for i, future in enumerate(futures):
+                shard_stus, shard_timings = dill.loads(future.result())
+                logger.info("Completed shard #%i with %i students" % (i, len(shard_stus)))
+                results.extend(shard_stus)
+                timings.update(shard_timings)
+
+        for stu in results:
+            batch.add_student(stu)
+            if stu._id in timings:
+                batch.add_timings(stu._id, timings[stu._id])
+
+        return batch, results
@@ -0,0 +1,150 @@
+# Vectorized generation of student populations with lazily built learners
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import os
+import copy
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from learner.cognition import BinarySkillCognition, PCorSkillCognition, BiasSkillCognition
+from learner.decider import DiligentDecider, Diligence, DomainSelfEff
+from learner.modular_learner import ModularLearner
+from sampling.rng import make_stream
+from sampling.truncnorm import truncnorm_many
+
+logger = logging.getLogger(__name__)
+
+
+# Default standard deviation of initial skills for kcs without a pl0_sd
+DEFAULT_SKILL_SD = 0.1
+
+SUPPORTED_COGNITION = (BinarySkillCognition, PCorSkillCognition, BiasSkillCognition)
+
+
+class StudentPopulation:
+    """
+    Parameters of a population of ModularLearners held as arrays. Ability,
+    diligence, self-efficacy and the initial skills of every kc are sampled
+    for all students at once, and a student's learner is only built when it
+    is indexed or iterated, so large populations can be generated up front
+    and materialized a shard at a time.
+
+    Each access builds a new learner, so keep the learners that are
+    simulated. Slicing returns a population of the selected students, which
+    is small to pickle and can be materialized in a worker process.
+    Student i's random stream is seeded with child i of the population seed
+    like spawn_seeds, regardless of how the population is sliced
+
+    """
+
+    def __init__(self, domain, num_students, seed=None,
+                 cog_type=BiasSkillCognition,
+                 m_diligence=0, sd_diligence=1,
+                 m_self_eff=None, sd_self_eff=1,
+                 decider_attr={}, block_size=10000):
+        if cog_type not in SUPPORTED_COGNITION:
+            raise ValueError(f"StudentPopulation does not support cognition module: {cog_type.__name__}")
+        self.domain = domain
+        self.cog_type = cog_type
+        self.decider_attr = decider_attr
+        self.seed_seq = np.random.SeedSequence(seed)
+        # Position of the first student within the full population
+        self.offset = 0
+
+        n = num_students
+        # Student ids from bulk random bytes instead of one uuid4 call per student
+        self.ids = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16)
+
+        # Population parameters are drawn from the root seed, whose stream is
+        # independent of the students' streams seeded by its children
+        rng = np.random.default_rng(self.seed_seq)
+        self.ability = rng.triangular(-1, 0, 1, n)
+        self.diligence = rng.normal(m_diligence, sd_diligence, n)
+        if m_self_eff is None:
+            self.self_eff = None
+        else:
+            self.self_eff = rng.normal(m_self_eff, sd_self_eff, n)
+        self.skills = self.sample_skills(rng, n, block_size)
+
+    def sample_skills(self, rng, n, block_size):
+        # Students x kcs initial skills, sampled in blocks of students to bound temporary arrays
+        index = self.domain.get_kc_index()
+        pl0 = index.params('pl0')
+        sd = np.array([getattr(kc, 'pl0_sd', DEFAULT_SKILL_SD) for kc in index.kcs], dtype=float)
+        skills = np.zeros((n, len(index)), dtype=self.cog_type.skill_dtype)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            if issubclass(self.cog_type, BiasSkillCognition):
+                mu = pl0 + self.ability[start:stop, None] * 2 * sd
+                skills[start:stop] = truncnorm_many(rng, mu, sd, 0, 1)
+            elif issubclass(self.cog_type, PCorSkillCognition):
+                skills[start:stop] = truncnorm_many(rng, pl0, sd, 0, 1, size=(stop - start, len(pl0)))
+            else:
+                skills[start:stop] = rng.random((stop - start, len(pl0))) < pl0
+        return skills
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.slice(i)
+        if i < 0:
+            i += len(self)
+        if (i < 0) or (i >= len(self)):
+            raise IndexError("Student index out of range")
+        return self.make_student(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.make_student(i)
+
+    def slice(self, s):
+        start, stop, step = s.indices(len(self))
+        if step != 1:
+            raise ValueError("Populations can only be sliced into contiguous students")
+        out = copy.copy(self)
+        out.offset = self.offset + start
+        out.ids = self.ids[start:stop]
+        out.ability = self.ability[start:stop]
+        out.diligence = self.diligence[start:stop]
+        if self.self_eff is not None:
+            out.self_eff = self.self_eff[start:stop]
+        out.skills = self.skills[start:stop]
+        return out
+
+    def get_id(self, i):
+        return str(uuid.UUID(bytes=self.ids[i].tobytes(), version=4))
+
+    def get_seed(self, i):
+        # Child of the population seed matching spawn_seeds(seed, n)[offset + i]
+        return np.random.SeedSequence(self.seed_seq.entropy,
+                                      spawn_key=self.seed_seq.spawn_key + (self.offset + i,))
+
+    def make_student(self, i):
+        rng = make_stream(self.get_seed(i))
+        attrs = {}
+        if issubclass(self.cog_type, BiasSkillCognition):
+            attrs['ability'] = float(self.ability[i])
+        cog = self.cog_type.from_skills(self.domain, self.skills[i].copy(), rng, **attrs)
+
+        constructs = [Diligence(attrs={'diligence': float(self.diligence[i])})]
+        if self.self_eff is not None:
+            constructs.append(DomainSelfEff(attrs={'self_eff': float(self.self_eff[i])}))
+        decider = DiligentDecider(attr=copy.deepcopy(self.decider_attr), constructs=constructs, rng=rng)
+
+        stu = ModularLearner(self.domain, cog, decider, rng)
+        stu._id = self.get_id(i)
+        return stu
+
+    def to_dataframe(self):
+        # One row of sampled parameters per student
+        d = {'ability': self.ability, 'diligence': self.diligence}
+        if self.self_eff is not None:
+            d['self_eff'] = self.self_eff
+        return pd.DataFrame(d, index=[self.get_id(i) for i in range(len(self))])
@@ -0,0 +1,94 @@
+# Opt-in phase level timing of the simulation hot loop
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """
+    Records wall time and call counts per phase of a simulation. Phases are
+    timed by wrapping the methods that implement them on a single sim's
+    student, tutor and logger instances, so sims without a timer pay nothing.
+    Phases may nest: context includes learner_state and choose_action
+    includes calc_ev. Batch timers also record the total wall time of the run
+
+    """
+
+    # Phase name, object path on the sim and method name
+    PHASES = [('context', None, 'build_context'),
+              ('learner_state', 'student', 'get_state'),
+              ('choose_action', 'student', 'choose_action'),
+              ('calc_ev', 'student.decider', 'calc_ev_dist'),
+              ('perform_action', 'student', 'perform_action'),
+              ('tutor', 'tutor', 'process_input'),
+              ('log', 'log', 'log_decision'),
+              ('log', 'log', 'log_action'),
+              ('log', 'log', 'log_transaction'),
+              ('log', 'log', 'log_session'),
+              ('db_write', 'log', 'write_to_db')
+             ]
+
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+        # (object, method name) for every wrapped method
+        self.wrapped = []
+
+    def add(self, phase, elapsed, count=1):
+        self.times[phase] = self.times.get(phase, 0) + elapsed
+        self.counts[phase] = self.counts.get(phase, 0) + count
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def instrument(self, sim):
+        # Wrap the phase methods of the given sim's objects
+        for phase, path, name in self.PHASES:
+            obj = sim
+            if path is not None:
+                for attr in path.split('.'):
+                    obj = getattr(obj, attr, None)
+            if obj is None or not hasattr(obj, name):
+                continue
+            setattr(obj, name, self.wrap(phase, getattr(obj, name)))
+            self.wrapped.append((obj, name))
+
+    def release(self):
+        # Remove the wrappers so the instrumented objects serialize as before
+        for obj, name in self.wrapped:
+            # Wrappers are instance attributes shadowing the class methods
+            obj.__dict__.pop(name, None)
+        self.wrapped = []
+
+    def merge(self, other):
+        if isinstance(other, PhaseTimer):
+            other = other.to_dict()
+        for phase, d in other.items():
+            self.add(phase, d['time'], d['count'])
+
+    def to_dict(self):
+        return {phase: {'time': self.times[phase], 'count': self.counts[phase]}
+                for phase in self.times}
+
+    @classmethod
+    def from_dict(cls, d):
+        timer = cls()
+        timer.merge(d)
+        return timer
+
+    def __str__(self):
+        lines = ["%-16s%12s%12s" % ("phase", "sec", "calls")]
+        for phase, t in sorted(self.times.items(), key=lambda x: -x[1]):
+            lines.append("%-16s%12.4f%12i" % (phase, t, self.counts[phase]))
+        return "\n".join(lines)
@@ -7,6 +7,7 @@ import uuid
 import random
 import numpy as np
 import math
+import time
 import datetime as dt
 # from datetime import datetime as dt
 
@@ -17,35 +18,62 @@ from learner.cognition import *
 from learner.modular_learner import *
 
 from tutor.tutor import SimpleTutor
+from log_db import mongo
+from sampling.rng import make_stream, spawn_seeds
 
 from simulate.simulation import *
-from simulate.modlearner_simulation import *
+from simulate.modlearner_simulation import ModLearnerSimulation
+from simulate.cohort_simulation import CohortSim
+from simulate.parallel import ParallelSimRunner
+from simulate.checkpoint import SimCheckpointer
+from simulate.streaming import MongoSink, run_pipeline
+from simulate.profiling import PhaseTimer
+from simulate.population import StudentPopulation
+from simulate.trajectory import TrajectoryRecorder
 
 logger = logging.getLogger(__name__)
 
 
 class SimHelper:
 
-    def __init__(self, db):
+    def __init__(self, db, db_params=None):
         self.db = db
+        # Connection parameters used by worker processes to open their own connections
+        self.db_params = db_params
    
     def gen_students(self, num_students, domain, curric, 
-		     cog_mod, cog_params, dec_mod, dec_params):
+		     cog_mod, cog_params, dec_mod, dec_params, seed=None):
         stus = []
+        seeds = spawn_seeds(seed, num_students)
         for i in range(num_students):
+            rng = make_stream(seeds[i])
             cp = cog_params()
-            cog = cog_mod(domain, **cp)
+            cog = cog_mod(domain, rng=rng, **cp)
             dp = dec_params()
-            dec = dec_mod(**dp)
+            dec = dec_mod(rng=rng, **dp)
             ### Tmp double off-task value ###
             dec.values['off task'] = 5*dec.values['off task']
-            decider = DiligentDecider(dec)
-            stu = ModularLearner(domain, cog, decider)
+            decider = DiligentDecider(dec, rng=rng)
+            stu = ModularLearner(domain, cog, decider, rng)
             stus.append(stu)
             
         return stus
 
-    def simulate_students(self, curric, students, batch):    
+    def gen_population(self, num_students, domain, seed=None, **params):
+        # Sample all students' parameters as arrays. Learners are built as the population is iterated,
+        # so it can be passed to simulate_students_stream or simulate_students_parallel in place of a list
+        return StudentPopulation(domain, num_students, seed, **params)
+
+    def simulate_students(self, curric, students, batch, num_sessions=10, seed=None, executor='simpy',
+                          checkpoint_dir=None, checkpoint_every=1, profile=False,
+                          trajectories=False, trajectory_steps=None):
+        # With profile, per phase timings of each student are exported with the batch
+        # With trajectories, each student's skills are recorded at every session end, and every
+        # trajectory_steps tutor steps if given, to the skill_trajectories collection
+        # executor 'direct' runs each student in a plain loop instead of a shared simpy environment
+        # With a checkpoint_dir, rerunning a crashed batch resumes each student from its last checkpoint
+        if executor not in ('simpy', 'direct'):
+            raise ValueError("Unknown simulation executor: %s" % executor)
 	
         env = simpy.Environment()
 
@@ -55,29 +83,204 @@ class SimHelper:
         max_ses_len = 60
         sim_start = dt.datetime.now()
 
+        checkpointer = None
+        if checkpoint_dir is not None:
+            checkpointer = SimCheckpointer(checkpoint_dir, curric, checkpoint_every)
+        recorder = TrajectoryRecorder(self.db, trajectory_steps) if trajectories else None
+
         mod = round(len(students) / 10)
+        seeds = spawn_seeds(seed, len(students))
+        final_stus = []
+        sims = []
+        start = time.perf_counter()
         for i, stu in enumerate(students):
             if i % mod == 0:
                 logger.info("Simulating student #%i" % i)
             # Create associated tutor
-            tutor = SimpleTutor(curric, stu._id, mastery_thres)
+            tutor_seed, sim_seed = seeds[i].spawn(2)
+            tutor = SimpleTutor(curric, stu._id, mastery_thres, tutor_seed)
 
             # Initialize simulation processes
             sim = SingleStudentSim(self.db, env, sim_start, stu, tutor,
-                                   num_sessions, m_ses_len, sd_ses_len, max_ses_len)
+                                   num_sessions, m_ses_len, sd_ses_len, max_ses_len, sim_seed,
+                                   checkpointer, PhaseTimer() if profile else None, recorder)
             batch.add_sim(sim)
+            sims.append(sim)
 
-            env.process(sim.run())
+            finished = False
+            if checkpointer is not None:
+                finished = checkpointer.resume(sim, self.db)
+            # Resumed sims carry the learner restored from the checkpoint
+            final_stus.append(sim.student)
+
+            if finished:
+                continue
+            elif executor == 'direct':
+                sim.run_direct()
+            else:
+                env.process(sim.run())
 
         env.run()
+        students = final_stus
+        if profile:
+            for sim in sims:
+                batch.add_timings(sim.student._id, sim.timer)
+            batch.timings.add('total', time.perf_counter() - start)
+            logger.info("Simulation phase timings:\n%s" % str(batch.timings))
+        if checkpointer is not None:
+            # Replace final students persisted by an earlier run of this batch
+            self.db.finalsimstudents.delete_many({'_id': {'$in': [stu._id for stu in students]}})
                     
         logger.info("Inserting %i simulated students to db" % len(students))
-        result = self.db.finalsimstudents.insert_many([stu.to_dict() for stu in students])
+        count = mongo.insert_chunked(self.db.finalsimstudents, (stu.to_dict() for stu in students))
+        logger.info("Inserted %i students to db" % count)
+
+        logger.info("Inserting simulation batch to db")
+        result = self.db.simbatches.insert_one(batch.to_dict())
+        logger.info("Db insert success: %s" % result.acknowledged)
+
+        return batch, students
+
+    def simulate_students_stream(self, curric, students, batch, num_sessions=10, seed=None, sinks=None,
+                                 profile=False, trajectories=False, trajectory_steps=None):
+        # Stream each student's records through the sinks as they are produced. Defaults to writing to the db
+        # Skill trajectories are written to the db as each student finishes, like in simulate_students
+        if sinks is None:
+            sinks = [MongoSink(self.db)]
+
+        mastery_thres = 0.95
+        m_ses_len = 45
+        sd_ses_len = 8
+        max_ses_len = 60
+        sim_start = dt.datetime.now()
+
+        seeds = spawn_seeds(seed, len(students))
+        recorder = TrajectoryRecorder(self.db, trajectory_steps) if trajectories else None
+        # Final students are persisted as they finish, so a lazily built population is never held in memory
+        final_docs = []
+        num_final = 0
+
+        def gen_records():
+            nonlocal num_final
+            for i, stu in enumerate(students):
+                tutor_seed, sim_seed = seeds[i].spawn(2)
+                tutor = SimpleTutor(curric, stu._id, mastery_thres, tutor_seed)
+                sim = SingleStudentSim(self.db, None, sim_start, stu, tutor,
+                                       num_sessions, m_ses_len, sd_ses_len, max_ses_len, sim_seed,
+                                       timer=PhaseTimer() if profile else None, recorder=recorder)
+                batch.add_sim(sim)
+                yield from sim.stream()
+                if profile:
+                    batch.add_timings(stu._id, sim.timer)
+                final_docs.append(stu.to_dict())
+                if len(final_docs) >= 1000:
+                    num_final += mongo.insert_chunked(self.db.finalsimstudents, final_docs)
+                    final_docs.clear()
+
+        start = time.perf_counter()
+        count = run_pipeline(gen_records(), sinks)
+        logger.info("Streamed %i records from %i students" % (count, len(students)))
+        if profile:
+            batch.timings.add('total', time.perf_counter() - start)
+            logger.info("Simulation phase timings:\n%s" % str(batch.timings))
+
+        num_final += mongo.insert_chunked(self.db.finalsimstudents, final_docs)
+        logger.info("Inserted %i simulated students to db" % num_final)
+
+        logger.info("Inserting simulation batch to db")
+        result = self.db.simbatches.insert_one(batch.to_dict())
+        logger.info("Db insert success: %s" % result.acknowledged)
+
+        return batch, students
+
+    def simulate_until_converged(self, curric, students, batch, stopping, num_sessions=10, seed=None):
+        # Simulate students one at a time with the direct executor until the batch's
+        # stopping rule converges. students can be a lazy iterable of new students, which
+        # may never end, so the stopping rule then needs a max_students
+        if (stopping.max_students is None) and not hasattr(students, '__len__'):
+            raise ValueError("Stopping rule needs max_students when students is an iterator")
+        mastery_thres = 0.95
+        m_ses_len = 45
+        sd_ses_len = 8
+        max_ses_len = 60
+        sim_start = dt.datetime.now()
+
+        batch.set_stopping(stopping)
+        # Seeds match spawn_seeds, so each student gets the same seed as in simulate_students
+        root_seed = np.random.SeedSequence(seed)
+        simulated = []
+        for stu in students:
+            tutor_seed, sim_seed = root_seed.spawn(1)[0].spawn(2)
+            tutor = SimpleTutor(curric, stu._id, mastery_thres, tutor_seed)
+            sim = SingleStudentSim(self.db, None, sim_start, stu, tutor,
+                                   num_sessions, m_ses_len, sd_ses_len, max_ses_len, sim_seed)
+            batch.add_sim(sim)
+            sim.run_direct()
+            batch.record_sim(sim)
+            simulated.append(stu)
+            if batch.should_stop():
+                break
+
+        logger.info("Stopped after %i students. Converged: %s" % (len(simulated), batch.is_converged()))
+        students = simulated
+
+        logger.info("Inserting %i simulated students to db" % len(students))
+        count = mongo.insert_chunked(self.db.finalsimstudents, (stu.to_dict() for stu in students))
+        logger.info("Inserted %i students to db" % count)
+
+        logger.info("Inserting simulation batch to db")
+        result = self.db.simbatches.insert_one(batch.to_dict())
         logger.info("Db insert success: %s" % result.acknowledged)
 
+        return batch, students
+
+    def simulate_students_parallel(self, curric, students, batch, num_sessions=10, num_workers=None, seed=None,
+                                   executor='simpy', checkpoint_dir=None, checkpoint_every=1, profile=False):
+        # Shard students across a process pool. Each worker persists its own logs and final students
+        db_params = self.db_params
+        if db_params is None:
+            db_params = mongo.get_db_params()
+        runner = ParallelSimRunner(db_params, num_workers)
+        start = time.perf_counter()
+        batch, students = runner.run(curric, students, batch, num_sessions, seed=seed, executor=executor,
+                                     checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every,
+                                     profile=profile)
+        if profile:
+            batch.timings.add('total', time.perf_counter() - start)
+            logger.info("Simulation phase timings summed over workers:\n%s" % str(batch.timings))
+
         logger.info("Inserting simulation batch to db")
         result = self.db.simbatches.insert_one(batch.to_dict())
         logger.info("Db insert success: %s" % result.acknowledged)
 
         return batch, students
 
+    def simulate_cohort(self, curric, students, batch, num_sessions, seed=None):
+        # Simulate all students in lockstep with a single vectorized cohort simulation
+        mastery_thres = 0.95
+        m_ses_len = 45
+        sd_ses_len = 8
+        max_ses_len = 60
+        sim_start = dt.datetime.now()
+
+        # Tutor seeds match simulate_students, so each student's tutor makes the same draws
+        seeds = spawn_seeds(seed, len(students))
+        tutors = []
+        for i, stu in enumerate(students):
+            tutor_seed, _ = seeds[i].spawn(2)
+            tutors.append(SimpleTutor(curric, stu._id, mastery_thres, tutor_seed))
+        sim = CohortSim(self.db, sim_start, students, tutors,
+                        num_sessions, m_ses_len, sd_ses_len, max_ses_len, seed)
+        batch.add_cohort(sim)
+        logger.info("Simulating cohort of %i students" % len(students))
+        sim.run()
+
+        logger.info("Inserting %i simulated students to db" % len(students))
+        count = mongo.insert_chunked(self.db.finalsimstudents, (stu.to_dict() for stu in students))
+        logger.info("Inserted %i students to db" % count)
+
+        logger.info("Inserting simulation batch to db")
+        result = self.db.simbatches.insert_one(batch.to_dict())
+        logger.info("Db insert success: %s" % result.acknowledged)
+
+        return batch, students
@@ -21,6 +21,9 @@ from context.context import *
 from tutor.simple_curriculum import SimpleCurriculum
 from tutor.tutor import Tutor
 from tutor.session import ClassSession
+from sampling.rng import make_stream
+from sampling.truncnorm import truncnorm
+from simulate.profiling import PhaseTimer
 
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
@@ -125,9 +128,12 @@ class SingleStudentSim(TimedSimulation):
     def __init__(self, db, env, start,
                  student, tutor,
                  num_sessions, m_ses_len, sd_ses_len,
-                 max_ses_len
+                 max_ses_len, rng=None, checkpointer=None, timer=None,
+                 recorder=None
                 ):
         super().__init__(env, start)
+        # Random stream for scheduling class sessions
+        self.rng = make_stream(rng)
         self.student = student
         self.tutor = tutor
         self.num_sessions = num_sessions
@@ -135,12 +141,20 @@ class SingleStudentSim(TimedSimulation):
         self.sd_ses_len = sd_ses_len
         self.max_ses_len = max_ses_len
 
+        # clock is the sim time at the end of the last completed session
         self.state = {'session_num': 0,
+                      'clock': 0,
                       'classes': []}
 
         self.class_start = None
 
         self.log = SimLogger(db, self.student, self.tutor)
+        # Optional SimCheckpointer saving state at class session boundaries
+        self.checkpointer = checkpointer
+        # Optional PhaseTimer recording where simulation time goes
+        self.timer = timer
+        # Optional TrajectoryRecorder capturing the student's skills over the simulation
+        self.recorder = recorder
 
         self.set_class_start()
 
@@ -154,7 +168,7 @@ class SingleStudentSim(TimedSimulation):
         school_end = 12+2.5 
         steps = 0.25 # 15 minute class start intervals
         day_intervals = np.arange(school_start, school_end - 1, steps)
-        class_start = random.choice(day_intervals)
+        class_start = self.rng.choice(day_intervals)
         
         start_hour = math.floor(class_start)
         start_min = int((class_start - start_hour)*60)
@@ -179,9 +193,7 @@ class SingleStudentSim(TimedSimulation):
 
         # Randomly determine class length, l
         if length is None:
-            length = -1
-            while (length <= 0) or (length > self.max_ses_len):
-                length = random.gauss(self.m_ses_len, self.sd_ses_len)
+            length = truncnorm(self.rng, self.m_ses_len, self.sd_ses_len, 0, self.max_ses_len)
 
         session = ClassSession(start=next_class,
                                end=next_class+dt.timedelta(minutes=length),
@@ -191,6 +203,9 @@ class SingleStudentSim(TimedSimulation):
 
         return session
 
+    def build_context(self, session, t):
+        return ClassSessionContext(self.tutor.state, self.student.get_state(), session, t)
+
     def wait_for_class_start(self, session):
         """
         Pause simulation process until session start
@@ -208,7 +223,7 @@ class SingleStudentSim(TimedSimulation):
                     # logger.warning(f"student had completed {loops} opportunities")
                 # loops += 1
                 t = self.get_sim_time()
-                cntxt = ClassSessionContext(self.tutor.state, self.student.get_state(), session, t)
+                cntxt = self.build_context(session, t)
                 choice, decision = self.student.choose_action(cntxt)
                 self.log.log_decision(decision)
                 
@@ -228,18 +243,66 @@ class SingleStudentSim(TimedSimulation):
                     self.student.process_feedback(feedback)
                     self.log.log_transaction(tx)
                     # self.db.tutor_events.insert_one(tx.to_dict())
+
+                if self.recorder is not None:
+                    self.recorder.step(self, t)
                 
                 yield self.env.timeout(action.time)
         except simpy.Interrupt as i:
             logger.debug(f"***** Studying was interrupted by: {i} *****")
 
+    def study_direct(self, session, now, end):
+        """
+        Plain loop equivalent of study. Works from sim time, now, until the
+        tutor is finished, the student stops work or class ends at sim time,
+        end. Yields after every step and returns the sim time the student
+        stopped working
+
+        """
+        # An action finishing exactly at the end of class is followed by one more step
+        # before logout, since simpy resumes study before the end of class condition
+        while self.tutor.has_more() and now <= end:
+            t = self.get_sim_time(now)
+            cntxt = self.build_context(session, t)
+            choice, decision = self.student.choose_action(cntxt)
+            self.log.log_decision(decision)
+
+            action = self.student.perform_action(choice, cntxt)
+            self.log.log_action(action, cntxt)
+
+            if isinstance(action, StopWork):
+                logger.debug("***** Studying was interrupted by: Student chose to stop working *****")
+                return now
+
+            # Simulate Learning interaction with tutor
+            feedback, tx = self.tutor.process_input(action, t)
+
+            if feedback is not None:
+                self.student.process_feedback(feedback)
+                self.log.log_transaction(tx)
+
+            if self.recorder is not None:
+                self.recorder.step(self, t)
+
+            now += action.time
+            yield
+
+        return min(now, end)
+
 
 
 
     def run(self):
+        if self.timer is not None:
+            self.timer.instrument(self)
+        if self.recorder is not None:
+            self.recorder.start(self)
         try:
             logger.debug(f"Starting Sim for student {self.student._id}")
-            for i in range(self.num_sessions):
+            if self.state['clock'] > 0:
+                # Resuming from a checkpoint
+                yield self.env.timeout(self.state['clock'] - self.env.now)
+            for i in range(self.state['session_num'], self.num_sessions):
                 # Start a new session and wait to start work
                 session = self.get_next_class_session()
                 logger.debug(f"Student {self.student._id}\nSimulating session #{i} start at {session.start}, sim time {self.get_sim_time()} and end at {session.end}")
@@ -283,13 +346,91 @@ class SingleStudentSim(TimedSimulation):
                 # self.db.class_sessions.insert_one(session.__dict__)
                 # logger.debug(f"Logged class session: {session}")
                 self.state['session_num'] += 1
+                self.state['clock'] = self.env.now
                 logger.debug(f"Class session ending at current time {self.get_sim_time()}")
+                if self.recorder is not None:
+                    self.recorder.session_end(self, self.get_sim_time())
+                if self.checkpointer is not None:
+                    self.checkpointer.session_end(self)
 
         except simpy.Interrupt as i:
             logger.warning("Process was interrupted")
         # Write all log to db at end of simulation
         self.log.write_to_db()
-        
+        if self.recorder is not None:
+            self.recorder.finish(self)
+        if self.timer is not None:
+            self.timer.release()
+
+    def run_direct(self):
+        """
+        Runs the simulation without simpy. Students are independent so the
+        event queue is replaced by a float clock with the end of class checked
+        inline. Clock arithmetic mirrors run, so both produce identical logs
+        for the same random streams
+
+        """
+        for _ in self.iter_direct():
+            pass
+
+    def stream(self):
+        """
+        Runs the simulation with the direct executor and yields each record as
+        a (collection, record) tuple as soon as it is produced, in the same db
+        form SimLogger writes. Nothing is buffered between steps, so memory
+        stays flat however long the student studies
+
+        """
+        self.log = StreamLogger(self.student, self.tutor)
+        for _ in self.iter_direct():
+            yield from self.log.pop_records()
+        yield from self.log.pop_records()
+
+    def iter_direct(self):
+        # Direct executor main loop. Yields after every simulated step
+        if self.timer is not None:
+            self.timer.instrument(self)
+        if self.recorder is not None:
+            self.recorder.start(self)
+        now = self.state['clock']
+        logger.debug(f"Starting direct Sim for student {self.student._id}")
+        for i in range(self.state['session_num'], self.num_sessions):
+            # Start a new session and wait to start work
+            session = self.get_next_class_session()
+            now += self.convert_to_sim_time(session.start) - now
+
+            # Start working
+            delay = self.student.start_working(session.length())
+            now += delay
+
+            # Login to tutor
+            tx = self.tutor.login(session, self.get_sim_time(now))
+            self.log.log_transaction(tx)
+
+            # Work on tutor until end of session or end of tutor then logout
+            end = now + (session.length() - delay)
+            now = yield from self.study_direct(session, now, end)
+            tx = self.tutor.logout(session, self.get_sim_time(now))
+            self.log.log_transaction(tx)
+            now = end
+
+            # Log session & update simulation state
+            self.log.log_session(session)
+            self.state['session_num'] += 1
+            self.state['clock'] = now
+            logger.debug(f"Class session ending at current time {self.get_sim_time(now)}")
+            if self.recorder is not None:
+                self.recorder.session_end(self, self.get_sim_time(now))
+            if self.checkpointer is not None:
+                self.checkpointer.session_end(self)
+
+        # Write all log to db at end of simulation
+        self.log.write_to_db()
+        if self.recorder is not None:
+            self.recorder.finish(self)
+        if self.timer is not None:
+            self.timer.release()
+
         
 
 
@@ -301,12 +442,51 @@ class SimulationBatch:
         # For now, just track the list of students
         self.student_ids = set()
         self.desc = desc
+        # Phase timings of the batch and of each student when sims are profiled
+        self.timings = None
+        self.student_timings = {}
+        # Optional SequentialStopping rule for sequentially sampled batches
+        self.stopping = None
+        self.convergence = None
 
     def add_sim(self, sim):
-        sim_stu = sim.student
-        sid = sim.student._id
+        self.add_student(sim.student)
+
+    def add_cohort(self, cohort):
+        for stu in cohort.students:
+            self.add_student(stu)
+
+    def add_student(self, stu):
+        sid = stu._id
         if sid not in self.student_ids:
             self.student_ids.add(sid)
+
+    def set_stopping(self, stopping):
+        self.stopping = stopping
+
+    def record_sim(self, sim):
+        # Update running estimates with a finished sim
+        if self.stopping is not None:
+            self.stopping.update(sim)
+
+    def is_converged(self):
+        if self.stopping is None:
+            return False
+        return self.stopping.is_converged()
+
+    def should_stop(self):
+        if self.stopping is None:
+            return False
+        return self.stopping.should_stop()
+
+    def add_timings(self, stu_id, timings):
+        # timings is a PhaseTimer or its dict form
+        if isinstance(timings, PhaseTimer):
+            timings = timings.to_dict()
+        self.student_timings[stu_id] = timings
+        if self.timings is None:
+            self.timings = PhaseTimer()
+        self.timings.merge(timings)
     
     def to_dict(self):
         out = {'_id': self._id,
@@ -314,6 +494,13 @@ class SimulationBatch:
                'desc': self.desc,
                'student_ids': list(self.student_ids)
                }
+        if self.timings is not None:
+            out['timings'] = self.timings.to_dict()
+            out['student_timings'] = self.student_timings
+        if self.stopping is not None:
+            out['convergence'] = self.stopping.to_dict()
+        elif self.convergence is not None:
+            out['convergence'] = self.convergence
         return out
     
     @classmethod
@@ -322,6 +509,11 @@ class SimulationBatch:
         result._id = d['_id']
         result.run_time = d['run_time']
         result.student_ids = set(d['student_ids'])
+        if 'timings' in d:
+            result.timings = PhaseTimer.from_dict(d['timings'])
+            result.student_timings = d['student_timings']
+        # Convergence summary only. Metric functions are not persisted
+        result.convergence = d.get('convergence')
         return result
 
 
@@ -0,0 +1,125 @@
+# Consumers for streams of simulation records produced by SingleStudentSim.stream
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import json
+from collections import Counter
+
+import numpy as np
+
+from log_db.tutor_log import TransactionEncoder
+
+logger = logging.getLogger(__name__)
+
+
+class RecordEncoder(TransactionEncoder):
+    # Also encodes numpy scalars found in decision records
+
+    def default(self, obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return super().default(obj)
+
+
+class MongoSink:
+    """
+    Writes streamed records to their db collections, holding at most
+    batch_size records per collection between inserts
+
+    """
+
+    def __init__(self, db, batch_size=1000):
+        self.db = db
+        self.batch_size = batch_size
+        self.queues = {}
+
+    def write(self, col, record):
+        queue = self.queues.setdefault(col, [])
+        queue.append(record)
+        if len(queue) >= self.batch_size:
+            self.flush(col)
+
+    def flush(self, col):
+        queue = self.queues.get(col)
+        if queue:
+            logger.debug("***** Writing %i records to %s *****" % (len(queue), col))
+            self.db[col].insert_many(queue)
+            self.queues[col] = []
+
+    def close(self):
+        for col in list(self.queues.keys()):
+            self.flush(col)
+
+
+class JsonlSink:
+    """
+    Writes streamed records to a json lines file, one record per line
+    tagged with its collection
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'w')
+
+    def write(self, col, record):
+        self.f.write(json.dumps({'collection': col, 'record': record}, cls=RecordEncoder))
+        self.f.write("\n")
+
+    def close(self):
+        self.f.close()
+
+
+class StatsSink:
+    """
+    Online aggregator of streamed records. Keeps counts of records, actions
+    and tutor outcomes without retaining the records themselves
+
+    """
+
+    def __init__(self):
+        self.records = Counter()
+        self.actions = Counter()
+        self.outcomes = Counter()
+        self.students = set()
+
+    def write(self, col, record):
+        self.records[col] += 1
+        if col == 'actions':
+            self.actions[record['action']['type']] += 1
+            self.students.add(record['student_id'])
+        elif col == 'tutor_events' and 'outcome' in record:
+            self.outcomes[record['outcome']] += 1
+
+    def close(self):
+        pass
+
+    def to_dict(self):
+        attempts = self.outcomes['Correct'] + self.outcomes['Incorrect']
+        out = {'records': dict(self.records),
+               'actions': dict(self.actions),
+               'outcomes': dict(self.outcomes),
+               'num_students': len(self.students),
+               'correct_rate': self.outcomes['Correct'] / attempts if attempts > 0 else None
+              }
+        return out
+
+
+def run_pipeline(records, sinks):
+    """
+    Pull (collection, record) tuples through each sink in turn. Records are
+    consumed one at a time, so only the sinks' own buffers are held in memory
+
+    """
+    count = 0
+    try:
+        for col, record in records:
+            for sink in sinks:
+                sink.write(col, record)
+            count += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+    return count
@@ -0,0 +1,207 @@
+# Parameter sweeps over simulation hyperparameters with cached results
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+import os
+import copy
+import json
+import hashlib
+import itertools
+import random
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from tutor.curriculum_factory import CurriculumFactory
+from log_db.memory_db import MemoryDB
+from simulate.simulation import SimulationBatch
+from simulate.streaming import StatsSink
+from simulate.benchmark import DOMAIN_PARAMS, gen_students
+from simulate.script_helpers import SimHelper
+
+logger = logging.getLogger(__name__)
+
+
+# Parameters of a sweep point. Designs override these with dotted keys such as 'domain.m_t'
+DEFAULT_POINT = {'domain': DOMAIN_PARAMS,
+                 'curric': {'num_units': 2,
+                            'mean_sections': 3,
+                            'stdev_sections': 1,
+                            'section_kcs_lambda': 4,
+                            'num_practice': 20
+                           },
+                 'decider': {},
+                 'm_diligence': 0,
+                 'sd_diligence': 1,
+                 'num_students': 20,
+                 'num_sessions': 5
+                }
+
+
+def grid_design(space):
+    """
+    Full factorial design. space maps each parameter to a list of values
+
+    """
+    keys = sorted(space.keys())
+    return [dict(zip(keys, vals)) for vals in itertools.product(*[space[k] for k in keys])]
+
+
+def random_design(space, n, seed=None):
+    """
+    n points sampled from space. A (low, high) tuple is sampled uniformly and
+    a list is sampled by choice
+
+    """
+    rng = np.random.default_rng(seed)
+    keys = sorted(space.keys())
+    points = []
+    for i in range(n):
+        point = {}
+        for k in keys:
+            if isinstance(space[k], tuple):
+                point[k] = float(rng.uniform(*space[k]))
+            else:
+                point[k] = space[k][rng.integers(len(space[k]))]
+        points.append(point)
+    return points
+
+
+def expand_params(params, defaults=DEFAULT_POINT):
+    # Apply dotted key overrides on top of the defaults
+    point = copy.deepcopy(defaults)
+    for key, val in params.items():
+        path = key.split('.')
+        d = point
+        for p in path[:-1]:
+            d = d.setdefault(p, {})
+        d[path[-1]] = val
+    return point
+
+
+def param_hash(params, seed):
+    # Content hash of a point's parameters and seed
+    content = json.dumps({'params': params, 'seed': seed}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def simulate_point(params, seed):
+    """
+    Simulate one sweep point against a null sink db and return its summary
+    statistics
+
+    """
+    point = expand_params(params)
+    random.seed(seed)
+    np.random.seed(seed)
+    domain, curric = CurriculumFactory.gen_curriculum(point['domain'], point['curric'])
+
+    students = gen_students(domain, point['num_students'], seed, point['m_diligence'],
+                            point['sd_diligence'], point['decider'])
+
+    stats = StatsSink()
+    db = MemoryDB(keep_docs=False)
+    SimHelper(db).simulate_students_stream(curric, students, SimulationBatch("sweep point"),
+                                           point['num_sessions'], seed, sinks=[stats])
+
+    summary = stats.to_dict()
+    summary['num_kcs'] = len(domain.kcs)
+    summary['mean_skill'] = float(np.mean([np.mean(list(stu.cog.skills.values())) for stu in students]))
+    return summary
+
+
+class SweepCache:
+    """
+    Directory of json records, one per computed point, named by the
+    content hash of the point's parameters and seed
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def has(self, key):
+        return os.path.exists(self.get_path(key))
+
+    def get(self, key):
+        with open(self.get_path(key), 'r') as f:
+            return json.load(f)
+
+    def put(self, key, record):
+        path = self.get_path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f, default=str)
+        os.replace(tmp_path, path)
+
+
+class SweepScheduler:
+    """
+    Runs each point of a design in a worker pool and caches its summary.
+    Points already in the cache are not recomputed, so rerunning or
+    extending a sweep only computes the new points. Keys only cover the
+    parameters and seed, so use a new cache directory after changing the
+    point function or its defaults
+
+    """
+
+    def __init__(self, cache_path, run_point=simulate_point, num_workers=None):
+        self.cache = SweepCache(cache_path)
+        # Must be a module level function so it can be sent to worker processes
+        self.run_point = run_point
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        self.num_workers = num_workers
+
+    def run(self, design, seeds=[0]):
+        """
+        Compute every point of the design for each seed. Returns the records
+        in design order
+
+        """
+        jobs = [(params, seed, param_hash(params, seed)) for params in design for seed in seeds]
+        todo = {}
+        for params, seed, key in jobs:
+            if not self.cache.has(key) and key not in todo:
+                todo[key] = (params, seed)
+        logger.info("Sweep of %i points: %i cached, %i to compute" %
+                    (len(jobs), len(jobs) - len(todo), len(todo)))
+
+        if len(todo) > 0:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+                futures = {pool.submit(self.run_point, params, seed): key
+                           for key, (params, seed) in todo.items()}
+                # Cache each point as it finishes so a failed sweep keeps its completed points
+                for future in as_completed(futures):
+                    key = futures[future]
+                    params, seed = todo[key]
+                    record = {'key': key,
+                              'params': params,
+                              'seed': seed,
+                              'run_time': dt.datetime.now(),
+                              'summary': future.result()
+                             }
+                    self.cache.put(key, record)
+                    logger.info("Computed sweep point %s" % str(params))
+
+        return [self.cache.get(key) for params, seed, key in jobs]
+
+    def to_dataframe(self, records):
+        # Flatten records into one row per point with params and numeric summary fields
+        rows = []
+        for record in records:
+            row = dict(record['params'])
+            row['seed'] = record['seed']
+            for k, v in record['summary'].items():
+                if not isinstance(v, dict):
+                    row[k] = v
+            rows.append(row)
+        return pd.DataFrame(rows)
@@ -0,0 +1,156 @@
+# Recording of learner skill trajectories as delta encoded arrays
+# Add project root to python path
+import sys
+sys.path.append('..')
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def get_skill_array(skills):
+    # Skill values in kc index order
+    if hasattr(skills, 'array'):
+        return skills.array
+    return np.array(list(skills.values()))
+
+
+class SkillTrajectory:
+    """
+    Sequence of snapshots of one learner's skills, ordered by the domain's
+    kc index. The first snapshot is stored in full and every later one as
+    the positions and new values of the skills that changed since the
+    previous snapshot, so a student who learns a few kcs per session costs a
+    few bytes per snapshot. Each snapshot is tagged with its session, step
+    and seconds since the start of the simulation
+
+    """
+
+    def __init__(self, stu_id, domain_id, initial):
+        self.stu_id = stu_id
+        self.domain_id = domain_id
+        self.initial = np.array(initial)
+        self.last = self.initial.copy()
+        self.sessions = [0]
+        self.steps = [0]
+        self.times = [0.0]
+        self.delta_pos = []
+        self.delta_val = []
+        # Start of each snapshot's deltas within the concatenated deltas
+        self.offsets = [0, 0]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, skills, session, step, time):
+        skills = np.asarray(skills)
+        changed = np.flatnonzero(skills != self.last)
+        self.delta_pos.append(changed)
+        self.delta_val.append(skills[changed])
+        self.last[changed] = skills[changed]
+        self.offsets.append(self.offsets[-1] + len(changed))
+        self.sessions.append(session)
+        self.steps.append(step)
+        self.times.append(time)
+
+    def get_pos_dtype(self):
+        return np.uint16 if len(self.initial) <= np.iinfo(np.uint16).max else np.int32
+
+    def to_dict(self):
+        pos = np.concatenate(self.delta_pos) if len(self.delta_pos) > 0 else np.zeros(0)
+        val = np.concatenate(self.delta_val) if len(self.delta_val) > 0 else np.zeros(0)
+        return {'_id': self.stu_id,
+                'domain_id': self.domain_id,
+                'dtype': self.initial.dtype.str,
+                'num_kcs': len(self.initial),
+                'initial': self.initial.tobytes(),
+                'sessions': np.array(self.sessions, dtype=np.int32).tobytes(),
+                'steps': np.array(self.steps, dtype=np.int32).tobytes(),
+                'times': np.array(self.times, dtype=np.float64).tobytes(),
+                'offsets': np.array(self.offsets, dtype=np.int32).tobytes(),
+                'delta_pos': pos.astype(self.get_pos_dtype()).tobytes(),
+                'delta_val': val.astype(self.initial.dtype).tobytes()
+               }
+
+    @classmethod
+    def from_dict(cls, d):
+        dtype = np.dtype(d['dtype'])
+        out = cls(d['_id'], d['domain_id'], np.frombuffer(d['initial'], dtype=dtype))
+        out.sessions = np.frombuffer(d['sessions'], dtype=np.int32).tolist()
+        out.steps = np.frombuffer(d['steps'], dtype=np.int32).tolist()
+        out.times = np.frombuffer(d['times'], dtype=np.float64).tolist()
+        out.offsets = np.frombuffer(d['offsets'], dtype=np.int32).tolist()
+        pos = np.frombuffer(d['delta_pos'], dtype=out.get_pos_dtype()).astype(int)
+        val = np.frombuffer(d['delta_val'], dtype=dtype)
+        out.delta_pos = [pos[out.offsets[i]:out.offsets[i+1]] for i in range(1, len(out.offsets) - 1)]
+        out.delta_val = [val[out.offsets[i]:out.offsets[i+1]] for i in range(1, len(out.offsets) - 1)]
+        out.last = out.to_array()[-1].copy()
+        return out
+
+    def to_array(self):
+        """
+        Snapshots x kcs array of skills
+
+        """
+        out = np.empty((len(self), len(self.initial)), dtype=self.initial.dtype)
+        out[0] = self.initial
+        for i, (pos, val) in enumerate(zip(self.delta_pos, self.delta_val)):
+            out[i+1] = out[i]
+            out[i+1, pos] = val
+        return out
+
+    def get_points(self):
+        # Session, step and time of each snapshot as arrays
+        return np.array(self.sessions), np.array(self.steps), np.array(self.times)
+
+
+class TrajectoryRecorder:
+    """
+    Records the skill trajectories of the students of SingleStudentSims.
+    Skills are captured at the start of the simulation, at the end of every
+    class session and, with every_steps, after every every_steps tutor
+    steps. Each student's trajectory is written to the db's
+    skill_trajectories collection when their simulation finishes. A resumed
+    simulation starts a new trajectory from its checkpoint
+
+    """
+
+    def __init__(self, db, every_steps=None):
+        self.db = db
+        self.every_steps = every_steps
+        # Trajectories and step counts of the simulations in progress keyed by student id
+        self.trajectories = {}
+        self.step_counts = {}
+
+    def get_time(self, sim, t=None):
+        if t is None:
+            t = sim.get_sim_time()
+        return (t - sim.start).total_seconds()
+
+    def start(self, sim):
+        stu = sim.student
+        self.trajectories[stu._id] = SkillTrajectory(stu._id, stu.domain_id, get_skill_array(stu.skills))
+        self.step_counts[stu._id] = 0
+
+    def record(self, sim, t=None):
+        stu = sim.student
+        self.trajectories[stu._id].add(get_skill_array(stu.skills), sim.state['session_num'],
+                                       self.step_counts[stu._id], self.get_time(sim, t))
+
+    def step(self, sim, t):
+        stu_id = sim.student._id
+        self.step_counts[stu_id] += 1
+        if (self.every_steps is not None) and (self.step_counts[stu_id] % self.every_steps == 0):
+            self.record(sim, t)
+
+    def session_end(self, sim, t=None):
+        self.record(sim, t)
+
+    def finish(self, sim):
+        stu_id = sim.student._id
+        traj = self.trajectories.pop(stu_id)
+        del self.step_counts[stu_id]
+        self.db.skill_trajectories.insert_one(traj.to_dict())
+        return traj
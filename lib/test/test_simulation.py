@@ -9,13 +9,17 @@ import logging
 import random
 import uuid
 import datetime as dt
+import time
+import copy
+import tempfile
 import dill
 
 import simpy
 
-from tutor.domain import Domain
+from tutor.domain import Domain, ContKCDomain
 from tutor.curriculum_factory import CurriculumFactory
 from tutor.simple_curriculum import SimpleCurriculum
+from tutor.cogtutor_curriculum import CogTutorCurriculum
 from tutor.tutor import SimpleTutor
 from tutor.action import Attempt, HintRequest
 
@@ -23,14 +27,28 @@ from learner.selfeff_learner import SelfEfficacyLearner
 from learner.modular_learner import ModularLearner
 from learner.cognition import *
 from learner.decider import *
+from learner.ev_kernel import DeciderArrays
+from learner.domain_tuner import DomainTuner
+from learner import schema
+from sampling.rng import make_stream, spawn_seeds
+from sampling.truncnorm import truncnorm, truncnorm_many
 
 from simulate.simple_tutor_simulation import SimpleTutorSimulation
 from simulate.self_eff_simulation import SelfEffSimulation
 from simulate.modlearner_simulation import ModLearnerSimulation
 from simulate.simulation import *
+from simulate.cohort_simulation import CohortSim
+from simulate.script_helpers import SimHelper
+from simulate.streaming import MongoSink, StatsSink
+from simulate.convergence import SequentialStopping, ConvergenceTarget
+from simulate.sweep import SweepScheduler, grid_design
+from simulate.population import StudentPopulation
+from simulate.trajectory import TrajectoryRecorder, SkillTrajectory
+from tutor.bkt import TutorReplayer
 
 from log_db import mongo
 from log_db.curriculum_mapper import DB_Curriculum_Mapper
+from log_db.curriculum_store import save_curriculum, load_curriculum, CurriculumArrays
 
 # logging.basicConfig(level=logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
@@ -251,9 +269,613 @@ def test_timed_simulation():
 
     db_util.peak()
 
+def test_cohort_simulation():
+    logger.info("***** Testing cohort simulation against single student simulations *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    num_students = 100
+    mastery_thres = 0.9
+    m_ses_len = 40
+    sd_ses_len = 8
+    max_ses_len = 60
+    num_sessions = 5
+    sim_start = dt.datetime.now()
+    students = []
+    for i in range(num_students):
+        rng = make_stream(i)
+        cog = BiasSkillCognition(domain, rng.triangular(-1, 1), rng=rng)
+        constructs = [Diligence(attrs={'diligence': rng.gauss(0,1)})]
+        students.append(ModularLearner(domain, cog, DiligentDecider(constructs=constructs, rng=rng), rng))
+
+    def run_sims(cohort):
+        # The cohort draws from its own stream, so the two paths only agree in distribution
+        stus = copy.deepcopy(students)
+        tutors = [SimpleTutor(curric, stu._id, mastery_thres, i) for i, stu in enumerate(stus)]
+        start = time.perf_counter()
+        if cohort:
+            CohortSim(db, sim_start, stus, tutors, num_sessions, m_ses_len, sd_ses_len, max_ses_len, 0).run()
+        else:
+            for i, (stu, tutor) in enumerate(zip(stus, tutors)):
+                sim = SingleStudentSim(db, None, sim_start, stu, tutor,
+                                       num_sessions, m_ses_len, sd_ses_len, max_ses_len, i)
+                sim.run_direct()
+        elapsed = time.perf_counter() - start
+
+        steps = db.actions.count_documents({}) / num_students
+        txs = db.tutor_events.count_documents({'type': 'TutorInput'}) / num_students
+        mastery = np.array([tutor.state.mastery.array for tutor in tutors])
+        db_util.clear_db()
+        return elapsed, steps, txs, mastery
+
+    cohort_time, cohort_steps, cohort_txs, cohort_mastery = run_sims(True)
+    single_time, single_steps, single_txs, single_mastery = run_sims(False)
+    logger.info("cohort: %f sec\tsingle student: %f sec" % (cohort_time, single_time))
+    logger.info("Steps per student cohort: %f single: %f" % (cohort_steps, single_steps))
+    logger.info("Transactions per student cohort: %f single: %f" % (cohort_txs, single_txs))
+    if abs(cohort_steps - single_steps) > 0.1 * single_steps:
+        logger.error("Cohort steps per student differ from single student simulations")
+    if abs(cohort_txs - single_txs) > 0.1 * single_txs:
+        logger.error("Cohort transactions per student differ from single student simulations")
+
+    # Mastery distribution over all students and kcs
+    quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+    cohort_q = np.quantile(cohort_mastery, quantiles)
+    single_q = np.quantile(single_mastery, quantiles)
+    logger.info("Mastery quantiles cohort: %s single: %s" % (str(cohort_q), str(single_q)))
+    if np.any(np.abs(cohort_q - single_q) > 0.02):
+        logger.error("Cohort mastery quantiles differ from single student simulations")
+    cohort_mastered = np.mean(cohort_mastery >= mastery_thres)
+    single_mastered = np.mean(single_mastery >= mastery_thres)
+    if abs(cohort_mastered - single_mastered) > 0.02:
+        logger.error("Cohort mastered %f of kcs and single student simulations %f" %
+                     (cohort_mastered, single_mastered))
+
+def test_parallel_simulation():
+    logger.info("***** Testing process pool simulation against a serial run *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    num_students = 12
+    num_sessions = 3
+    students = []
+    for i in range(num_students):
+        rng = make_stream(i)
+        cog = BiasSkillCognition(domain, rng.triangular(-1, 1), rng=rng)
+        constructs = [Diligence(attrs={'diligence': rng.gauss(0,1)})]
+        students.append(ModularLearner(domain, cog, DiligentDecider(constructs=constructs, rng=rng), rng))
+
+    def get_results(stus):
+        # Final skills and number of logged actions of each student
+        if db.finalsimstudents.count_documents({}) != num_students:
+            logger.error("Expected %i persisted final students, found %i" %
+                         (num_students, db.finalsimstudents.count_documents({})))
+        skills = {stu._id: dict(stu.skills) for stu in stus}
+        actions = {stu._id: db.actions.count_documents({'student_id': stu._id}) for stu in stus}
+        db_util.clear_db()
+        return skills, actions
+
+    helper = SimHelper(db, db_params)
+    start = time.perf_counter()
+    batch, serial = helper.simulate_students(curric, copy.deepcopy(students), SimulationBatch("serial run"),
+                                             num_sessions, seed=0)
+    serial_time = time.perf_counter() - start
+    serial_skills, serial_actions = get_results(serial)
+
+    start = time.perf_counter()
+    batch, parallel = helper.simulate_students_parallel(curric, copy.deepcopy(students),
+                                                        SimulationBatch("parallel run"), num_sessions,
+                                                        num_workers=2, seed=0)
+    parallel_time = time.perf_counter() - start
+    parallel_skills, parallel_actions = get_results(parallel)
+
+    logger.info("serial: %f sec\tparallel: %f sec" % (serial_time, parallel_time))
+    if sorted(stu._id for stu in parallel) != sorted(stu._id for stu in students):
+        logger.error("Parallel run did not return every student")
+    if parallel_skills != serial_skills:
+        logger.error("Final skills differ between the parallel and serial runs")
+    if parallel_actions != serial_actions:
+        logger.error("Logged actions per student differ between the parallel and serial runs")
+
+def test_direct_executor():
+    logger.info("***** Benchmarking direct loop executor against simpy *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    num_students = 20
+    mastery_thres = 0.9
+    m_ses_len = 40
+    sd_ses_len = 8
+    max_ses_len = 60
+    num_sessions = 5
+    sim_start = dt.datetime.now()
+    students = []
+    for i in range(num_students):
+        cog = BiasSkillCognition(domain, random.triangular(-1, 1), rng=i)
+        constructs = [Diligence(attrs={'diligence': random.gauss(0,1)})]
+        decider = DiligentDecider(constructs=constructs)
+        students.append(ModularLearner(domain, cog, decider))
+
+    def run_sims(direct):
+        # Copy students so both executors start from the same state and random streams
+        stus = copy.deepcopy(students)
+        env = None if direct else simpy.Environment()
+        sims = [SingleStudentSim(db, env, sim_start, stu, SimpleTutor(curric, stu._id, mastery_thres, i),
+                                 num_sessions, m_ses_len, sd_ses_len, max_ses_len, i)
+                for i, stu in enumerate(stus)]
+        start = time.perf_counter()
+        if direct:
+            for sim in sims:
+                sim.run_direct()
+        else:
+            for sim in sims:
+                env.process(sim.run())
+            env.run()
+        elapsed = time.perf_counter() - start
+
+        actions = {}
+        for stu in stus:
+            acts = db.actions.find({'student_id': stu._id}).sort('time')
+            actions[stu._id] = [(act['action']['type'], act['time']) for act in acts]
+        db_util.clear_db()
+        return elapsed, actions
+
+    simpy_time, simpy_actions = run_sims(False)
+    direct_time, direct_actions = run_sims(True)
+    logger.info("simpy executor: %f sec\tdirect executor: %f sec" % (simpy_time, direct_time))
+    if simpy_actions != direct_actions:
+        logger.error("Direct executor actions differ from the simpy executor's")
+
+def test_checkpoint_resume():
+    logger.info("***** Testing checkpoint and resume of a simulation batch *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    students = []
+    for i in range(10):
+        cog = BiasSkillCognition(domain, random.triangular(-1, 1), rng=i)
+        constructs = [Diligence(attrs={'diligence': random.gauss(0,1)})]
+        students.append(ModularLearner(domain, cog, DiligentDecider(constructs=constructs)))
+
+    def get_results(stus):
+        # Final skills and logged actions of each student
+        skills = {stu._id: dict(stu.skills) for stu in stus}
+        actions = {}
+        for stu in stus:
+            acts = sorted(db.actions.find({'student_id': stu._id}), key=lambda act: act['time'])
+            actions[stu._id] = [(act['action']['type'], act['action']['time']) for act in acts]
+        db_util.clear_db()
+        return skills, actions
+
+    helper = SimHelper(db, db_params)
+    batch, stus = helper.simulate_students(curric, copy.deepcopy(students), SimulationBatch("uninterrupted run"),
+                                           num_sessions=3, seed=0, executor='direct')
+    expected_skills, expected_actions = get_results(stus)
+
+    with tempfile.TemporaryDirectory() as ckpt_dir:
+        # Crash the first run during the second session of the second student
+        study_direct = SingleStudentSim.study_direct
+        calls = [0]
+        def crashing_study(sim, *args):
+            calls[0] += 1
+            if calls[0] == 5:
+                raise RuntimeError("Simulated crash")
+            return study_direct(sim, *args)
+        SingleStudentSim.study_direct = crashing_study
+        try:
+            helper.simulate_students(curric, copy.deepcopy(students), SimulationBatch("crashed run"),
+                                     num_sessions=3, seed=0, executor='direct', checkpoint_dir=ckpt_dir)
+            logger.error("Simulated crash did not interrupt the first run")
+        except RuntimeError:
+            logger.info("First run crashed after %i sessions" % (calls[0] - 1))
+        finally:
+            SingleStudentSim.study_direct = study_direct
+
+        batch, stus = helper.simulate_students(curric, copy.deepcopy(students), SimulationBatch("resumed run"),
+                                               num_sessions=3, seed=0, executor='direct',
+                                               checkpoint_dir=ckpt_dir)
+        num_actions = db.actions.count_documents({})
+
+        # Every student finished, so rerunning from the checkpoints should log nothing new
+        helper.simulate_students(curric, copy.deepcopy(students), SimulationBatch("finished run"),
+                                 num_sessions=3, seed=0, executor='direct', checkpoint_dir=ckpt_dir)
+        if num_actions != db.actions.count_documents({}):
+            logger.error("Rerun of a finished batch logged new actions")
+        db_util.peak()
+        skills, actions = get_results(stus)
+
+    if skills != expected_skills:
+        logger.error("Final skills after resuming differ from the uninterrupted run")
+    if actions != expected_actions:
+        logger.error("Logged actions after resuming differ from the uninterrupted run")
+
+def test_stream_simulation():
+    logger.info("***** Testing streaming simulation records *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    students = []
+    for i in range(10):
+        cog = BiasSkillCognition(domain, random.triangular(-1, 1))
+        constructs = [Diligence(attrs={'diligence': random.gauss(0,1)})]
+        students.append(ModularLearner(domain, cog, DiligentDecider(constructs=constructs)))
+
+    stats = StatsSink()
+    helper = SimHelper(db, db_params)
+    batch, students = helper.simulate_students_stream(curric, students, SimulationBatch("streamed run"),
+                                                      num_sessions=3, sinks=[MongoSink(db), stats],
+                                                      profile=True)
+    logger.info("Streamed stats: %s" % str(stats.to_dict()))
+    logger.info("Phase timings:\n%s" % str(batch.timings))
+    db_util.peak()
+
+def test_sequential_stopping():
+    logger.info("***** Testing convergence based early stopping *****")
+
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    def gen_students():
+        while True:
+            cog = BiasSkillCognition(domain, random.triangular(-1, 1))
+            constructs = [Diligence(attrs={'diligence': random.gauss(0,1)})]
+            yield ModularLearner(domain, cog, DiligentDecider(constructs=constructs))
+
+    stopping = SequentialStopping([ConvergenceTarget('correct_rate', 0.02),
+                                   ConvergenceTarget('off_task_rate', 0.01)],
+                                  min_students=20, max_students=500)
+    helper = SimHelper(db, db_params)
+    batch, students = helper.simulate_until_converged(curric, gen_students(), SimulationBatch("sequential run"),
+                                                      stopping, num_sessions=3)
+    logger.info("Simulated %i students: %s" % (len(students), str(batch.to_dict()['convergence'])))
+    db_util.peak()
+
+def test_param_sweep():
+    logger.info("***** Testing cached parameter sweep *****")
+    design = grid_design({'domain.m_t': [0.2, 0.35, 0.5],
+                          'm_diligence': [-1, 0, 1],
+                          'num_students': [10],
+                          'num_sessions': [3]})
+    with tempfile.TemporaryDirectory() as cache_path:
+        sweep = SweepScheduler(cache_path)
+        records = sweep.run(design, seeds=[0, 1])
+        logger.info("Sweep results:\n%s" % str(sweep.to_dataframe(records)))
+
+        # Rerunning the sweep should only read from the cache
+        start = time.perf_counter()
+        sweep.run(design, seeds=[0, 1])
+        logger.info("Cached rerun took %f sec" % (time.perf_counter() - start))
+
+def test_ev_kernel():
+    logger.info("***** Testing compiled ev kernel against interpreted path *****")
+    class Cntxt: pass
+    actions = [Attempt, Guess, HintRequest, OffTask, StopWork]
+    for i in range(1000):
+        constructs = [Diligence(attrs={'diligence': random.gauss(0, 2)}),
+                      DomainSelfEff(attrs={'self_eff': random.gauss(0, 2)})]
+        decider = EVDecider(constructs=random.sample(constructs, random.randint(0, 2)))
+        cntxt = Cntxt()
+        cntxt.time = dt.datetime.now()
+        cntxt.session = Cntxt()
+        cntxt.session.end = cntxt.time + dt.timedelta(seconds=random.uniform(1, 3600))
+        choices = random.sample(actions, random.randint(1, len(actions)))
+
+        choice_evs, pev = decider.get_kernel().evaluate(choices, {}, cntxt)
+        if choice_evs != decider.calc_ev(choices, {}, cntxt):
+            logger.error("Compiled evs differ from interpreted path for %s" % str(decider))
+        decider.kernel = False
+        if pev != decider.calc_ev_dist(choices, {}, cntxt)[1]:
+            logger.error("Compiled choice probabilities differ for %s" % str(decider))
+    logger.info("Compared compiled and interpreted evs")
+
+def test_choose_many():
+    logger.info("***** Testing batch decisions over a cohort of deciders *****")
+    class Cntxt: pass
+    actions = [Attempt, Guess, HintRequest, OffTask, StopWork]
+    deciders = []
+    for i in range(200):
+        constructs = [Diligence(attrs={'diligence': random.gauss(0, 1)}),
+                      DomainSelfEff(attrs={'self_eff': random.gauss(0, 1)})]
+        deciders.append(EVDecider(constructs=random.sample(constructs, random.randint(0, 2))))
+    arrays = DeciderArrays(deciders, [{} for d in deciders], actions)
+
+    idx = np.arange(len(deciders))
+    tt_end = np.random.randint(1, 3600, len(deciders)).astype(float)
+    avail = np.ones((len(deciders), len(actions)), dtype=bool)
+    choice, exp, val, ev, pev = arrays.choose_many(idx, avail, tt_end, np.random.default_rng(0))
+    now = dt.datetime.now()
+    for i, decider in enumerate(deciders):
+        cntxt = Cntxt()
+        cntxt.time = now
+        cntxt.session = Cntxt()
+        cntxt.session.end = now + dt.timedelta(seconds=int(tt_end[i]))
+        choice_evs, stu_pev = decider.calc_ev_dist(actions, {}, cntxt)
+        if [choice_evs[a.__name__]['ev'] for a in actions] != ev[i].tolist():
+            logger.error("Batch evs differ from decider %i: %s" % (i, str(decider)))
+    logger.info("Batch choices: %s" % str(np.bincount(choice, minlength=len(actions))))
+
+def test_state_snapshot():
+    logger.info("***** Testing learner state snapshots *****")
+    domain = Domain()
+    domain.generate_kcs(100)
+    stu = ModularLearner(domain, BinarySkillCognition(domain), DiligentDecider())
+    expected = dict(stu.skills)
+    state = stu.get_state()
+    for kc in domain.kcs:
+        stu.practice_skill(kc)
+    if dict(state['skills']) != expected:
+        logger.error("Snapshot changed with the learner's skills")
+    changed = sum(expected[kc_id] != val for kc_id, val in stu.skills.items())
+    if len(state['skills'].preserved) > changed:
+        logger.error("Snapshot copied %i skills but only %i changed" % (len(state['skills'].preserved), changed))
+    if dict(stu.get_state()['skills']) != dict(stu.skills):
+        logger.error("New snapshot does not match the learner's skills")
+    logger.info("Snapshot kept %i of %i skills mastered" % (state['skills'].count(1), len(state['skills'])))
+
+def test_truncnorm():
+    logger.info("***** Testing truncated normal sampling *****")
+    rng = make_stream(0)
+    # Bounds far in the tail where the old rejection loops rarely terminated
+    for mu, sd, low, high in [(0, 1, -1, 1), (0, 1, 40, float('inf')), (10, 1, -float('inf'), -30)]:
+        vals = [truncnorm(rng, mu, sd, low, high) for i in range(1000)]
+        batch = truncnorm_many(rng, mu, sd, low, high, size=1000)
+        if (min(vals) < low) or (max(vals) > high) or (batch.min() < low) or (batch.max() > high):
+            logger.error("Draws outside of [%s, %s]" % (str(low), str(high)))
+        logger.info("mu: %s sd: %s bounds: [%s, %s] mean: %f batch mean: %f" %
+                    (str(mu), str(sd), str(low), str(high), np.mean(vals), batch.mean()))
+
+def test_learner_schema():
+    logger.info("***** Testing schema based learner persistence *****")
+    domain = Domain()
+    domain.generate_kcs(100)
+    cog = BiasSkillCognition(domain, 0.5)
+    constructs = [Diligence(attrs={'diligence': 1.2}), DomainSelfEff(attrs={'self_eff': -0.3})]
+    stu = ModularLearner(domain, cog, DiligentDecider(constructs=constructs))
+    d = stu.to_dict()
+    logger.info("Learner document is %i bytes" % len(dill.dumps(d)))
+    out = ModularLearner.from_dict(d)
+    if dict(out.skills) != dict(stu.skills):
+        logger.error("Reloaded skills do not match")
+    if out.decider.to_dict() != stu.decider.to_dict():
+        logger.error("Reloaded decider does not match")
+    if [out.rng.random() for i in range(10)] != [stu.rng.random() for i in range(10)]:
+        logger.error("Reloaded random stream does not continue the learner's stream")
+    # Values other than the defaults are stored by their registered name
+    stu = ModularLearner(domain, cog, EVDecider(values={Attempt: lambda s,c: 4}))
+    try:
+        stu.to_dict()
+        logger.error("Decider with an unregistered attempt value was stored")
+    except ValueError:
+        pass
+    schema.register_ev_func('test_attempt_value', stu.decider.values[Attempt])
+    out = ModularLearner.from_dict(stu.to_dict())
+    if out.decider.values[Attempt] is not stu.decider.values[Attempt]:
+        logger.error("Reloaded decider lost its attempt value")
+    if out.decider.rng is not out.rng:
+        logger.error("Reloaded decider does not share the learner's random stream")
+    # Module level functions are stored by their import path
+    stu = ModularLearner(domain, cog, EVDecider(exp={Attempt: truncnorm}))
+    d = stu.to_dict()
+    if d['decider']['exps'] != {'Attempt': 'sampling.truncnorm:truncnorm'}:
+        logger.error("Attempt expectancy stored as %s" % str(d['decider'].get('exps')))
+    out = ModularLearner.from_dict(d)
+    if out.decider.exps[Attempt] is not truncnorm:
+        logger.error("Reloaded decider lost its attempt expectancy")
+
+def test_population():
+    logger.info("***** Testing vectorized student population generation *****")
+    domain = ContKCDomain()
+    domain.generate_kcs(50)
+    start = time.perf_counter()
+    pop = StudentPopulation(domain, 100000, seed=0, m_self_eff=0)
+    logger.info("Generated %i students in %f seconds" % (len(pop), time.perf_counter() - start))
+    shard = pop[500:600]
+    stu = shard[10]
+    if stu._id != pop[510]._id:
+        logger.error("Sliced population does not match the full population")
+    if dict(stu.skills) != dict(pop[510].skills):
+        logger.error("Materialized skills differ between accesses")
+    if stu.rng.seed_seq.spawn_key != spawn_seeds(0, 511)[510].spawn_key:
+        logger.error("Student stream is not seeded by its child of the population seed")
+    logger.info("Student 510 ability: %f diligence: %f" % (stu.cog.ability, stu.decider.constructs[Diligence].diligence))
+
+def test_trajectory():
+    logger.info("***** Testing recording of skill trajectories *****")
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    num_sessions = 5
+    sim_start = dt.datetime.now()
+    recorder = TrajectoryRecorder(db, every_steps=20)
+    students = []
+    for i in range(10):
+        cog = BiasSkillCognition(domain, random.triangular(-1, 1), rng=i)
+        decider = DiligentDecider(constructs=[Diligence(attrs={'diligence': random.gauss(0,1)})])
+        stu = ModularLearner(domain, cog, decider)
+        sim = SingleStudentSim(db, None, sim_start, stu, SimpleTutor(curric, stu._id, 0.9, i),
+                               num_sessions, 40, 8, 60, i, recorder=recorder)
+        sim.run_direct()
+        students.append(stu)
+
+    for stu in students:
+        traj = SkillTrajectory.from_dict(db.skill_trajectories.find_one({'_id': stu._id}))
+        skills = traj.to_array()
+        sessions, steps, times = traj.get_points()
+        if not np.array_equal(skills[-1], stu.skills.array):
+            logger.error("Last snapshot does not match the final skills of student %s" % stu._id)
+        if sessions[-1] != num_sessions:
+            logger.error("Trajectory ends at session %i instead of %i" % (sessions[-1], num_sessions))
+        logger.info("Student %s: %i snapshots over %i steps, %i kcs mastered" %
+                    (stu._id, len(traj), steps[-1], np.count_nonzero(skills[-1] >= 0.9)))
+    db_util.clear_db()
+
+def test_tuner_curves():
+    logger.info("***** Testing closed form domain tuner curves against simulated tuners *****")
+    domain = ContKCDomain()
+    domain.generate_kcs(5)
+    num_opps = 10
+    start = time.perf_counter()
+    curves = DomainTuner.expected_curves(domain, num_opps)
+    logger.info("Computed curves in %f seconds" % (time.perf_counter() - start))
+
+    class OppContext:
+        def __init__(self, kc, attempt):
+            self.kc = kc
+            self.attempt = attempt
+            self.time = None
+
+    num_students = 2000
+    correct = np.zeros((len(domain.kcs), num_opps))
+    for i in range(num_students):
+        stu = DomainTuner(domain)
+        for j, kc in enumerate(domain.kcs):
+            for n in range(num_opps):
+                act = stu.perform_action(Attempt, OppContext(kc, 0))
+                correct[j, n] += act.is_correct
+    err = np.abs(correct / num_students - curves.p_correct).max()
+    logger.info("Max difference of simulated and expected pct correct: %f" % err)
+    if err > 0.05:
+        logger.error("Simulated tuners do not match the expected curves")
+
+def test_navigation():
+    logger.info("***** Testing tutor navigation of a curriculum *****")
+    domain = Domain()
+    domain.generate_kcs(30)
+    curric = SimpleCurriculum(domain)
+    curric.generate(2, 3, 20)
+
+    tutor = SimpleTutor(curric, str(uuid.uuid4()), 0.9, 0)
+    t = dt.datetime.now()
+    tutor.login(ClassSession(t, t + dt.timedelta(hours=1), None), t)
+    visited = []
+    stale = 0
+    start = time.perf_counter()
+    while tutor.has_more():
+        state = tutor.state
+        visited.append((state.unit, state.section, state.problem, state.step))
+        tutor.process_input(Attempt(1, random.random() < 0.7), t)
+        unmastered = [kc for kc, plt in state.get_section_kc_mastery().items() if plt < tutor.mastery_thres]
+        stale += list(state.unmastered) != unmastered
+    logger.info("Completed %i step attempts in %f seconds" % (len(visited), time.perf_counter() - start))
+    if stale > 0:
+        logger.error("Unmastered kcs were out of sync with mastery after %i attempts" % stale)
+
+    units = list(dict.fromkeys(v[0] for v in visited))
+    if units != curric.units[:len(units)]:
+        logger.error("Units were not practiced in order")
+    # Each selected problem is worked through its steps in order and never selected again
+    steps = list(dict.fromkeys(v[3] for v in visited))
+    probs = [v[2] for v in visited]
+    runs = [p for i, p in enumerate(probs) if (i == 0) or (probs[i-1] is not p)]
+    if len(runs) != len(set(runs)):
+        logger.error("A problem was selected more than once")
+    for prob in set(runs):
+        prob_steps = [step for step in steps if step in prob.steps]
+        if prob_steps != prob.steps[:len(prob_steps)]:
+            logger.error("Steps of problem %s were not practiced in order" % prob._id)
+
+def test_bkt_replay():
+    logger.info("***** Testing replay of logged tutor inputs *****")
+    db, db_util, db_params = init_db()
+    domain, curric = gen_cont_curric(db, db_params)
+
+    sim_start = dt.datetime.now()
+    stu_ids = []
+    for i in range(10):
+        cog = BiasSkillCognition(domain, random.triangular(-1, 1), rng=i)
+        decider = DiligentDecider(constructs=[Diligence(attrs={'diligence': random.gauss(0,1)})])
+        stu = ModularLearner(domain, cog, decider)
+        sim = SingleStudentSim(db, None, sim_start, stu, SimpleTutor(curric, stu._id, 0.9, i),
+                               5, 40, 8, 60, i)
+        sim.run_direct()
+        stu_ids.append(stu._id)
+
+    start = time.perf_counter()
+    replayer = TutorReplayer.from_db(db, stu_ids)
+    replayed = replayer.replay()
+    logger.info("Replayed %i tutor inputs in %f seconds" % (len(replayed), time.perf_counter() - start))
+    if not (np.array_equal(replayed['plt'], replayer.tx['plt']) and np.array_equal(replayed['plt1'], replayer.tx['plt1'])):
+        logger.error("Replayed mastery does not match the logged mastery")
+
+    for pt in [0.1, 0.3]:
+        opps = TutorReplayer.opps_to_mastery(replayer.replay(pt=pt), 0.9)
+        logger.info("With pt %f, %i student kcs mastered after %f opportunities on average" %
+                    (pt, opps.count(), opps.mean()))
+    db_util.clear_db()
+
+def test_curriculum_bulk():
+    logger.info("***** Comparing bulk and one problem at a time curriculum generation *****")
+    domain_params = {'m_l0': 0.45, 'sd_l0': 0.155, 'm_l0_sd': 0.1, 'sd_l0_sd': 0.03,
+                     'm_t': 0.35, 'sd_t': 0.13, 'm_s': 0.105, 'sd_s': 0.055, 'm_g': 0.45, 'sd_g': 0.105}
+    for bulk in [False, True]:
+        domain = ContKCDomain()
+        domain.set_kc_hyperparams(**domain_params)
+        curric = CogTutorCurriculum(domain)
+        start = time.perf_counter()
+        curric.generate(num_units=10, num_practice=100, bulk=bulk)
+        elapsed = time.perf_counter() - start
+
+        probs = [prob for unit in curric.units for sect in unit.sections for prob in sect.problems]
+        for prob in probs:
+            if set(step.kcs[0] for step in prob.steps) != set(prob.kcs):
+                logger.error("Steps of problem %s do not cover its kcs" % prob._id)
+        num_probs = [len(sect.problems) / len(sect.kcs) for unit in curric.units for sect in unit.sections]
+        logger.info("bulk: %s\t%f sec\tproblems per kc: %f\tsteps per problem: %f\tkcs per problem: %f" %
+                    (bulk, elapsed, np.mean(num_probs), np.mean([len(p.steps) for p in probs]),
+                     np.mean([len(p.kcs) for p in probs])))
+
+def test_curriculum_store():
+    logger.info("***** Testing save and load of columnar curricula *****")
+    domain = ContKCDomain()
+    curric = CogTutorCurriculum(domain)
+    curric.generate(num_units=10, num_practice=100)
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        save_curriculum(curric, path)
+        logger.info("Saved curriculum in %f seconds" % (time.perf_counter() - start))
+        start = time.perf_counter()
+        loaded = load_curriculum(path)
+        logger.info("Loaded curriculum in %f seconds" % (time.perf_counter() - start))
+
+        def get_content(c):
+            return [(sect._id, [(prob._id, [(step._id, step.kcs[0]._id, step.m_time) for step in prob.steps])
+                                for prob in sect.problems])
+                    for unit in c.units for sect in unit.sections]
+        if get_content(loaded) != get_content(curric):
+            logger.error("Loaded curriculum content differs from the saved curriculum")
+        kc_params = lambda c: [(kc._id, kc.pl0, kc.pt, kc.ps, kc.pg, kc.pl0_sd) for kc in c.domain.kcs]
+        if kc_params(loaded) != kc_params(curric):
+            logger.error("Loaded kc parameters differ from the saved domain")
+        arrays = CurriculumArrays(path)
+        logger.info("Mean step time of %i memory mapped steps: %f" % (len(arrays['step_id']), arrays['step_m_time'].mean()))
+
 if __name__ == "__main__":
     # test_simple_tutor()
     #test_selfeff_learner()
     # test_modlearner()
     # test_biaslearner()
     test_timed_simulation()
+    # test_cohort_simulation()
+    # test_parallel_simulation()
+    # test_direct_executor()
+    # test_checkpoint_resume()
+    # test_stream_simulation()
+    # test_sequential_stopping()
+    # test_param_sweep()
+    # test_ev_kernel()
+    # test_choose_many()
+    # test_state_snapshot()
+    # test_truncnorm()
+    # test_learner_schema()
+    # test_population()
+    # test_trajectory()
+    # test_tuner_curves()
+    # test_navigation()
+    # test_bkt_replay()
+    # test_curriculum_bulk()
+    # test_curriculum_store()
@@ -9,6 +9,9 @@ logger = logging.getLogger(__name__)
 
 
 class Action:
+    # Slotted since an action is allocated for every simulated step
+
+    __slots__ = ('name', 'type', 'time')
 
     def __init__(self, time):
         self.name = None
@@ -19,18 +22,27 @@ class Action:
         return self.name
 
     def to_dict(self):
-        return self.__dict__
+        return {'name': self.name, 'type': self.type, 'time': self.time}
 
 
 class Attempt(Action):
 
+    __slots__ = ('is_correct',)
+
     def __init__(self, time, is_correct):
         super().__init__(time)
         self.name = "Attempt"
         self.is_correct = is_correct
 
+    def to_dict(self):
+        d = super().to_dict()
+        d['is_correct'] = self.is_correct
+        return d
+
 class FailedAttempt(Action):
 
+    __slots__ = ()
+
     def __init__(self, time):
         super().__init__(time)
         self.name = "Failed Attempt"
@@ -38,6 +50,8 @@ class FailedAttempt(Action):
 
 class HintRequest(Action):
 
+    __slots__ = ()
+
     def __init__(self, time):
         super().__init__(time)
         self.name = "Hint Request"
@@ -45,14 +59,23 @@ class HintRequest(Action):
 
 class Guess(Action):
 
+    __slots__ = ('is_correct',)
+
     def __init__(self, time, is_correct):
         super().__init__(time)
         self.name = "Guess"
         self.is_correct = is_correct
 
+    def to_dict(self):
+        d = super().to_dict()
+        d['is_correct'] = self.is_correct
+        return d
+
 
 class OffTask(Action):
 
+    __slots__ = ()
+
     def __init__(self, time):
         super().__init__(time)
         self.name = "Off Task"
@@ -60,6 +83,8 @@ class OffTask(Action):
 
 class StopWork(OffTask):
 
+    __slots__ = ()
+
     def __init__(self, time):
         super().__init__(time)
         self.name = "Stop Work"
@@ -0,0 +1,180 @@
+# Vectorized Bayesian knowledge tracing and replay of logged tutor inputs
+import logging
+
+import numpy as np
+import pandas as pd
+
+from tutor.kc_index import KCIndex
+
+logger = logging.getLogger(__name__)
+
+
+BKT_PARAMS = ('pl0', 'pt', 'ps', 'pg')
+
+
+def bkt_update(plt, is_correct, pt, ps, pg):
+    """
+    Mastery after an opportunity with the given outcome. Arguments
+    broadcast against each other. The arithmetic follows
+    SimpleTutor.update_skill so both give identical estimates
+
+    """
+    cor = plt * (1 - ps) / ((plt * (1 - ps)) + (1 - plt) * pg)
+    inc = plt * ps / ((plt * ps) + (1 - plt) * (1 - pg))
+    plt1_cond = np.where(is_correct, cor, inc)
+    return plt1_cond + (1 - plt1_cond) * pt
+
+
+def get_rounds(key):
+    """
+    Splits events into rounds so that the events sharing a key, e.g. a
+    student and kc, fall into successive rounds in their original order.
+    Returns event positions grouped by round and the bounds of each round
+
+    """
+    n = len(key)
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = sorted_key[1:] != sorted_key[:-1]
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n) - group_start
+    by_round = np.argsort(rank, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(rank))]) if n > 0 else np.zeros(1, dtype=int)
+    return by_round, bounds
+
+
+class BKTEngine:
+    """
+    Mastery estimates of a set of students for the kcs of a KCIndex,
+    updated from arrays of (student, kc, outcome) events. Parameters are
+    arrays in kc index order, so other parameters than the domain's can be
+    traced over the same events
+
+    """
+
+    def __init__(self, index, num_students, pl0, pt, ps, pg):
+        self.index = index
+        self.pl0, self.pt, self.ps, self.pg = [np.broadcast_to(np.asarray(p, dtype=float), (len(index),))
+                                               for p in (pl0, pt, ps, pg)]
+        self.mastery = np.tile(self.pl0, (num_students, 1))
+
+    @classmethod
+    def from_index(cls, index, num_students, **params):
+        # Parameters default to the kcs' own. Each override is a scalar or an array in index order
+        args = [params[name] if name in params else index.params(name) for name in BKT_PARAMS]
+        return cls(index, num_students, *args)
+
+    def update(self, stu, kc, is_correct, first=None):
+        """
+        Applies events in order and returns the mastery of each event's kc
+        before and after it. stu and kc are positions, and events with
+        first set to False, e.g. later attempts at a step, leave mastery
+        unchanged. Events of different students and kcs are updated
+        together, one round per opportunity
+
+        """
+        stu = np.asarray(stu, dtype=int)
+        kc = np.asarray(kc, dtype=int)
+        is_correct = np.asarray(is_correct, dtype=bool)
+        first = np.ones(len(stu), dtype=bool) if first is None else np.asarray(first, dtype=bool)
+
+        plt = np.empty(len(stu))
+        plt1 = np.empty(len(stu))
+        by_round, bounds = get_rounds(stu * len(self.index) + kc)
+        for r in range(len(bounds) - 1):
+            ev = by_round[bounds[r]:bounds[r+1]]
+            s, k = stu[ev], kc[ev]
+            cur = self.mastery[s, k]
+            new = bkt_update(cur, is_correct[ev], self.pt[k], self.ps[k], self.pg[k])
+            new = np.where(first[ev], new, cur)
+            self.mastery[s, k] = new
+            plt[ev] = cur
+            plt1[ev] = new
+        return plt, plt1
+
+    def is_mastered(self, thres):
+        return self.mastery >= thres
+
+
+class TutorReplayer:
+    """
+    Recomputes SimpleTutor mastery estimates from logged TutorInput events,
+    e.g. to study other BKT parameters or mastery thresholds without
+    rerunning simulations. Events are traced per student in time order
+    with the first kc of each step, and only first attempts update mastery,
+    hint requests counting as incorrect
+
+    """
+
+    def __init__(self, tx):
+        tx = pd.DataFrame(tx)
+        tx = tx[tx['type'] == 'TutorInput'] if 'type' in tx else tx
+        self.tx = tx.sort_values(['stu_id', 'time'], kind='stable')
+
+        kcs = self.tx['kcs'].map(lambda kcs: kcs[0])
+        self.kc_ids = kcs.map(lambda kc: kc['_id']).to_numpy()
+        self.stu_pos, self.stu_ids = pd.factorize(self.tx['stu_id'])
+        kc_pos, kc_ids = pd.factorize(self.kc_ids)
+        self.kc_pos = kc_pos
+        self.index = KCIndex.from_ids(kc_ids)
+        # Logged parameters of each kc, from its first event
+        first_kc = kcs.iloc[np.unique(kc_pos, return_index=True)[1]]
+        self.params = {name: first_kc.map(lambda kc: kc[name]).to_numpy(dtype=float) for name in BKT_PARAMS}
+
+    @classmethod
+    def from_db(cls, db, stu_ids=None):
+        query = {'type': 'TutorInput'}
+        if stu_ids is not None:
+            query['stu_id'] = {'$in': list(stu_ids)}
+        return cls(list(db.tutor_events.find(query)))
+
+    def get_params(self, overrides):
+        # Logged parameters with overrides given as scalars, arrays in kc order or dicts of kc id to value
+        params = {}
+        for name in BKT_PARAMS:
+            val = overrides.get(name)
+            if val is None:
+                params[name] = self.params[name]
+            elif isinstance(val, dict):
+                params[name] = self.params[name].copy()
+                params[name][self.index.get_positions(val.keys())] = list(val.values())
+            else:
+                params[name] = val
+        return params
+
+    def replay(self, **overrides):
+        """
+        Mastery before and after every event as columns plt and plt1 of the
+        events, with the logged kc parameters or the given overrides of
+        pl0, pt, ps and pg
+
+        """
+        params = self.get_params(overrides)
+        engine = BKTEngine(self.index, len(self.stu_ids), **params)
+        is_correct = (self.tx['outcome'] == 'Correct').to_numpy()
+        first = (self.tx['attempt'] == 0).to_numpy()
+        plt, plt1 = engine.update(self.stu_pos, self.kc_pos, is_correct, first)
+
+        out = pd.DataFrame({'stu_id': self.tx['stu_id'].to_numpy(),
+                            'kc': self.kc_ids,
+                            'time': self.tx['time'].to_numpy(),
+                            'attempt': self.tx['attempt'].to_numpy(),
+                            'outcome': self.tx['outcome'].to_numpy(),
+                            'plt': plt,
+                            'plt1': plt1},
+                           index=self.tx.index)
+        return out
+
+    @staticmethod
+    def opps_to_mastery(replayed, thres):
+        """
+        Number of first attempt opportunities of each student and kc until
+        the replayed mastery reached thres, NaN if it never did
+
+        """
+        opps = replayed[replayed['attempt'] == 0]
+        num = opps.groupby(['stu_id', 'kc']).cumcount() + 1
+        reached = num.where(opps['plt1'] >= thres)
+        return reached.groupby([opps['stu_id'], opps['kc']]).min()
@@ -1,6 +1,7 @@
 # Class definitions to support defining a simple curriculum for testing
 
 import logging
+import os
 import uuid
 from numpy import random as nprand
 import random
@@ -9,8 +10,71 @@ from .curriculum import *
 
 import numpy as np
 
+from sampling.truncnorm import truncnorm_many
+
 logger = logging.getLogger(__name__)
 
+
+def bulk_uuids(n):
+    # uuid4 strings formatted from one call for random bytes with the version and variant bits set
+    data = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    data[:, 6] = (data[:, 6] & 0x0f) | 0x40
+    data[:, 8] = (data[:, 8] & 0x3f) | 0x80
+    h = data.tobytes().hex()
+    return ['%s-%s-%s-%s-%s' % (h[i:i+8], h[i+8:i+12], h[i+12:i+16], h[i+16:i+20], h[i+20:i+32])
+            for i in range(0, 32 * n, 32)]
+
+
+def cover_probs(max_kcs, max_steps):
+    """
+    Table of the probability that the next step of a uniformly random
+    assignment of steps to kcs, conditioned on every kc getting a step,
+    goes to a kc without a step yet. Indexed by [kcs, steps left, kcs
+    without a step]. Built from the fraction of assignments of r steps to
+    k kcs that cover m given kcs:
+
+        g[k, r, m] = m/k * g[k, r-1, m-1] + (k-m)/k * g[k, r-1, m]
+
+    """
+    k = np.arange(max_kcs + 1)[:, None]
+    m = np.arange(max_kcs + 1)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_any = np.where(m <= k, m / k, 0)
+        p_stay = np.where(m <= k, (k - m) / k, 0)
+    g = np.zeros((max_kcs + 1, max_steps + 1, max_kcs + 1))
+    g[:, 0, 0] = 1
+    for r in range(1, max_steps + 1):
+        g[:, r, 1:] = p_any[:, 1:] * g[:, r-1, :-1]
+        g[:, r] += p_stay * g[:, r-1]
+    p_new = np.zeros_like(g)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_new[:, 1:, 1:] = np.nan_to_num(p_any[:, None, 1:] * g[:, :-1, :-1] / g[:, 1:, 1:])
+    return p_new
+
+
+def sample_surjections(num_steps, num_kcs):
+    """
+    Uniformly random assignments of each problem's num_steps steps to its
+    num_kcs kcs with every kc assigned at least one step, the distribution
+    of rejection sampling assignments until all kcs are covered. Kcs are
+    numbered by their first step. Returns problems x max steps kc numbers,
+    -1 past a problem's last step
+
+    """
+    num_probs = len(num_steps)
+    max_steps = num_steps.max() if num_probs > 0 else 0
+    p_new = cover_probs(num_kcs.max() if num_probs > 0 else 0, max_steps)
+    out = np.full((num_probs, max_steps), -1)
+    covered = np.zeros(num_probs, dtype=int)
+    for t in range(max_steps):
+        active = t < num_steps
+        left = np.where(active, num_steps - t, 0)
+        new = nprand.random(num_probs) < p_new[num_kcs, left, num_kcs - covered]
+        old = np.floor(nprand.random(num_probs) * covered).astype(int)
+        out[:, t] = np.where(active, np.where(new, covered, old), -1)
+        covered += new & active
+    return out
+
 class CogTutorCurriculum(Curriculum):
 
     def generate(self,
@@ -25,8 +89,11 @@ class CogTutorCurriculum(Curriculum):
                  stdev_steps=4,
                  mean_prob_kcs=6,
                  stdev_prob_kcs=3,
-                 mastery_thres=0.9
+                 mastery_thres=0.9,
+                 bulk=True
                  ):
+        # With bulk, problems are sampled in arrays by gen_section_problems_bulk. The one problem at
+        # a time generator draws differently from the same seed, so it is kept to rebuild old curricula
         logger.debug("Generating curriculum for %s" % type(self))
 
         self.gen_units(num_units, mean_sections, stdev_sections, mean_unit_kcs, stdev_unit_kcs, section_kcs_lambda, mastery_thres)
@@ -34,7 +101,10 @@ class CogTutorCurriculum(Curriculum):
 
         for unit in self.units:
             for section in unit.sections:
-                self.gen_section_problems(section, num_practice)
+                if bulk:
+                    self.gen_section_problems_bulk(section, num_practice)
+                else:
+                    self.gen_section_problems(section, num_practice)
 
         # self.gen_sections(num_sections)
 
@@ -119,3 +189,80 @@ class CogTutorCurriculum(Curriculum):
             logger.debug("Number of problems: %i" % len(section.problems))
 
             logger.debug("Total kcs: %i\tkcs with completed practice:\n %s" % (len(section.kcs), str(practice_counts)))
+
+    def sample_problems(self, section, num_probs):
+        """
+        Samples the sizes, kcs and step kcs of num_probs problems like
+        gen_section_problems. Returns each problem's steps, its kcs as
+        positions in section.kcs (problems x kcs, the first num_kcs in
+        sampled order) and the position of each step's kc (-1 past the
+        last step)
+
+        """
+        max_kcs = len(section.kcs)
+        # Rounds to at least 1 step
+        num_steps = np.rint(truncnorm_many(nprand, section.m_steps, section.sd_steps, 0.5, np.inf,
+                                           num_probs)).astype(int)
+        num_steps = np.maximum(num_steps, 1)
+        # Triangular on [1, num_steps] with mode num_steps by inverse cdf
+        num_kcs = np.rint(1 + (num_steps - 1) * np.sqrt(nprand.random(num_probs))).astype(int)
+        num_kcs = np.minimum(num_kcs, max_kcs)
+
+        # Random orders of the section kcs, the first num_kcs of each being a problem's sample
+        prob_kcs = np.argsort(nprand.random((num_probs, max_kcs)), axis=1)
+        slots = sample_surjections(num_steps, num_kcs)
+        rows = np.arange(num_probs)[:, None]
+        step_kcs = np.where(slots >= 0, prob_kcs[rows, np.maximum(slots, 0)], -1)
+        return num_steps, num_kcs, prob_kcs, step_kcs
+
+    def gen_section_problems_bulk(self, section, num_practice, batch_size=None):
+        """
+        Vectorized gen_section_problems with the same distribution of
+        problems. Problems are sampled in batches and kept up to the first
+        one after which every kc has num_practice steps, then built as
+        objects at the end
+
+        """
+        logger.debug("Generating %i practice opportunities per kc for section, %s" % (num_practice, section._id))
+        max_kcs = len(section.kcs)
+        if batch_size is None:
+            # Enough problems on average to finish most sections in one batch
+            batch_size = max(16, math.ceil(1.5 * max_kcs * num_practice / max(section.m_steps, 1)))
+
+        counts = np.zeros(max_kcs, dtype=int)
+        batches = []
+        while counts.min() < num_practice:
+            num_steps, num_kcs, prob_kcs, step_kcs = self.sample_problems(section, batch_size)
+            # Running practice counts of every kc after each problem
+            rows = np.broadcast_to(np.arange(batch_size)[:, None], step_kcs.shape)[step_kcs >= 0]
+            prob_counts = np.bincount(rows * max_kcs + step_kcs[step_kcs >= 0],
+                                      minlength=batch_size * max_kcs).reshape(batch_size, max_kcs)
+            cum = counts + np.cumsum(prob_counts, axis=0)
+            done = np.flatnonzero((cum >= num_practice).all(axis=1))
+            num = done[0] + 1 if len(done) > 0 else batch_size
+            # Step kcs of the kept problems in order, batches having different max steps
+            kept = step_kcs[:num]
+            batches.append((num_steps[:num], num_kcs[:num], prob_kcs[:num], kept[kept >= 0]))
+            counts = cum[num - 1]
+
+        num_steps, num_kcs, prob_kcs, step_kcs = [np.concatenate(x) for x in zip(*batches)]
+        kc_m_time = np.array([kc.m_time for kc in section.kcs], dtype=float)
+        kc_sd_time = np.array([kc.sd_time for kc in section.kcs], dtype=float)
+        m_time = np.rint(nprand.normal(kc_m_time[step_kcs], kc_sd_time[step_kcs])).astype(int)
+        sd_time = np.rint(m_time / 4).astype(int)
+
+        ids = bulk_uuids(len(num_steps) + len(step_kcs))
+        step_ids = ids[len(num_steps):]
+        s = 0
+        for i in range(len(num_steps)):
+            prob = Problem(self.domain_id, self._id, section.unit_id, section._id, ids[i])
+            prob.kcs = [section.kcs[j] for j in prob_kcs[i, :num_kcs[i]]]
+            for j in range(s, s + num_steps[i]):
+                step = Step(self.domain_id, self._id,
+                            section.unit_id, section._id, prob._id,
+                            int(m_time[j]), int(sd_time[j]), _id=step_ids[j])
+                step.kcs = [section.kcs[step_kcs[j]]]
+                prob.steps.append(step)
+            s += num_steps[i]
+            section.problems.append(prob)
+        logger.debug("Generated %i problems with %i steps" % (len(num_steps), len(step_kcs)))
@@ -5,6 +5,8 @@ import uuid
 import random
 import math
 
+from tutor.navigation import CurriculumIndex
+
 logger = logging.getLogger(__name__)
 
 class Curriculum:
@@ -15,6 +17,14 @@ class Curriculum:
         self.domain = domain
         self.domain_id = domain._id
         self.units = []
+        # Navigation index of the curriculum's content, built on first use
+        self.nav_index = None
+
+    def get_nav_index(self):
+        # Built once the curriculum is generated, so tutors share one index
+        if getattr(self, 'nav_index', None) is None:
+            self.nav_index = CurriculumIndex(self)
+        return self.nav_index
 
     def to_db_object(self):
         return {'_id': self._id,
@@ -81,8 +91,9 @@ class Problem:
                  curric_id,
                  unit_id,
                  section_id,
+                 _id=None
                  ):
-        self._id = str(uuid.uuid4())
+        self._id = str(uuid.uuid4()) if _id is None else _id
         self.domain_id = domain_id
         self.curric_id = curric_id
         self.unit_id = unit_id
@@ -111,8 +122,9 @@ class Step:
                  m_time=None,
                  sd_time=None,
                  hints=3,
+                 _id=None
                  ):
-        self._id = str(uuid.uuid4())
+        self._id = str(uuid.uuid4()) if _id is None else _id
         self.domain_id = domain_id
         self.curric_id = curric_id
         self.unit_id = unit_id
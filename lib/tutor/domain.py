@@ -4,6 +4,9 @@ import uuid
 import random
 import copy
 
+from sampling.truncnorm import truncnorm
+from tutor.kc_index import KCIndex
+
 logger = logging.getLogger(__name__)
 
 class KC:
@@ -52,6 +55,8 @@ class Domain:
         self._id = str(uuid.uuid4())
         self.type = type(self).__name__
         self.kcs = []
+        # Dense index of kc ids, built on first use
+        self.kc_index = None
         self.kc_hyperparams = {
                      'm_l0':None,
                      'sd_l0':None,
@@ -115,10 +120,8 @@ class Domain:
             elif pg >= 1:
                 pg = 0.99
 
-            m_time = -1
-            while m_time < 4:
-                m_time = random.gauss(self.kc_hyperparams['m_mt'],
-                                      self.kc_hyperparams['sd_mt'])
+            m_time = truncnorm(random, self.kc_hyperparams['m_mt'],
+                               self.kc_hyperparams['sd_mt'], low=4)
             sd_time = m_time/4
             kc = KC(self._id, pl0, pt, ps, pg, m_time, sd_time)
             logger.debug("KC: pl0: %f\tpt: %f\tpg: %f\tps: %f\tmtime: %f\t sdtime: %f" % (kc.pl0, kc.pt, kc.ps, kc.pg, kc.m_time, kc.sd_time))
@@ -134,8 +137,14 @@ class Domain:
                   'kc_hyperparms': self.kc_hyperparams
                   })
 
+    def get_kc_index(self):
+        # Kcs added since the index was built get a new index so arrays over the old one keep their length
+        if (getattr(self, 'kc_index', None) is None) or (len(self.kc_index) != len(self.kcs)):
+            self.kc_index = KCIndex(self.kcs)
+        return self.kc_index
+
     def to_dict(self):
-        d = copy.deepcopy(self.__dict__)
+        d = copy.deepcopy({k: v for k, v in self.__dict__.items() if k not in ('kcs', 'kc_index')})
         d['kcs'] = [kc._id for kc in self.kcs]
         return d
 
@@ -166,32 +175,18 @@ class ContKCDomain(Domain):
         kcs = []
         for i in range(n):
             logger.debug("Generating kc #%i" % i)
-            pl0 = -1
-            while not ((pl0 >= 0) and (pl0 <= 1)):
-                pl0 = random.gauss(self.kc_hyperparams['m_l0'], 
-                                   self.kc_hyperparams['sd_l0'])
-        
-            pl0_sd = 0
-            while pl0_sd <= 0:
-                pl0_sd = random.gauss(self.kc_hyperparams['m_l0_sd'],
-                                      self.kc_hyperparams['m_l0_sd'])
-            pt = -1
-            while (pt <= 0) or (pt > 1):
-                pt = random.gauss(self.kc_hyperparams['m_t'], 
-                                  self.kc_hyperparams['sd_t'])
-            ps = -1
-            while (ps <= 0) or (ps > 1):
-                ps = random.gauss(self.kc_hyperparams['m_s'], 
-                                  self.kc_hyperparams['sd_s'])
-            pg = -1
-            while (pg <= 0) or (pg > 1):
-                pg = random.gauss(self.kc_hyperparams['m_g'], 
-                                  self.kc_hyperparams['sd_g'])
-            
-            m_time = -1
-            while m_time < 0:
-                m_time = random.gauss(self.kc_hyperparams['m_mt'],
-                                      self.kc_hyperparams['sd_mt'])
+            pl0 = truncnorm(random, self.kc_hyperparams['m_l0'],
+                            self.kc_hyperparams['sd_l0'], 0, 1)
+            pl0_sd = truncnorm(random, self.kc_hyperparams['m_l0_sd'],
+                               self.kc_hyperparams['m_l0_sd'], low=0)
+            pt = truncnorm(random, self.kc_hyperparams['m_t'],
+                           self.kc_hyperparams['sd_t'], 0, 1)
+            ps = truncnorm(random, self.kc_hyperparams['m_s'],
+                           self.kc_hyperparams['sd_s'], 0, 1)
+            pg = truncnorm(random, self.kc_hyperparams['m_g'],
+                           self.kc_hyperparams['sd_g'], 0, 1)
+            m_time = truncnorm(random, self.kc_hyperparams['m_mt'],
+                               self.kc_hyperparams['sd_mt'], low=0)
             sd_time = m_time/4
             kc = ContKC(self._id, pl0, pl0_sd, pt, ps, pg, m_time, sd_time)
             logger.debug("KC: pl0: %f\tpl0_sd: %f\tpt: %f\tpg: %f\tps: %f\tmtime: %f\t sdtime: %f" % (kc.pl0, kc.pl0_sd, kc.pt, kc.ps, kc.pg, kc.m_time, kc.sd_time))
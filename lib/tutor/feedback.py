@@ -5,6 +5,9 @@ import uuid
 logger = logging.getLogger(__name__)
 
 class Feedback:
+    # Slotted since feedback is allocated for every tutored step
+
+    __slots__ = ('type', 'action', 'msg')
 
     def __init__(self, action):
         self.type = type(self).__name__
@@ -15,20 +18,29 @@ class Feedback:
         return str(self.to_dict())
 
     def to_dict(self):
-        return self.__dict__
+        return {'type': self.type, 'action': self.action, 'msg': self.msg}
 
 
 class AttemptResponse(Feedback):
 
+    __slots__ = ('is_correct',)
+
     def __init__(self, action, is_correct, msg=""):
         super().__init__(action)
         # self.type = "Attempt Response"
         self.is_correct = is_correct
         self.msg = msg
 
+    def to_dict(self):
+        d = super().to_dict()
+        d['is_correct'] = self.is_correct
+        return d
+
 
 class HintResponse(Feedback):
 
+    __slots__ = ('hint_num', 'hint_remain')
+
     def __init__(self, action, hint_num, hint_remain, msg=""):
         super().__init__(action)
         # self.type = "Hint Response"
@@ -36,3 +48,9 @@ class HintResponse(Feedback):
         self.hint_remain = hint_remain
         self.msg = msg
 
+    def to_dict(self):
+        d = super().to_dict()
+        d['hint_num'] = self.hint_num
+        d['hint_remain'] = self.hint_remain
+        return d
+
@@ -0,0 +1,240 @@
+# Dense integer index of a domain's kcs and kc keyed arrays
+import logging
+import weakref
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class KCIndex:
+    """
+    Maps the ids of a domain's kcs to dense integer positions, in the order
+    the kcs were added to the domain. Built once per domain (see
+    Domain.get_kc_index) and shared by every skill and mastery array of
+    that domain so they line up position for position. An index is never
+    extended, kcs added to the domain later get a new index
+
+    """
+
+    def __init__(self, kcs=[]):
+        self.kcs = []
+        self.ids = []
+        self.pos = {}
+        for kc in kcs:
+            if kc._id not in self.pos:
+                self.pos[kc._id] = len(self.ids)
+                self.ids.append(kc._id)
+                self.kcs.append(kc)
+
+    @classmethod
+    def from_ids(cls, ids):
+        # Index of kc ids without their kc objects, e.g. when loading stored skills
+        out = cls()
+        for kc_id in ids:
+            out.pos[kc_id] = len(out.ids)
+            out.ids.append(kc_id)
+            out.kcs.append(None)
+        return out
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_pos(self, key):
+        # Position of a kc given the kc or its id
+        if isinstance(key, str):
+            return self.pos[key]
+        return self.pos[key._id]
+
+    def get_positions(self, keys):
+        return np.array([self.get_pos(key) for key in keys], dtype=int)
+
+    def params(self, name):
+        # Array of a kc parameter, e.g. 'pl0', in index order
+        return np.array([getattr(kc, name) for kc in self.kcs], dtype=float)
+
+
+class KCArray(MutableMapping):
+    """
+    Mapping from kcs to values stored in a numpy array ordered by a
+    KCIndex. Keys can be kcs or kc ids. Iterates over kc ids, or over the
+    kc objects when by_kc is set, so it can stand in for the dicts of
+    learner skills and tutor mastery while counts, updates and
+    serialization work on the whole array at once
+
+    """
+
+    def __init__(self, index, array=None, dtype=float, by_kc=False):
+        self.index = index
+        if array is None:
+            array = np.zeros(len(index), dtype=dtype)
+        else:
+            array = np.asarray(array, dtype=dtype)
+        if len(array) != len(index):
+            raise ValueError("Array of %i values does not match index of %i kcs" % (len(array), len(index)))
+        self.array = array
+        self.by_kc = by_kc
+        # Weak references to snapshots that may still be alive
+        self.views = []
+
+    @classmethod
+    def from_dict(cls, index, d, dtype=None, by_kc=False):
+        # Values of a dict keyed by kc or kc id. Kcs missing from d are left as 0
+        if dtype is None:
+            dtype = np.asarray(list(d.values())).dtype if len(d) > 0 else float
+        out = cls(index, dtype=dtype, by_kc=by_kc)
+        if len(d) > 0:
+            out.array[index.get_positions(d.keys())] = list(d.values())
+        return out
+
+    def __getitem__(self, key):
+        return self.array[self.index.get_pos(key)].item()
+
+    def __setitem__(self, key, val):
+        pos = self.index.get_pos(key)
+        if len(self.views) > 0:
+            self.preserve(pos)
+        self.array[pos] = val
+
+    def preserve(self, pos):
+        # Called before a position is written so live snapshots keep its old value
+        alive = []
+        for ref in self.views:
+            view = ref()
+            if view is not None:
+                view.preserve(pos, self.array[pos])
+                alive.append(ref)
+        self.views = alive
+
+    def set_array(self, array):
+        # Overwrite every value, e.g. from a cohort's skill matrix. Live snapshots get their own copy first
+        for ref in self.views:
+            view = ref()
+            if view is not None:
+                view.detach()
+        self.views = []
+        self.array[:] = array
+
+    def __delitem__(self, key):
+        raise TypeError("Kcs can not be removed from a KCArray")
+
+    def __contains__(self, key):
+        try:
+            self.index.get_pos(key)
+        except (KeyError, AttributeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.index.kcs if self.by_kc else self.index.ids)
+
+    def __len__(self):
+        return len(self.array)
+
+    def keys(self):
+        return list(self.index.kcs if self.by_kc else self.index.ids)
+
+    def values(self):
+        return self.array.tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.array.tolist()))
+
+    def count(self, thres):
+        # Number of kcs with values at or above thres
+        return int(np.count_nonzero(self.array >= thres))
+
+    def total(self):
+        return self.array.sum().item()
+
+    def mean(self):
+        return self.array.mean().item()
+
+    def copy(self):
+        return KCArray(self.index, self.array.copy(), self.array.dtype, self.by_kc)
+
+    def snapshot(self):
+        # Read only copy-on-write view, e.g. of a learner's skills for a decision context
+        view = KCArrayView(self)
+        self.views = [ref for ref in self.views if ref() is not None]
+        self.views.append(weakref.ref(view))
+        return view
+
+    def __getstate__(self):
+        # Snapshots are not part of the array's persisted state
+        state = self.__dict__.copy()
+        state['views'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.views = []
+
+    def to_dict(self):
+        # Plain dict of kc ids to python scalars, e.g. for a db document
+        return dict(zip(self.index.ids, self.array.tolist()))
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class KCArrayView(Mapping):
+    """
+    Read only view of a KCArray as of when KCArray.snapshot took it.
+    Taking the view copies nothing. Before the array writes a position, it
+    hands the view the old value, so the view only holds the values changed
+    during its lifetime and reads everything else from the live array
+
+    """
+
+    def __init__(self, live):
+        self.live = live
+        # Values as of the snapshot of positions written since, keyed by position
+        self.preserved = {}
+
+    def preserve(self, pos, val):
+        if pos not in self.preserved:
+            self.preserved[pos] = val
+
+    def detach(self):
+        # Copy the values so the view no longer depends on the live array
+        self.live = self.copy()
+        self.preserved = {}
+
+    def __getitem__(self, key):
+        pos = self.live.index.get_pos(key)
+        if pos in self.preserved:
+            return self.preserved[pos].item()
+        return self.live.array[pos].item()
+
+    def __contains__(self, key):
+        return key in self.live
+
+    def __iter__(self):
+        return iter(self.live)
+
+    def __len__(self):
+        return len(self.live)
+
+    def count(self, thres):
+        return self.copy().count(thres)
+
+    def copy(self):
+        # KCArray of the values as of the snapshot
+        out = self.live.copy()
+        for pos, val in self.preserved.items():
+            out.array[pos] = val
+        return out
+
+    def to_dict(self):
+        return self.copy().to_dict()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return (KCArray, (self.live.index, self.copy().array, self.live.array.dtype, self.live.by_kc))
+
+    def __repr__(self):
+        return repr(self.to_dict())
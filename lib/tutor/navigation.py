@@ -0,0 +1,148 @@
+# Navigation index of a curriculum for selecting a student's next problem and step
+import logging
+import bisect
+
+logger = logging.getLogger(__name__)
+
+
+class SectionIndex:
+    """
+    Problems of a section by position with, for every kc, the sorted
+    positions of the problems that practice it
+
+    """
+
+    def __init__(self, section):
+        self.section = section
+        self.problems = list(section.problems)
+        self.kc_probs = {}
+        # Positions of each problem, which can appear more than once in a section
+        self.prob_pos = {}
+        for i, prob in enumerate(self.problems):
+            self.prob_pos.setdefault(prob, []).append(i)
+            for kc in dict.fromkeys(prob.kcs):
+                self.kc_probs.setdefault(kc, []).append(i)
+
+
+class CurriculumIndex:
+    """
+    Navigation index built once per curriculum (see
+    Curriculum.get_nav_index) and shared by all tutors of that curriculum.
+    The per student position in it is kept in a NavCursor
+
+    """
+
+    def __init__(self, curric):
+        self.units = list(curric.units)
+        self.sections = [[SectionIndex(sect) for sect in unit.sections] for unit in self.units]
+
+    def get_section(self, cursor):
+        return self.sections[cursor.unit_pos][cursor.sect_pos]
+
+
+class NavCursor:
+    """
+    A student's position in a CurriculumIndex and the problems of the
+    current section still available to them. Available positions per kc
+    are copied from the section index the first time a problem practicing
+    that kc is taken
+
+    """
+
+    def __init__(self):
+        self.unit_pos = -1
+        self.sect_pos = -1
+        self.step_pos = -1
+        self.avail = {}
+
+    def next_unit(self, index):
+        # Move to the next unit, returning False past the last unit
+        if self.unit_pos + 1 >= len(index.units):
+            return False
+        self.unit_pos += 1
+        self.sect_pos = -1
+        return True
+
+    def next_section(self, index):
+        # Move to the next section of the unit, returning False past its last section
+        if self.sect_pos + 1 >= len(index.sections[self.unit_pos]):
+            return False
+        self.sect_pos += 1
+        self.step_pos = -1
+        self.avail = {}
+        return True
+
+    def get_avail(self, index, kc):
+        # Sorted positions of the section's problems practicing kc that were not taken yet
+        if kc in self.avail:
+            return self.avail[kc]
+        return index.get_section(self).kc_probs.get(kc, [])
+
+    def take(self, index, pos):
+        # Take the problem at pos, removing all its positions from the available problems of its kcs
+        sect = index.get_section(self)
+        prob = sect.problems[pos]
+        for kc in dict.fromkeys(prob.kcs):
+            if kc not in self.avail:
+                self.avail[kc] = list(sect.kc_probs[kc])
+            avail = self.avail[kc]
+            for p in sect.prob_pos[prob]:
+                i = bisect.bisect_left(avail, p)
+                if (i < len(avail)) and (avail[i] == p):
+                    del avail[i]
+        self.step_pos = -1
+        return prob
+
+    def next_step(self, prob):
+        # Move to the next step of the problem, returning None past its last step
+        if self.step_pos + 1 >= len(prob.steps):
+            return None
+        self.step_pos += 1
+        return prob.steps[self.step_pos]
+
+
+class UnmasteredKCs:
+    """
+    Live set of the current section's kcs whose mastery is below the
+    tutor's mastery threshold, kept as sorted positions in the section's
+    kc order. Updated by the tutor whenever a kc's mastery changes, so
+    sampling a target kc indexes the list instead of filtering every
+    section kc's mastery
+
+    """
+
+    def __init__(self, section, mastery, thres):
+        self.kcs = list(dict.fromkeys(section.kcs))
+        self.pos = {kc: i for i, kc in enumerate(self.kcs)}
+        self.thres = thres
+        self.unmastered = [i for i, kc in enumerate(self.kcs) if mastery[kc] < thres]
+
+    def __len__(self):
+        return len(self.unmastered)
+
+    def __iter__(self):
+        return (self.kcs[i] for i in self.unmastered)
+
+    def __contains__(self, kc):
+        i = self.pos.get(kc)
+        if i is None:
+            return False
+        j = bisect.bisect_left(self.unmastered, i)
+        return (j < len(self.unmastered)) and (self.unmastered[j] == i)
+
+    def update(self, kc, plt):
+        # Add or remove kc given its new mastery, ignoring kcs outside the section
+        i = self.pos.get(kc)
+        if i is None:
+            return
+        j = bisect.bisect_left(self.unmastered, i)
+        present = (j < len(self.unmastered)) and (self.unmastered[j] == i)
+        if plt < self.thres:
+            if not present:
+                self.unmastered.insert(j, i)
+        elif present:
+            del self.unmastered[j]
+
+    def choice(self, rng):
+        # Random unmastered kc, drawn like rng.choice over the unmastered kcs in section order
+        return self.kcs[rng.choice(self.unmastered)]
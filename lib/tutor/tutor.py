@@ -13,18 +13,23 @@ from .session import Session
 from .feedback import *
 from log_db.tutor_log import TutorInput, SessionStart, SessionEnd
 from log_db import mongo
+from sampling.rng import make_stream
+from tutor.kc_index import KCArray
+from tutor.navigation import NavCursor, UnmasteredKCs
 
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
 class Tutor:
 
-    def __init__(self, curric, stu_id, mastery_thres=0.9):
+    def __init__(self, curric, stu_id, mastery_thres=0.9, rng=None):
         self._id = str(uuid.uuid4())
         self.curric = curric
         self.stu_id = stu_id
         self.mastery_thres = mastery_thres
         self.state = None
+        # Tutor specific random stream
+        self.rng = make_stream(rng)
 
         self.init_student_model()
         self.init_tutor()
@@ -39,13 +44,13 @@ class Tutor:
     def login(self, session, time):
         logger.debug(f"Logging start of new session: {time}")
         tx = SessionStart(stu_id=self.stu_id, session_id=session._id, time=time)
-        logger.debug(f"session start: {str(tx.to_dict())}")
+        logger.debug("session start: %s", tx)
         return tx
 
     def logout(self, session, time):
         logger.debug("Logging end of session")
         tx = SessionEnd(stu_id=self.stu_id, session_id=session._id, time=time)
-        logger.debug(f"session end: {tx.__dict__}")
+        logger.debug("session end: %s", tx)
         return tx
 
     def process_input(self, inpt, time):
@@ -73,19 +78,19 @@ class Tutor:
 
 class SimpleTutor(Tutor):
 
-    def __init__(self, curric, stu_id, mastery_thres=0.9):
-        super().__init__(curric, stu_id, mastery_thres)
+    def __init__(self, curric, stu_id, mastery_thres=0.9, rng=None):
+        super().__init__(curric, stu_id, mastery_thres, rng)
 
     def init_student_model(self):
         self.state = SimpleTutorState()
-        stu_mdl = {kc: kc.pl0 for kc in self.curric.domain.kcs}
-        self.state.mastery = stu_mdl
+        index = self.curric.domain.get_kc_index()
+        self.state.mastery = KCArray(index, index.params('pl0'), by_kc=True)
 
     def init_tutor(self):
-        try:
-            self.set_next_unit()
-        except Exception as e:
-            logger.warning(f"Error while initializing tutor: {str(e)}")
+        self.nav = self.curric.get_nav_index()
+        if not self.set_next_unit():
+            logger.warning("Curriculum has no problems to practice")
+            self.state.is_done = True
        
     def login(self, session, time):
         tx = super().login(session, time)
@@ -110,15 +115,7 @@ class SimpleTutor(Tutor):
             logger.debug("Is not first attempt")
 
         plt1 = self.state.mastery[kc]
-        tx = self.log_input(time, inpt, plt, plt1)
-        self.state.attempt = self.state.attempt + 1
-        
-        # Increment step or problem if problem is complete
-        if inpt.is_correct:
-            self.update_state()
-
-        fdbk = AttemptResponse(inpt.name, inpt.is_correct)
-        return fdbk, tx
+        return self.record_input(inpt, time, plt, plt1)
 
     def process_hint(self, inpt, time):
         logger.debug("Processing student hint request")
@@ -134,49 +131,47 @@ class SimpleTutor(Tutor):
             logger.debug("Is not first attempt")
 
         plt1 = self.state.mastery[kc]
+        return self.record_input(inpt, time, plt, plt1)
+
+    def record_input(self, inpt, time, plt, plt1):
+        """
+        Logs an attempt, guess or hint request on the current step whose
+        mastery update from plt to plt1 was already made, e.g. by
+        process_attempt or in bulk by a cohort simulation, and advances the
+        step. Returns the feedback and the logged transaction
+
+        """
+        self.refresh_mastery(self.state.step.kcs[0])
         tx = self.log_input(time, inpt, plt, plt1)
         self.state.attempt = self.state.attempt + 1
 
-        if self.state.hints_avail > 0: 
-            self.state.hints_used = self.state.hints_used + 1
-            self.state.hints_avail = self.state.hints_avail - 1
-        else:
-            logger.debug("No additional hints available")
-        
-        hint_msg = "Hint #%i" % self.state.hints_used
-        fdbk = HintResponse(inpt.name, self.state.hints_used, self.state.hints_avail, hint_msg)
+        if isinstance(inpt, action.HintRequest):
+            if self.state.hints_avail > 0: 
+                self.state.hints_used = self.state.hints_used + 1
+                self.state.hints_avail = self.state.hints_avail - 1
+            else:
+                logger.debug("No additional hints available")
+            
+            hint_msg = "Hint #%i" % self.state.hints_used
+            fdbk = HintResponse(inpt.name, self.state.hints_used, self.state.hints_avail, hint_msg)
+            return fdbk, tx
+
+        # Increment step or problem if problem is complete
+        if inpt.is_correct:
+            self.update_state()
+
+        fdbk = AttemptResponse(inpt.name, inpt.is_correct)
         return fdbk, tx
 
     def update_state(self):
         ### Update the tutor after completing a problem-step
-        
-        # Mark step as completed
-        self.state.completed[self.state.unit][self.state.section][self.state.problem][self.state.step] = True
-        # Increment step or problem if problem is complete
-        completed_steps = self.state.completed[self.state.unit][self.state.section][self.state.problem]
-        avail_steps = [step for step in self.state.problem.steps if step not in completed_steps]
-        if len(avail_steps) > 0:
-            self.set_next_step()
-        else:
-            try:
-                self.set_next_prob()
-                return
-            except Exception as e:
-                logger.debug(e)
-
-            try:
-                self.set_next_section()
-                return
-            except Exception as e:
-                logger.debug(e)
-
-            try:
-                self.set_next_unit()
-                return
-            except Exception as e:
-                logger.debug(e)
-                logger.debug("Completed last unit. No more units in curriculum")
-                self.state.is_done = True
+        # Move to the next step, else the next problem, section or unit
+        if self.set_next_step():
+            return
+        if self.set_next_prob() or self.set_next_section() or self.set_next_unit():
+            return
+        logger.debug("Completed last unit. No more units in curriculum")
+        self.state.is_done = True
 
 
     def has_more(self):
@@ -191,94 +186,71 @@ class SimpleTutor(Tutor):
         
 
     def set_next_unit(self):
-        # logger.info("Beginning next unit")
-        compl_units = self.state.completed.keys()
-        avail_units = [unit for unit in self.curric.units if unit not in compl_units]
-        logger.debug("available units: %s" % str(avail_units))
-        if len(avail_units) > 0:
-            next_unit = avail_units[0]
-            self.state.unit = next_unit
-            self.state.section = None
-            self.state.problem = None
-            self.state.step = None
-            self.state.completed[next_unit] = {} 
-            self.set_next_section()
-            return True
-        else:
-            raise Exception("No additional units available")
+        # Start the next unit. Returns False if there are no more units or the
+        # new unit has no sections with problems to practice
+        cursor = self.state.nav
+        if not cursor.next_unit(self.nav):
+            logger.debug("No additional units available")
             return False
+        self.state.unit = self.nav.units[cursor.unit_pos]
+        self.state.section = None
+        self.state.problem = None
+        self.state.step = None
+        return self.set_next_section()
 
     def set_next_section(self):
-        # if self.state.unit == None:
-            # logger.debug("No unit currently set. Setting unit before setting section")
-            # self.set_next_unit()
-        compl_sections = self.state.completed[self.state.unit].keys()
-        # logger.debug(f"Num of sections: {len(compl_sections)}")
-        avail_sections = [sect for sect in self.state.unit.sections if sect not in compl_sections]
-        # logger.debug(f"Num of avail sections: {len(avail_sections)}")
-        while len(avail_sections) > 0:
-            next_sect = avail_sections[0]
-            self.state.section = next_sect
+        # Start the next section of the unit with problems to practice. Returns False if there is none
+        cursor = self.state.nav
+        while cursor.next_section(self.nav):
+            self.state.section = self.nav.get_section(cursor).section
+            self.state.unmastered = UnmasteredKCs(self.state.section, self.state.mastery, self.mastery_thres)
             self.state.problem = None
             self.state.step = None
-            self.state.completed[self.state.unit][self.state.section] = {}
-            try:
-                self.set_next_prob()
-                return
-            except Exception as e:
-                logger.debug("Next section has no problems to complete")
-                compl_sections = self.state.completed[self.state.unit].keys()
-                avail_sections = [sect for sect in self.state.unit.sections if sect not in compl_sections]
-
-        raise Exception("No additional sections available in this unit")
+            if self.set_next_prob():
+                return True
+            logger.debug("Next section has no problems to complete")
+        logger.debug("No additional sections available in this unit")
+        return False
 
     def set_next_prob(self):
-        sect_kcs = self.state.get_section_kc_mastery()
-        avail_kcs = self.get_unmastered_kcs()
-        if len( avail_kcs) > 0:
-            target_kc = random.choice(list(avail_kcs.keys()))
-            logger.debug("Total section kcs: %i\tUnmastered kcs: %i\ttarget kc: %s" % (len(sect_kcs), len(avail_kcs), str(target_kc._id)))
-        else:
-            raise Exception("Mastered all kcs. No additional problems to complete for this section")
+        # Start a problem practicing a random unmastered kc of the section. Returns False if
+        # all section kcs are mastered or the target kc has no problems left
+        avail_kcs = self.state.unmastered
+        if len(avail_kcs) == 0:
+            logger.debug("Mastered all kcs. No additional problems to complete for this section")
             return False
-                    
-        avail_probs = [prob for prob in self.state.section.problems if ((target_kc in prob.kcs) and (prob not in self.state.completed[self.state.unit][self.state.section]))]
+        target_kc = avail_kcs.choice(self.rng)
+        logger.debug("Unmastered kcs: %i\ttarget kc: %s" % (len(avail_kcs), str(target_kc._id)))
+
+        cursor = self.state.nav
+        avail_probs = cursor.get_avail(self.nav, target_kc)
         logger.debug("Current have %i available problems" % len(avail_probs))
-        if len(avail_probs) > 0:
-            prob = random.choice(avail_probs)
-            self.state.problem = prob
-            self.state.step = None
-            self.state.completed[self.state.unit][self.state.section][self.state.problem] = {}
-            logger.debug("Selected problem: %s" % str(prob))
-            self.set_next_step()
-            return True
-        else:
-            logger.debug("Finished with section. Advancing to next section")
-            raise Exception("No additional problems available in this section")
-            # self.set_next_section()
+        if len(avail_probs) == 0:
+            logger.debug("No additional problems available in this section")
             return False
-
+        prob = cursor.take(self.nav, self.rng.choice(avail_probs))
+        self.state.problem = prob
+        self.state.step = None
+        logger.debug("Selected problem: %s" % str(prob))
+        return self.set_next_step()
 
     def set_next_step(self):
-        if self.state.problem is not None:
-            avail_steps = [step for step in self.state.problem.steps if step not in self.state.completed[self.state.unit][self.state.section][self.state.problem]]
-            if len(avail_steps) > 0:
-                # Steps are in order of expected completion, so set the next step in the list by default
-                self.state.step = avail_steps[0]
-                self.state.hints_avail = self.state.step.hints_avail
-                self.state.hints_used = 0
-                self.state.attempt = 0
-                self.state.completed[self.state.unit][self.state.section][self.state.problem][self.state.step] = False
-            else:
-                raise Exception("no additional steps available")
-        else:
-            raise Exception("Cannot set next step if problem is not set")
+        # Steps are in order of expected completion. Returns False after the last step of the problem
+        if self.state.problem is None:
+            return False
+        step = self.state.nav.next_step(self.state.problem)
+        if step is None:
+            return False
+        self.state.step = step
+        self.state.hints_avail = step.hints_avail
+        self.state.hints_used = 0
+        self.state.attempt = 0
+        return True
 
 
     def get_unmastered_kcs(self):
         if self.state.section is not None:
-            kcs = self.state.get_section_kc_mastery()
-            return {kc: pl0 for kc, pl0 in kcs.items() if pl0 < self.mastery_thres}
+            return {kc: self.state.mastery[kc] for kc in self.state.unmastered}
         else:
             logger.error("Cannot get list of mastered kcs because section is not specified")
             raise Exception("Cannot get list of mastered kcs because section is not specified")
@@ -293,12 +265,19 @@ class SimpleTutor(Tutor):
             plt1_cond = plt * kc.ps / ((plt * kc.ps) + (1 - plt) * (1 -kc.pg))
         plt1 = plt1_cond + (1 - plt1_cond) * kc.pt
         self.state.mastery[kc] = plt1
+        self.refresh_mastery(kc)
         logger.debug("Outcome: %s\tPrior plt: %f\t updated plt: %f" % (str(is_correct), plt, plt1))
         # else:
             # # Hack for mastery learning to not allow student regression
             # logger.debug("Not updating skill because already past mastery threshold")
 
 
+    def refresh_mastery(self, kc):
+        # Keep the section's unmastered kcs in sync after kc's mastery is updated,
+        # e.g. by update_skill or in bulk by a cohort simulation
+        if self.state.unmastered is not None:
+            self.state.unmastered.update(kc, self.state.mastery[kc])
+
     def log_input(self, time, inpt, plt, plt1):
         if isinstance(inpt, action.Attempt) or isinstance(inpt, action.Guess):
             logger.debug("Logging student attempt")
@@ -336,7 +315,7 @@ class SimpleTutor(Tutor):
         self.state.last_tx_time = time
             
         # tx._id = self.db.tutor_events.insert_one(tx.to_dict()).inserted_id
-        logger.debug("User Transaction: %s" % tx)
+        logger.debug("User Transaction: %s", tx)
 
         return tx
  
@@ -345,11 +324,13 @@ class SimpleTutor(Tutor):
 class SimpleTutorState:
 
     def __init__(self):
-        # Tracking completed content in curriculum
-        self.completed = {}
+        # Position in the curriculum and problems left in the current section
+        self.nav = NavCursor()
         # Tracking mastery of all skills within domain
         self.session = None
         self.mastery = {}
+        # Unmastered kcs of the current section
+        self.unmastered = None
         self.unit = None
         self.section = None
         self.problem = None